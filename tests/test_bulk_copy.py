@@ -0,0 +1,101 @@
+import csv
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Boolean, Date
+
+from tulsa.bulk_copy import (NULL_STR, array_literal, copy_df_to_connection,
+                             object_column_types, write_copy_csv)
+
+
+def test_object_column_types_use_all_values():
+    df = pd.DataFrame({'entry_date': [datetime.date(2015, 8, 1), None],
+                       'enrolled': [True, None],
+                       'comment': ['new', None],
+                       'mixed': [datetime.date(2015, 8, 1), 'later'],
+                       'score': [1.5, 2.0]})
+    # the empty frame the table is created from can't tell these apart
+    assert pd.api.types.infer_dtype(df['entry_date'].head(0)) == 'empty'
+    assert object_column_types(df) == {'entry_date': Date,
+                                       'enrolled': Boolean}
+
+
+def read_copy_csv(csv_str):
+    """the rows COPY would read, with unquoted NULL_STR fields as None"""
+    rows = []
+    for line in csv.reader(io.StringIO(csv_str)):
+        rows.append([None if field == NULL_STR else field for field in line])
+    return rows
+
+
+def test_array_literal():
+    assert array_literal(['map_testritscore', 'att_absence']) == \
+        '{map_testritscore,att_absence}'
+    assert array_literal(()) == '{}'
+    assert array_literal([1, 2.5, None, float('nan')]) == '{1,2.5,NULL,NULL}'
+    assert array_literal(['a b', 'x,y', '', 'null', 'say "hi"', 'back\\slash', '{}']) == \
+        '{"a b","x,y","","null","say \\"hi\\"","back\\\\slash","{}"}'
+    assert array_literal([['a', 'b'], ['c']]) == '{{a,b},{c}}'
+
+
+def test_write_copy_csv():
+    df = pd.DataFrame({'model_name': ['LR', 'RF', None],
+                       'comment': ['says "hi"', 'two\nlines', 'a, b'],
+                       'metric_value': [0.5, np.nan, 1.0],
+                       'time': [pd.Timestamp('2016-07-01 10:00'), pd.NaT,
+                                pd.Timestamp('2016-07-02')],
+                       'features_to_make': [['map_testritscore', 'att_absence'],
+                                            ('female',), None]})
+    buffer = io.StringIO()
+    write_copy_csv(df, buffer)
+    csv_str = buffer.getvalue()
+    # quotes and newlines are in quoted fields
+    assert '"says ""hi"""' in csv_str
+    assert '"two\nlines"' in csv_str
+    assert read_copy_csv(csv_str) == [
+        ['LR', 'says "hi"', '0.5', '2016-07-01 10:00:00', '{map_testritscore,att_absence}'],
+        ['RF', 'two\nlines', None, None, '{female}'],
+        [None, 'a, b', '1.0', '2016-07-02 00:00:00', None]]
+    # the frame itself is left alone
+    assert df['features_to_make'][0] == ['map_testritscore', 'att_absence']
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, buffer.read()))
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.connection = self
+        self.cursor_ = FakeCursor()
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_copy_df_to_connection(monkeypatch):
+    created = []
+    monkeypatch.setattr(pd.DataFrame, 'to_sql',
+                        lambda df, table_name, connection, **kwargs:
+                        created.append((list(df.columns), len(df), table_name, kwargs)))
+    df = pd.DataFrame({'test_name': ['15_16'] * 5,
+                       'features_to_make': [['female']] * 5,
+                       'entry_date': [datetime.date(2015, 8, 1)] * 5})
+    connection = FakeConnection()
+    copy_df_to_connection(df, 'results', connection, schema='results',
+                          if_exists='append', chunksize=2)
+    assert created == [(['test_name', 'features_to_make', 'entry_date'], 0, 'results',
+                        {'schema': 'results', 'if_exists': 'append', 'index': False,
+                         'dtype': {'entry_date': Date}})]
+    copies = connection.cursor_.copies
+    assert len(copies) == 3
+    assert all('COPY "results"."results" ("test_name", "features_to_make", "entry_date")' in sql
+               for sql, _ in copies)
+    rows = [row for _, csv_str in copies for row in read_copy_csv(csv_str)]
+    assert rows == [['15_16', '{female}', '2015-08-01']] * 5
@@ -0,0 +1,56 @@
+"""
+Fitting the model grid on every split.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tulsa.learn import evaluate
+
+
+def synthetic_split(seed, num_rows=120):
+    rng = np.random.RandomState(seed)
+    X = pd.DataFrame({'map_testritscore': rng.normal(190, 15, size=num_rows),
+                      'att_absence': rng.randint(0, 30, size=num_rows).astype(float),
+                      'female': rng.randint(0, 2, size=num_rows)})
+    y = pd.Series((X['map_testritscore'] + rng.normal(0, 10, size=num_rows) < 185).astype(int))
+    num_train = num_rows * 2 // 3
+    return (X.iloc[:num_train], X.iloc[num_train:].reset_index(drop=True),
+            y.iloc[:num_train], y.iloc[num_train:].reset_index(drop=True))
+
+
+@pytest.fixture
+def splits():
+    return [synthetic_split(seed) for seed in range(3)]
+
+
+models_to_make = {'DT': {'max_depth': [2, 4], 'random_state': [0]},
+                  'NB': {}}
+metrics_to_make = ['auc', 'precision_at_10', 'recall_at_20']
+
+
+def test_parallel_fit_splits_matches_serial(splits):
+    serial = list(evaluate.fit_splits(splits, models_to_make, metrics_to_make, n_workers=1))
+    parallel = list(evaluate.fit_splits(splits, models_to_make, metrics_to_make, n_workers=2))
+    assert len(serial) == len(parallel) == len(splits)
+    for serial_results, parallel_results in zip(serial, parallel):
+        serial_list, serial_imps, serial_crosstab, serial_preds = serial_results
+        parallel_list, parallel_imps, parallel_crosstab, parallel_preds = parallel_results
+        # same rows in the same order, leaving out the run time
+        assert [row[:4] for row in parallel_list] == [row[:4] for row in serial_list]
+        assert len(serial_list) == 3 * len(metrics_to_make)
+        pd.testing.assert_frame_equal(parallel_preds, serial_preds)
+        assert serial_imps.empty and parallel_imps.empty
+        assert serial_crosstab.empty and parallel_crosstab.empty
+
+
+def test_fit_split_model_uses_worker_splits(splits):
+    evaluate.init_worker(splits)
+    try:
+        X_train, X_test, y_train, y_test = splits[1]
+        y_pred_probs, run_time, feat_imp_df = evaluate.fit_split_model(1, 'NB', {}, 1)
+        expected, _, _ = evaluate.fit_model('NB', {}, X_train, y_train, X_test, 1)
+        np.testing.assert_array_equal(y_pred_probs, expected)
+        assert feat_imp_df is None
+    finally:
+        evaluate.init_worker(None)
@@ -0,0 +1,712 @@
+"""
+The feature family builders against the one feature at a time versions
+they replaced, on small synthetic source tables.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from tulsa.learn import features
+from tulsa.learn import helpers
+
+from test_helpers import (old_ac_year_from_date, old_find_ac_year, old_season_from_date,
+                          old_termid_to_ac_year)
+
+
+def season_calendar():
+    """clean_data.season_calendar, as season_calendar.sql builds it, from
+    the old per-date helpers"""
+    dates = pd.Series(pd.date_range('2009-01-01', '2018-12-31', freq='D'))
+    return pd.DataFrame({'cal_date': dates,
+                         'measured_year': dates.apply(old_ac_year_from_date),
+                         'season': dates.apply(old_season_from_date),
+                         'cal_year': dates.dt.year % 100})
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """source tables by name, served to the features instead of the database"""
+    frames = {'clean_data.season_calendar': season_calendar()}
+
+    def read_query(sql, engine):
+        for table_name, df in frames.items():
+            if table_name in sql.split():
+                return df.copy()
+        raise KeyError(sql)
+
+    monkeypatch.setattr(features.source_cache, 'read_query', read_query)
+    return frames
+
+
+def synthetic_stuterm_df(rng, num_students=30):
+    years = ['12_13', '13_14', '14_15', '15_16']
+    seasons = ['fall', 'winter', 'spring']
+    stuterms = [(100 + student, year, season)
+                for student in range(num_students)
+                for year in years
+                for season in seasons]
+    keep = rng.rand(len(stuterms)) < 0.6
+    return pd.DataFrame([stuterm for stuterm, kept in zip(stuterms, keep) if kept],
+                        columns=['studentid', 'measured_year', 'season'])
+
+
+def random_dates(rng, size, start='2012-08-01', end='2016-07-31'):
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    return pd.Timestamp(start) + pd.to_timedelta(rng.randint(0, days, size=size), unit='D') + \
+        pd.to_timedelta(rng.randint(0, 24 * 3600, size=size), unit='s')
+
+
+def assert_features_equal(new_df, old_features):
+    """each column of new_df against the old feature of the same name"""
+    for feature_str, old in old_features.items():
+        pd.testing.assert_series_equal(new_df[feature_str].reset_index(drop=True),
+                                       old.reset_index(drop=True),
+                                       check_names=False, check_dtype=False)
+
+
+def old_discipline(stuterm_df, dem, r, disc):
+    if disc == 'num':
+        sub_fun = lambda x: 1
+    else:
+        sub_fun = lambda x: helpers.disc_group(x) == disc
+    stuterm_dem_df = stuterm_df.merge(dem, how='left',
+                                      left_on=['studentid'],
+                                      right_on=['student_number'])
+    r = r[(r['incidentdate'].notnull())].copy()
+    r['date'] = r['incidentdate'].apply(lambda x:
+                                        datetime.datetime.strptime(x, "%Y-%m-%d %H:%M:%S")\
+                                        if len(x) == 19 else None)
+    dateful = r[(r['date'].notnull())].copy()
+    dateful['season'] = dateful['date'].apply(old_season_from_date)
+    dateful['measured_year'] = dateful['date'].apply(old_ac_year_from_date)
+    dateful['cat'] = dateful['incidenttype'].apply(sub_fun)
+    dateful_minimal = dateful[['studentid', 'season', 'measured_year', 'cat']]
+    dateful_stuterm = dateful_minimal.groupby(by=['studentid', 'measured_year', 'season'])\
+                                     .agg('sum').reset_index()
+    merged_df = stuterm_dem_df.merge(dateful_stuterm,
+                                     how='left',
+                                     left_on=['id', 'measured_year', 'season'],
+                                     right_on=['studentid', 'measured_year', 'season'])
+    return merged_df['cat']
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_discipline_features(sources, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    # a row per student and year, the discipline data uses id not student_number
+    dem = pd.DataFrame({'student_number': np.repeat(np.arange(100, 130), 2),
+                        'id': np.repeat(np.arange(5000, 5030), 2)})
+    incident_types = ['214 DISRUPTIVE CONDUCT', '211 FIGHTING', '106 INSUBORDINATION',
+                      '108 DISRESPECT', '202 BULLYING', '215 SKIPPING/CUTTING CLASS',
+                      '0', '', '402 POSSESS WEAPON/FACSIMILE', '204 EXCESSIVE REFERRALS',
+                      '207 POSSESS STOLEN PROP', '316 SEXUAL HARASSMENT', '403 ARSON',
+                      '302 DISORDERLY CONDUCT', 'SOMETHING ELSE']
+    num_incidents = 300
+    dates = random_dates(rng, num_incidents).strftime('%Y-%m-%d %H:%M:%S')
+    incidentdate = pd.Series(dates, dtype=object)
+    # dates without times are left out, as are missing dates
+    incidentdate[rng.rand(num_incidents) < 0.1] = '2014-01-05'
+    incidentdate[rng.rand(num_incidents) < 0.05] = None
+    r = pd.DataFrame({'studentid': rng.randint(5000, 5035, size=num_incidents),
+                      'incidenttype': pd.Series(incident_types, dtype=object)
+                                        [rng.randint(0, len(incident_types), size=num_incidents)]
+                                        .values,
+                      'incidentdate': incidentdate})
+    sources['clean_data.demographics'] = dem
+    sources['raw_data.discipline_16_u_of_c_discipline_pk_3rd_data'] = r
+
+    new_df = features.build_discipline_features(stuterm_df, None, features.discipline_features)
+    # the old query was SELECT DISTINCT student_number, id
+    distinct_dem = dem.drop_duplicates()
+    old_features = {'discipline_num': old_discipline(stuterm_df, distinct_dem, r, 'num')}
+    for disc in features.discipline_cats:
+        old_features['discipline_' + disc] = old_discipline(stuterm_df, distinct_dem, r, disc)
+    assert_features_equal(new_df, old_features)
+    assert new_df['discipline_num'].notnull().any()
+    single = features.make_discipline_feature('physical')(stuterm_df, None)
+    assert_features_equal(pd.DataFrame({'discipline_physical': single}),
+                          {'discipline_physical': old_features['discipline_physical']})
+
+
+def old_rsa_logs(stuterm_df, rsa_df, subtype):
+    rsa_df = rsa_df[rsa_df['subtype'] == subtype].copy()
+    rsa_df['measured_year'] = rsa_df['discipline_incidentdate'].apply(old_ac_year_from_date)
+    rsa_df['season'] = rsa_df['discipline_incidentdate'].apply(old_season_from_date)
+    count_per_term = rsa_df.groupby(by=['student_number', 'measured_year',
+                                        'season']).agg(len).reset_index()
+    merged_df = stuterm_df.merge(count_per_term,
+                                 how='left',
+                                 left_on=['studentid', 'measured_year', 'season'],
+                                 right_on=['student_number', 'measured_year', 'season'])
+    return merged_df['subtype']
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_rsa_log_features(sources, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    subtypes = list(features.rsa_log_subtypes.values()) + ['SOMETHING_ELSE']
+    num_logs = 200
+    rsa_df = pd.DataFrame({'student_number': rng.randint(100, 135, size=num_logs),
+                           'subtype': np.array(subtypes, dtype=object)
+                                      [rng.randint(0, len(subtypes), size=num_logs)],
+                           'entry_date': random_dates(rng, num_logs),
+                           'discipline_incidentdate': random_dates(rng, num_logs)})
+    sources['clean_data.rsa_logs'] = rsa_df
+
+    feature_strs = sorted(features.rsa_log_subtypes)
+    new_df = features.build_rsa_log_features(stuterm_df, None, feature_strs)
+    assert_features_equal(new_df, {feature_str: old_rsa_logs(stuterm_df, rsa_df,
+                                                             features.rsa_log_subtypes[feature_str])
+                                   for feature_str in feature_strs})
+    assert new_df.notnull().any().all()
+    single = features.make_rsa_log_feature('EXEMPTION')(stuterm_df, None)
+    pd.testing.assert_series_equal(single, new_df['rsa_log_exemption'])
+
+
+def old_reenroll(stuterm_df, r, reen):
+    strats = {'num': {'col': 'entrycomment',
+                      'sub_fun': lambda x: 1},
+              'off_peak': {'col': 'entrydate',
+                           'sub_fun': lambda x: x.month != 8},
+              'pss': {'col': 'entrycomment',
+                      'sub_fun': lambda x: x == 'Promote Same School'},
+              'pns': {'col': 'entrycomment',
+                      'sub_fun': lambda x: x == 'Promoted Next School'},
+              'other': {'col': 'entrycomment',
+                        'sub_fun': lambda x: x != 'Promoted Same School' and\
+                        x != 'Promoted Next School'}
+              }
+    dateful = r[r['entrydate'].notnull()].copy()
+    dateful['season'] = dateful['entrydate'].apply(old_season_from_date)
+    dateful['measured_year'] = dateful['entrydate'].apply(old_ac_year_from_date)
+    col = strats[reen]['col']
+    sub_fun = strats[reen]['sub_fun']
+    dateful['cat'] = dateful[col].apply(sub_fun)
+    dateful_minimal = dateful[['student_number', 'measured_year', 'season', 'cat']]
+    dateful_stuterm = dateful_minimal.groupby(by=['student_number', 'measured_year', 'season'])\
+                                     .agg('sum').reset_index()
+    merged_df = stuterm_df.merge(dateful_stuterm,
+                                 how='left',
+                                 left_on=['studentid', 'measured_year', 'season'],
+                                 right_on=['student_number', 'measured_year', 'season'])
+    return merged_df['cat']
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_reenroll_features(sources, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    comments = ['Promote Same School', 'Promoted Same School',
+                'Promoted Next School', 'New To District']
+    num_reenrolls = 200
+    entrydate = pd.Series(random_dates(rng, num_reenrolls))
+    # missing entry dates are left out
+    entrydate[rng.rand(num_reenrolls) < 0.05] = pd.NaT
+    r = pd.DataFrame({'student_number': rng.randint(100, 135, size=num_reenrolls),
+                      'entrydate': entrydate,
+                      'entrycomment': np.array(comments, dtype=object)
+                                      [rng.randint(0, len(comments), size=num_reenrolls)]})
+    sources['clean_data.reenroll'] = r
+
+    new_df = features.build_reenroll_features(stuterm_df, None, features.reenroll_features)
+    assert_features_equal(new_df, {'reenroll_' + reen: old_reenroll(stuterm_df, r, reen)
+                                   for reen in ['num', 'off_peak', 'pss', 'pns', 'other']})
+    assert new_df.notnull().any().all()
+    single = features.make_reenroll_feature('pns')(stuterm_df, None)
+    pd.testing.assert_series_equal(single, new_df['reenroll_pns'])
+
+
+@pytest.fixture
+def sqlite_engine():
+    """an in memory database with a clean_data schema, for features that
+    run their own sql"""
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ':memory:' AS clean_data")
+    yield engine
+    engine.dispose()
+
+
+def old_att_feature(stuterm_df, dem, att, map_df, att_code, att_col_name):
+    """the old per-code query, the season windows come from the map terms"""
+    dem = dem[['id', 'student_number']].drop_duplicates()
+    att = att[att['att_code'] == att_code].merge(dem, left_on='studentid', right_on='id')
+    map_season_date = map_df[['measured_year', 'season', 'cal_year']].drop_duplicates()
+    starts = {'fall': '-08-01', 'winter': '-01-01', 'spring': '-03-01'}
+    ends = {'fall': '-01-01', 'winter': '-03-01', 'spring': '-08-01'}
+    map_season_date['season_start'] = pd.to_datetime(
+        ('20' + map_season_date['cal_year'].astype(str)) + map_season_date['season'].map(starts))
+    end_years = map_season_date['cal_year'] + (map_season_date['season'] == 'fall')
+    map_season_date['season_end'] = pd.to_datetime(
+        ('20' + end_years.astype(str)) + map_season_date['season'].map(ends))
+    joined = att.merge(map_season_date, how='cross')
+    att_dates = pd.to_datetime(joined['att_date'])
+    joined = joined[(att_dates >= joined['season_start']) & (att_dates < joined['season_end'])]
+    att_df = joined.groupby(['measured_year', 'season', 'student_number']).size()\
+                   .rename(att_col_name).reset_index()
+    stuterm_att_df = stuterm_df.merge(att_df, how='left',
+                                      left_on=['studentid',
+                                               'measured_year',
+                                               'season'],
+                                      right_on=['student_number',
+                                                'measured_year',
+                                                'season'])
+    return stuterm_att_df[att_col_name]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_att_features(sqlite_engine, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    dem = pd.DataFrame({'student_number': np.repeat(np.arange(100, 130), 2),
+                        'id': np.repeat(np.arange(5000, 5030), 2)})
+    codes = list(features.att_codes.values()) + ['present']
+    num_days = 2000
+    att = pd.DataFrame({'studentid': rng.randint(5000, 5035, size=num_days),
+                        'att_date': random_dates(rng, num_days).strftime('%Y-%m-%d'),
+                        'att_code': np.array(codes, dtype=object)
+                                    [rng.randint(0, len(codes), size=num_days)]})
+    map_df = pd.DataFrame([(measured_year, season, int(measured_year[:2]) + (season != 'fall'))
+                           for measured_year in ['12_13', '13_14', '14_15', '15_16']
+                           for season in ['fall', 'winter', 'spring']],
+                          columns=['measured_year', 'season', 'cal_year'])
+    calendar_df = season_calendar()
+    calendar_df['cal_date'] = calendar_df['cal_date'].dt.strftime('%Y-%m-%d')
+    dem.to_sql('demographics', sqlite_engine, schema='clean_data', index=False)
+    att.to_sql('att_by_day_12_16', sqlite_engine, schema='clean_data', index=False)
+    calendar_df.to_sql('season_calendar', sqlite_engine, schema='clean_data', index=False)
+
+    feature_strs = sorted(features.att_codes)
+    new_df = features.build_att_features(stuterm_df, sqlite_engine, feature_strs)
+    assert_features_equal(new_df, {feature_str: old_att_feature(stuterm_df, dem, att, map_df,
+                                                                features.att_codes[feature_str],
+                                                                feature_str)
+                                   for feature_str in feature_strs})
+    assert new_df.notnull().any().all()
+    single = features.make_attendance_feature('nurse', 'att_nurse')(stuterm_df, sqlite_engine)
+    pd.testing.assert_series_equal(single, new_df['att_nurse'])
+
+
+def test_terms_from_dates():
+    rng = np.random.RandomState(0)
+    # the calendar does not have to come sorted
+    calendar_df = season_calendar().sample(frac=1, random_state=rng)
+    in_range = pd.Series(random_dates(rng, 500, start='2009-01-01', end='2018-12-31'))
+    dates = pd.concat([in_range,
+                       pd.Series([pd.Timestamp('2009-01-01'), pd.Timestamp('2018-12-31 23:59:59'),
+                                  pd.Timestamp('2008-12-31 23:59:59'), pd.Timestamp('2019-01-01'),
+                                  pd.NaT])],
+                      ignore_index=True)
+    dates.index = rng.permutation(len(dates)) + 1000
+    terms_df = helpers.terms_from_dates(dates, calendar_df)
+    assert terms_df.index.equals(dates.index)
+    found = dates.between('2009-01-01', '2018-12-31 23:59:59')
+    assert found.sum() == len(in_range) + 2
+    assert terms_df.loc[found, 'season'].tolist() == \
+        [old_season_from_date(date) for date in dates[found]]
+    assert terms_df.loc[found, 'measured_year'].tolist() == \
+        [old_ac_year_from_date(date) for date in dates[found]]
+    assert (terms_df.loc[found, 'cal_year'] == dates[found].dt.year % 100).all()
+    # missing dates and dates off the calendar have no term
+    assert terms_df[~found].isnull().all().all()
+
+
+def test_get_date_terms(sources):
+    dates = pd.Series([pd.Timestamp('2014-08-01'), pd.Timestamp('2015-02-28 13:00'),
+                       pd.Timestamp('2015-03-01')])
+    terms_df = features.get_date_terms(dates, None)
+    assert terms_df['measured_year'].tolist() == ['14_15', '14_15', '14_15']
+    assert terms_df['season'].tolist() == ['fall', 'winter', 'spring']
+    assert terms_df['cal_year'].tolist() == [14, 15, 15]
+
+
+@pytest.fixture
+def empty_source_cache():
+    """the real source cache, emptied around a test that reads through it"""
+    features.source_cache.clear()
+    yield features.source_cache
+    features.source_cache.clear()
+
+
+def old_get_dem_sql(dem_col, static=False):
+    dem_sql = """
+              SELECT
+                dem.measured_year,
+                dem.student_number
+                , {dem_column}
+              FROM
+                  clean_data.demographics AS dem
+              """.format(dem_column=dem_col)
+    if static:
+        dem_sql = dem_sql + """INNER JOIN
+                                   (SELECT
+                                       student_number,
+                                       MAX(start_year) AS start_year
+                                   FROM
+                                       clean_data.demographics
+                                   GROUP BY
+                                          student_number) AS most_recent_record
+                               USING (student_number, start_year)"""
+    return dem_sql
+
+
+def old_dem_feature(stuterm_df, engine, dem_col, col_name, static):
+    dem_df = pd.read_sql_query(old_get_dem_sql(dem_col, static), engine)
+    if static:
+        stuterm_dem_df = stuterm_df.merge(dem_df[['student_number', col_name]],
+                                          how='left',
+                                          left_on='studentid',
+                                          right_on='student_number')
+    else:
+        stuterm_dem_df = stuterm_df.merge(dem_df, how='left',
+                                          left_on=['studentid',
+                                                   'measured_year'],
+                                          right_on=['student_number',
+                                                    'measured_year'])
+    return stuterm_dem_df[col_name]
+
+
+def old_dem_features(stuterm_df, engine):
+    """every demographics feature, with the columns the old functions selected"""
+    old_features = {
+        'female': old_dem_feature(stuterm_df, engine,
+                                  """CASE gender
+                                         WHEN 'F' THEN 1
+                                         WHEN 'M' THEN 0
+                                         ELSE -1
+                                     END AS is_female""", 'is_female', True),
+        'ethnicity': old_dem_feature(stuterm_df, engine, 'ethnicity', 'ethnicity', True)}
+    yearly_cols = {'ell': 'ok_ell',
+                   'ell_language': 'ok_ell_language_code',
+                   'disability_code': 'ok_primary_disability_code',
+                   'service_delivery': 'tps_service_delivery_code',
+                   'lunch_status': 'lunch_status',
+                   'homeless': 'ok_homeless',
+                   'lives_with': 'tps_demographics_lives_with',
+                   'school': 'school_id'}
+    for feature_str, col in yearly_cols.items():
+        dem_col = "CASE WHEN {col} IS NULL THEN '0' ELSE {col} END AS {feature_str}"\
+            .format(col=col, feature_str=feature_str)
+        old_features[feature_str] = old_dem_feature(stuterm_df, engine, dem_col,
+                                                    feature_str, False)
+    return old_features
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_demographics_features(sqlite_engine, empty_source_cache, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    # a row per student and measured year they are in a demographics file,
+    # some students are in none of them
+    dem_rows = [(student_number, measured_year, 2000 + int(measured_year[:2]))
+                for student_number in range(100, 128)
+                for measured_year in ['12_13', '13_14', '14_15', '15_16']
+                if rng.rand() < 0.7]
+    dem = pd.DataFrame(dem_rows, columns=['student_number', 'measured_year', 'start_year'])
+    dem['id'] = dem['student_number'] + 4900
+    dem['grade_level'] = '1'
+
+    def random_values(values):
+        chosen = np.array(values, dtype=object)[rng.randint(0, len(values), size=len(dem))]
+        chosen[rng.rand(len(dem)) < 0.2] = None
+        return chosen
+
+    dem['gender'] = random_values(['F', 'M', 'U'])
+    dem['ethnicity'] = random_values(['1', '2', '3', '4'])
+    dem['ok_ell'] = random_values(['Y', 'N'])
+    dem['ok_ell_language_code'] = random_values(['SPA', 'VIE', 'ENG'])
+    dem['ok_primary_disability_code'] = random_values(['SLI', 'OHI', 'DD'])
+    dem['tps_service_delivery_code'] = random_values(['A', 'B'])
+    dem['lunch_status'] = random_values(['F', 'R', 'P'])
+    dem['ok_homeless'] = random_values(['Y', 'N'])
+    dem['tps_demographics_lives_with'] = random_values(['BP', 'M', 'F', 'G'])
+    dem['school_id'] = random_values(['110', '120', '130'])
+    dem.to_sql('demographics', sqlite_engine, schema='clean_data', index=False)
+
+    feature_strs = sorted(features.dem_features)
+    new_df = features.build_demographics_features(stuterm_df, sqlite_engine, feature_strs)
+    assert_features_equal(new_df, old_dem_features(stuterm_df, sqlite_engine))
+    # unknown genders, missing values filled with '0' and stuterms with no
+    # demographics row are all covered
+    assert (new_df['female'] == -1).any()
+    assert (new_df['ell'] == '0').any() and new_df['ell'].isnull().any()
+    single = features.make_demographics_feature('ell')(stuterm_df, sqlite_engine)
+    pd.testing.assert_series_equal(single, new_df['ell'])
+
+
+def old_convert_current_series_topic(x, level_type):
+    if x == None:
+        current_series = None
+        current_topic = None
+    elif 'series' in x:
+        current_series = int(x.split('_')[1])
+        current_topic = int(x.split('_')[3])
+    else:
+        current_series = int(x.split('.')[0])
+        current_topic = int(x.split('.')[1])
+    if level_type == 'series':
+        return current_series
+    else:
+        return current_topic
+
+
+def test_iread_series_topics():
+    series_topics = pd.Series(['series_3_topic_12', 'series_10_topic_1', '4.07',
+                               '12.3', None, 'series_1_topic_1'], dtype=object)
+    series_topic_df = features.iread_series_topics(series_topics)
+    for level_type in ['series', 'topic']:
+        old = series_topics.apply(lambda x: old_convert_current_series_topic(x, level_type))
+        pd.testing.assert_series_equal(series_topic_df[level_type], old.astype(float),
+                                       check_names=False)
+
+
+def old_iread_features(stuterm_df, iread_df, dem):
+    """the old iread features, each from the one row per student and year the
+    old queries selected"""
+    def merge(feature_df):
+        return stuterm_df.merge(feature_df, how='left',
+                                left_on=['studentid', 'measured_year'],
+                                right_on=['sis_id', 'measured_year'])
+
+    old_features = {'iread_is_enrolled': merge(iread_df)['iread_is_enrolled']}
+
+    stuterm_dem_df = merge(iread_df).merge(dem, how='left',
+                                           left_on=['studentid', 'measured_year'],
+                                           right_on=['student_number', 'measured_year'])
+    stuterm_dem_df['iread_data_missing'] = np.nan
+    stuterm_dem_df.loc[(np.isnan(stuterm_dem_df['iread_is_enrolled'])) & (stuterm_dem_df['grade_level']!=3), 'iread_data_missing'] = 1
+    stuterm_dem_df.loc[(np.isfinite(stuterm_dem_df['iread_is_enrolled'])) & (stuterm_dem_df['grade_level']!=3), 'iread_data_missing'] = 0
+    old_features['iread_data_missing'] = stuterm_dem_df['iread_data_missing']
+
+    took_screener_df = iread_df.copy()
+    took_screener_df['took_screener'] = np.nan
+    took_screener_df.loc[(took_screener_df['s44jr_enrolled'] == "Yes") & (took_screener_df['iread_screener_date_administered'].isnull()), 'took_screener' ] = 0
+    took_screener_df.loc[(took_screener_df['s44jr_enrolled'] == "Yes") & (took_screener_df['iread_screener_date_administered'].notnull()), 'took_screener' ] = 1
+    old_features['iread_took_screener'] = merge(took_screener_df)['took_screener']
+
+    feature_df = iread_df.copy()
+    feature_df['iread_average_time_per_topic'] = feature_df['iread_daterange_total_time']/ feature_df['iread_daterange_total_topics_completed']
+    old_features['iread_average_time_per_topic'] = merge(feature_df)['iread_average_time_per_topic']
+
+    feature_df = iread_df.copy()
+    feature_df['end_date'] = feature_df['export_end_date'].apply(lambda x: datetime.datetime.strptime(str(x), '%Y%m%d').toordinal())
+    feature_df['start_date'] = feature_df['export_start_date'].apply(lambda x: datetime.datetime.strptime(str(x), '%Y%m%d').toordinal())
+    feature_df['weeks'] = (feature_df['end_date'] - feature_df['start_date'])/7
+    feature_df['iread_average_sessions_per_week'] = feature_df['iread_daterange_total_sessions']/ feature_df['weeks']
+    old_features['iread_average_sessions_per_week'] = merge(feature_df)['iread_average_sessions_per_week']
+
+    for level_type in ['series', 'topic']:
+        feature_df = iread_df.copy()
+        feature_df['current_' + level_type] = feature_df['iread_daterange_current_series_topic'].apply(lambda x: old_convert_current_series_topic(x, level_type))
+        old_features['iread_current_' + level_type] = merge(feature_df)['current_' + level_type].astype(float)
+
+    for feature_str, iread_col in features.iread_feature_cols.items():
+        old_features[feature_str] = merge(iread_df)[iread_col]
+    return old_features
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_iread_features(sources, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    # the extraction has a row per student and year
+    keys = [(sis_id, measured_year)
+            for sis_id in range(100, 135)
+            for measured_year in ['12_13', '13_14', '14_15', '15_16']
+            if rng.rand() < 0.6]
+    iread_df = pd.DataFrame(keys, columns=['sis_id', 'measured_year'])
+    num_rows = len(iread_df)
+    iread_df['grade'] = rng.randint(0, 4, size=num_rows)
+    enrolled = np.array(['Yes', 'No', None], dtype=object)[rng.randint(0, 3, size=num_rows)]
+    iread_df['s44jr_enrolled'] = enrolled
+    iread_df['iread_is_enrolled'] = pd.Series(enrolled).map({'Yes': 1, 'No': 0}).fillna(-1)
+    screener_dates = pd.Series(random_dates(rng, num_rows), dtype=object)
+    screener_dates[rng.rand(num_rows) < 0.3] = None
+    iread_df['iread_screener_date_administered'] = screener_dates
+    starts = random_dates(rng, num_rows, end='2015-12-31')
+    iread_df['export_start_date'] = starts.strftime('%Y%m%d').astype(int)
+    iread_df['export_end_date'] = (starts + pd.to_timedelta(rng.randint(7, 200, size=num_rows),
+                                                            unit='D')).strftime('%Y%m%d').astype(int)
+    series_topics = np.array(['series_3_topic_12', 'series_10_topic_1', '4.07', '12.3', None],
+                             dtype=object)
+    # kept as objects, so missing values are None as from the database
+    iread_df['iread_daterange_current_series_topic'] = \
+        pd.Series(series_topics[rng.randint(0, 5, size=num_rows)], dtype=object)
+    iread_df['iread_screener_placement_series'] = rng.randint(1, 10, size=num_rows)
+    iread_df['iread_daterange_highest_unit_reached'] = rng.randint(1, 30, size=num_rows)
+    iread_df['iread_daterange_total_sessions'] = rng.randint(1, 80, size=num_rows)
+    iread_df['iread_daterange_total_topics_completed'] = rng.randint(0, 40, size=num_rows)
+    iread_df['iread_daterange_total_time'] = rng.randint(0, 3000, size=num_rows)
+    dem = pd.DataFrame([(student_number, measured_year, rng.randint(0, 5))
+                        for student_number in range(100, 130)
+                        for measured_year in ['12_13', '13_14', '14_15', '15_16']],
+                       columns=['student_number', 'measured_year', 'grade_level'])
+    sources['clean_data.iread'] = iread_df
+    sources['clean_data.demographics'] = dem
+
+    new_df = features.build_iread_features(stuterm_df, None, features.iread_features)
+    assert_features_equal(new_df, old_iread_features(stuterm_df, iread_df, dem))
+    assert new_df['iread_data_missing'].isin([0, 1]).any()
+    single = features.make_iread_feature('iread_took_screener')(stuterm_df, None)
+    pd.testing.assert_series_equal(single, new_df['iread_took_screener'])
+
+
+def old_categorize_courses(course_name):
+    try:
+        return helpers.course_categories[course_name]
+    except KeyError:
+        return 'non-grade'
+
+
+def old_categorize_grades(grade):
+    valid_grades = frozenset(['a', 'b', 'c', 'd',
+                              'e', 'f', 's', 'n',
+                              'u', 'p', 'ng'])
+    if grade:
+        grade = grade.lower()
+        if grade in valid_grades:
+            return grade
+    # either no grade, or grade not a valid grade
+    return 'non_standard_grade'
+
+
+def old_course_taken(stuterm_df, engine, course_or_grade, cg_value):
+    grades_sql = """SELECT student_number, grade, course_name, termid
+                    FROM clean_data.grades_16_uofc_grades_1st___3rd_2013_to_2
+                    where grade_level <4"""
+    grades_df = pd.read_sql(grades_sql, engine)
+    # missing grades were read as None when this ran
+    grades_df['grade'] = grades_df['grade'].astype(object) \
+        .where(grades_df['grade'].notnull(), None)
+    grades_df['measured_year'] = grades_df['termid'] \
+        .apply(old_termid_to_ac_year)
+    if course_or_grade == 'course':
+        select_col = 'course_name'
+        cat_fun = old_categorize_courses
+    else:
+        select_col = 'grade'
+        cat_fun = old_categorize_grades
+    grades_df['cat'] = grades_df[select_col] \
+        .apply(cat_fun)
+    course_cat_only = grades_df[grades_df['cat'] == cg_value]
+    course_minimal = course_cat_only[['student_number', 'measured_year',
+                                      'cat']]
+    course_per_stuterm = course_minimal.groupby(by=['student_number',
+                                                    'measured_year']) \
+        .agg(len).reset_index()
+    merged_df = stuterm_df.merge(course_per_stuterm,
+                                 how='left',
+                                 left_on=['studentid', 'measured_year'],
+                                 right_on=['student_number', 'measured_year'])
+    return merged_df['cat']
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_grades_features(sqlite_engine, empty_source_cache, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    course_names = list(helpers.course_categories) + ['GR 3 ORCHESTRA', 'HOMEROOM']
+    grades = ['A', 'b', 'C', 'D', 'F', 'S', 'n', 'U', 'E', 'P', 'NG', 'A+', 'I', '', None]
+    # termids whose second digit is the academic year, and a few malformed ones
+    termids = [2200, 2201, 2300, 2302, 2400, 2401, 2500, 2502, 12, 12345]
+    num_grades = 600
+    grades_df = pd.DataFrame({
+        'student_number': rng.randint(100, 135, size=num_grades),
+        'grade': np.array(grades, dtype=object)[rng.randint(0, len(grades), size=num_grades)],
+        'course_name': np.array(course_names, dtype=object)
+                       [rng.randint(0, len(course_names), size=num_grades)],
+        'termid': np.array(termids)[rng.randint(0, len(termids), size=num_grades)],
+        'grade_level': rng.randint(0, 6, size=num_grades)})
+    grades_df.to_sql('grades_16_uofc_grades_1st___3rd_2013_to_2', sqlite_engine,
+                     schema='clean_data', index=False)
+
+    new_df = features.build_grades_features(stuterm_df, sqlite_engine, features.grades_features)
+    old_features = {}
+    for course_cat in features.course_cats:
+        old_features['course_taken_' + course_cat] = old_course_taken(stuterm_df, sqlite_engine,
+                                                                      'course', course_cat)
+    for grade_cat in features.grade_cats:
+        old_features['grade_mark_' + grade_cat] = old_course_taken(stuterm_df, sqlite_engine,
+                                                                   'grade', grade_cat)
+    assert_features_equal(new_df, old_features)
+    assert new_df.notnull().any().all()
+    single = features.make_course_feature('grade', 'ng')(stuterm_df, sqlite_engine)
+    pd.testing.assert_series_equal(single, new_df['grade_mark_ng'])
+
+
+def old_tripod_feat(stuterm_df, engine, tripod_col, agg_fun):
+    tripod_select_sql = """select * from
+                    (SELECT {tripod_col}, yr, season as tripod_season, teacher_id
+                    FROM clean_data.tripod) as t
+
+                    inner join
+
+                    (SELECT student_number, measured_year, season, teachernumber
+                    FROM clean_data.roster) as r
+
+                    on t.teacher_id = r.teachernumber
+                       and t.yr = cast(r.measured_year as int)
+                       and lower(t.tripod_season) = lower(r.season)""".format(tripod_col=tripod_col)
+
+    tripod_col_df = pd.read_sql_query(tripod_select_sql, engine)
+    tripod_col_df['ac_measured_year'] = tripod_col_df[['measured_year', 'season']].apply(
+        lambda x: old_find_ac_year(x['measured_year'], x['season']), axis=1)
+    # the other columns were aggregated too and thrown away, pandas no
+    # longer takes the std of text so only the feature column is
+    aggperterm_df = tripod_col_df.groupby(by=['student_number', 'ac_measured_year', 'season'])[
+        [tripod_col]].agg(agg_fun).reset_index()
+    merged_df = stuterm_df.merge(aggperterm_df,
+                                 how='left',
+                                 left_on=['studentid', 'measured_year', 'season'],
+                                 right_on=['student_number', 'ac_measured_year', 'season'])
+    return merged_df[tripod_col]
+
+
+# the pandas this ran on turned np.min, np.max, np.mean and np.std into these
+# groupby methods, so the std was the sample std
+old_tripod_aggs = ['min', 'max', 'mean', 'std']
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_build_tripod_features(sqlite_engine, empty_source_cache, seed):
+    rng = np.random.RandomState(seed)
+    stuterm_df = synthetic_stuterm_df(rng)
+    years = [2012, 2013, 2014, 2015, 2016]
+    seasons = ['fall', 'winter', 'spring']
+    # some survey scores for each teacher and term, with capitalized seasons
+    tripod_rows = [(teacher_id, yr, season.capitalize())
+                   for teacher_id in range(1, 9) for yr in years for season in seasons
+                   for _ in range(rng.choice([0, 1, 1, 2]))]
+    tripod_df = pd.DataFrame(tripod_rows, columns=['teacher_id', 'yr', 'season'])
+    for tripod_col in features.tripod_cols:
+        scores = pd.Series(rng.rand(len(tripod_df)) * 5)
+        scores[rng.rand(len(tripod_df)) < 0.1] = np.nan
+        tripod_df[tripod_col] = scores
+    # the classes students took each term, as text years like the roster has
+    roster_rows = [(student_number, str(yr), season, teachernumber)
+                   for student_number in range(100, 135) for yr in years for season in seasons
+                   if rng.rand() < 0.6
+                   for teachernumber in rng.choice(range(1, 9), size=rng.randint(1, 4),
+                                                   replace=False)]
+    roster_df = pd.DataFrame(roster_rows, columns=['student_number', 'measured_year',
+                                                   'season', 'teachernumber'])
+    tripod_df.to_sql('tripod', sqlite_engine, schema='clean_data', index=False)
+    roster_df.to_sql('roster', sqlite_engine, schema='clean_data', index=False)
+
+    new_df = features.build_tripod_features(stuterm_df, sqlite_engine, features.tripod_features)
+    old_features = {}
+    for tripod_col in features.tripod_cols:
+        for agg in old_tripod_aggs:
+            old_features['tripod_{}_{}'.format(tripod_col, agg)] = \
+                old_tripod_feat(stuterm_df, sqlite_engine, tripod_col, agg)
+    assert sorted(old_features) == sorted(features.tripod_features)
+    assert_features_equal(new_df, old_features)
+    assert new_df.notnull().any().all()
+    single = features.make_tripod_feature('tripod_care_std')(stuterm_df, sqlite_engine)
+    pd.testing.assert_series_equal(single, new_df['tripod_care_std'])
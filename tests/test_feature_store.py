@@ -0,0 +1,120 @@
+"""
+Saving and loading the label and feature columns of a run.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+from tulsa.learn import feature_store
+
+
+@pytest.fixture
+def all_data_df():
+    return pd.DataFrame({'studentid': [101, 102, 103, 104],
+                         'measured_year': ['14_15', '14_15', '15_16', '15_16'],
+                         'season': ['fall', 'winter', 'spring', 'fall'],
+                         'eventual186': [0, 1, 1, 0],
+                         'map_testritscore': [190.5, np.nan, 201.0, np.nan],
+                         'ethnicity': ['W', 'B', None, 'H'],
+                         'female': [True, False, True, True]})
+
+
+def test_npy_round_trip(tmpdir, all_data_df):
+    store = feature_store.NpyFeatureStore(str(tmpdir), 'eventual186', 'v1')
+    assert store.existing_columns() == []
+    store.save_all(all_data_df)
+    assert sorted(store.existing_columns()) == sorted(all_data_df.columns)
+    loaded_df = store.load_columns(list(all_data_df.columns))
+    # numeric columns are memmaps, compared as plain arrays
+    pd.testing.assert_frame_equal(pd.DataFrame({col: np.asarray(loaded_df[col])
+                                                for col in loaded_df.columns}),
+                                  all_data_df, check_dtype=False)
+    assert loaded_df['studentid'].dtype.kind == 'i'
+    assert loaded_df['map_testritscore'].dtype.kind == 'f'
+
+    # only the columns asked for, in the order asked for
+    subset_df = store.load_columns(['ethnicity', 'studentid'])
+    assert list(subset_df.columns) == ['ethnicity', 'studentid']
+
+
+def test_npy_add_columns_and_replace(tmpdir, all_data_df):
+    store = feature_store.NpyFeatureStore(str(tmpdir), 'eventual186', 'v1')
+    store.save_all(all_data_df)
+    stuterm_df = store.load_columns(['studentid', 'measured_year', 'season'])
+    store.add_columns(stuterm_df, pd.DataFrame({'school': ['110', '120', None, '110'],
+                                                'att_absence': [1.0, np.nan, 3.0, 0.0]}))
+    loaded_df = store.load_columns(['studentid', 'school', 'att_absence'])
+    assert loaded_df['school'].tolist()[:2] == ['110', '120']
+    assert loaded_df['school'].isnull().tolist() == [False, False, True, False]
+    assert loaded_df['att_absence'].isnull().tolist() == [False, True, False, False]
+
+    # save_all drops the columns that are not saved again
+    store.save_all(all_data_df[['studentid', 'eventual186']])
+    assert sorted(store.existing_columns()) == ['eventual186', 'studentid']
+    # no temp files are left behind
+    assert sorted(tmpdir.join('eventual186', 'v1').listdir()) == \
+        sorted(tmpdir.join('eventual186', 'v1', name) for name in ['eventual186.npy',
+                                                                     'studentid.npy'])
+
+
+def test_npy_numeric_columns_are_memory_mapped(monkeypatch, tmpdir, all_data_df):
+    store = feature_store.NpyFeatureStore(str(tmpdir), 'eventual186', 'v1')
+    store.save_all(all_data_df)
+    np_load = np.load
+    loaded_arrays = {}
+
+    def recording_load(path, *args, **kwargs):
+        loaded_arrays[path] = np_load(path, *args, **kwargs)
+        return loaded_arrays[path]
+
+    monkeypatch.setattr(np, 'load', recording_load)
+    loaded_df = store.load_columns(['map_testritscore', 'studentid', 'ethnicity'])
+    for col in ['map_testritscore', 'studentid']:
+        mapped = loaded_arrays[store.col_path(col)]
+        assert isinstance(mapped, np.memmap)
+        # the column reads straight from the file, it is not a copy
+        assert np.shares_memory(loaded_df[col].to_numpy(), mapped)
+
+
+@pytest.fixture
+def sqlite_engine():
+    engine = sqlalchemy.create_engine('sqlite://', poolclass=StaticPool)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ':memory:' AS features")
+    yield engine
+    engine.dispose()
+
+
+def test_postgres_load_columns(sqlite_engine, all_data_df):
+    all_data_df.to_sql('eventual186', sqlite_engine, schema='features', index=False)
+    store = feature_store.PostgresFeatureStore(sqlite_engine, 'eventual186')
+    loaded_df = store.load_columns(['studentid', 'map_testritscore'])
+    pd.testing.assert_frame_equal(loaded_df, all_data_df[['studentid', 'map_testritscore']])
+
+
+def test_postgres_add_columns(monkeypatch, all_data_df):
+    calls = []
+    monkeypatch.setattr(feature_store, 'copy_df_to_db',
+                        lambda df, table_name, engine, **kwargs:
+                        calls.append(('copy', list(df.columns), table_name, kwargs)))
+    monkeypatch.setattr(feature_store.helpers, 'alter_features_add_columns',
+                        lambda from_table, from_cols, to_table, engine:
+                        calls.append(('alter', from_table, from_cols, to_table)))
+    store = feature_store.PostgresFeatureStore(None, 'eventual186')
+    stuterm_df = all_data_df[['studentid', 'measured_year', 'season']]
+    store.add_columns(stuterm_df, all_data_df[['ethnicity', 'female']])
+    assert calls == [('copy', ['studentid', 'measured_year', 'season', 'ethnicity', 'female'],
+                      'temp', {'schema': 'features', 'if_exists': 'replace'}),
+                     ('alter', 'temp', ['ethnicity', 'female'], 'eventual186')]
+
+
+def test_make_feature_store(tmpdir):
+    assert isinstance(feature_store.make_feature_store('postgres', None, 'eventual186'),
+                      feature_store.PostgresFeatureStore)
+    assert isinstance(feature_store.make_feature_store('npy', None, 'eventual186',
+                                                       str(tmpdir), 'v1'),
+                      feature_store.NpyFeatureStore)
+    with pytest.raises(ValueError):
+        feature_store.make_feature_store('parquet', None, 'eventual186')
@@ -0,0 +1,109 @@
+"""
+The vectorized MAP helpers against the row by row versions they replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tulsa.learn import features
+from tulsa.learn import helpers
+
+
+def old_max_score_to_date(df):
+    df['max_score'] = df['map_testritscore']
+    for (prev_index, prev_row), (this_index, this_row) in helpers.pairwise(df.iterrows()):
+        if len(df) == 1:
+            pass
+        elif this_row['map_testritscore'] > df.loc[prev_index, 'max_score']:
+            df.loc[this_index, 'max_score'] = df.loc[this_index, 'map_testritscore']
+        else:
+            df.loc[this_index, 'max_score'] = df.loc[prev_index, 'max_score']
+    return df['max_score']
+
+
+def old_num_consecutive_negs(df):
+    df['num_consecutive_negs'] = 0
+    df.loc[df.index[0], 'num_consecutive_negs'] = int(df.loc[df.index[0], 'diffs'] < 0)
+    for (prev_index, prev_row), (this_index, this_row) in helpers.pairwise(df.iterrows()):
+        if this_row['diffs'] < 0:
+            df.loc[this_index, 'num_consecutive_negs'] = df.loc[prev_index, 'num_consecutive_negs'] + 1
+    return df['num_consecutive_negs']
+
+
+def synthetic_map_df(seed, num_students=40):
+    """studentid, map_testritscore and diffs for a few terms per student,
+    sorted by student then term, with a shuffled index and some missing
+    scores, first scores included"""
+    rng = np.random.RandomState(seed)
+    terms_per_student = rng.randint(1, 7, size=num_students)
+    studentids = np.repeat(np.arange(num_students) * 7 + 100, terms_per_student)
+    scores = rng.randint(140, 230, size=len(studentids)).astype(float)
+    scores[rng.rand(len(studentids)) < 0.2] = np.nan
+    df = pd.DataFrame({'studentid': studentids,
+                       'map_testritscore': scores},
+                      index=rng.permutation(len(studentids)))
+    diffs = df['map_testritscore'].diff()
+    diffs[df['studentid'] != df['studentid'].shift(1)] = np.nan
+    df['diffs'] = diffs
+    return df
+
+
+def per_student(old_fun, df):
+    return pd.concat([old_fun(student_df.copy())
+                      for studentid, student_df in df.groupby('studentid', sort=False)])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_max_score_to_date_matches_iterrows(seed):
+    df = synthetic_map_df(seed)
+    # make sure missing first scores are covered
+    df.loc[df.index[0], 'map_testritscore'] = np.nan
+    expected = per_student(old_max_score_to_date, df)
+    result = features.max_score_to_date(df.copy())
+    pd.testing.assert_series_equal(result, expected.reindex(result.index),
+                                   check_names=False, check_dtype=False)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_num_consecutive_negs_matches_iterrows(seed):
+    df = synthetic_map_df(seed)
+    expected = per_student(old_num_consecutive_negs, df)
+    result = features.num_consecutive_negs(df.copy())
+    pd.testing.assert_series_equal(result, expected.reindex(result.index),
+                                   check_names=False, check_dtype=False)
+
+
+def squash(sql):
+    return ' '.join(sql.split())
+
+
+@pytest.mark.parametrize('feature_str, agg', [
+    ('map_testritscore', 'MAX(testritscore)'),
+    ('map_reading_testpercentile',
+     "MAX(CASE WHEN discipline = 'Reading' THEN testpercentile END)"),
+    ('map_start_date', "MAX(TO_DATE(teststartdate, 'MM/DD/YYYY') - DATE '2013-09-09')"),
+    ('map_reading_start_hour',
+     "MAX(CASE WHEN discipline = 'Reading' THEN EXTRACT(HOUR FROM teststarttime::time)::int END)"),
+])
+def test_map_aggregate_sql_one_feature(feature_str, agg):
+    assert squash(features.map_aggregate_sql([feature_str])) == squash(
+        """SELECT studentid, measured_year, season, {agg} AS {feature_str}
+           FROM clean_data.map
+           GROUP BY studentid, measured_year, season""".format(agg=agg, feature_str=feature_str))
+
+
+def test_map_aggregate_sql_many_features():
+    sql = squash(features.map_aggregate_sql(['map_start_hour', 'map_testritscore',
+                                             'map_reading_start_date']))
+    # one column per feature, in name order, from one GROUP BY
+    assert sql == squash(
+        """SELECT studentid, measured_year, season,
+               MAX(CASE WHEN discipline = 'Reading'
+                        THEN TO_DATE(teststartdate, 'MM/DD/YYYY') - DATE '2013-09-09' END)
+                   AS map_reading_start_date,
+               MAX(EXTRACT(HOUR FROM teststarttime::time)::int) AS map_start_hour,
+               MAX(testritscore) AS map_testritscore
+           FROM clean_data.map
+           GROUP BY studentid, measured_year, season""")
+    with pytest.raises(KeyError):
+        features.map_aggregate_sql(['map_math_testritscore'])
@@ -0,0 +1,171 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tulsa.learn import features, helpers
+
+
+# the one-value-at-a-time implementations the column helpers replaced
+def old_termid_to_ac_year(termid):
+    str_termid = str(termid)
+    if not len(str_termid) == 4:
+        return float('nan')
+    else:
+        key_year = int(str_termid[1])
+        return '1{}_1{}'.format(key_year, key_year+1)
+
+
+def old_season_from_date(date):
+    month = date.month
+    if month >= 8 and month < 13:
+        season = 'fall'
+    elif month >= 0 and month < 3:
+        season = 'winter'
+    elif month >= 3 and month < 8:
+        season = 'spring'
+    return season
+
+
+def old_ac_year_from_date(date):
+    season = old_season_from_date(date)
+    if season == 'fall':
+        start_year, end_year = date.year, date.year + 1
+    elif season in ('spring', 'winter'):
+        start_year, end_year = date.year - 1, date.year
+    start_year_2dig = str(start_year)[2:]
+    end_year_2dig = str(end_year)[2:]
+    return '{}_{}'.format(start_year_2dig, end_year_2dig)
+
+
+def old_find_ac_year(year, season):
+    if season == 'fall':
+        start, end = year[-2:], str(int(year) + 1)[-2:]
+    elif season in ['winter', 'spring']:
+        start, end = str(int(year) - 1)[-2:], year[-2:]
+    return '{}_{}'.format(start, end)
+
+
+def old_hour_of_day(timestr):
+    time = datetime.datetime.strptime(timestr, '%H:%M:%S')
+    return time.hour
+
+
+def old_days_since_first_map(datestr):
+    first_map = datetime.datetime(2013, 9, 9).toordinal()
+    this_map = datetime.datetime.strptime(datestr, '%m/%d/%Y').toordinal()
+    return this_map - first_map
+
+
+@pytest.fixture
+def dates():
+    """every day of several academic years, with some missing dates mixed in"""
+    days = pd.Series(pd.date_range('2009-07-01', '2016-08-31', freq='D'))
+    return pd.concat([days, pd.Series([pd.NaT] * 3)], ignore_index=True)
+
+
+def test_seasons_from_dates(dates):
+    seasons = helpers.seasons_from_dates(dates)
+    present = dates.notnull()
+    expected = [old_season_from_date(date) for date in dates[present]]
+    assert seasons[present].tolist() == expected
+    assert seasons[~present].isnull().all()
+    assert [helpers.season_from_date(date) for date in dates[present][::97]] == \
+        expected[::97]
+
+
+def test_ac_years_from_dates(dates):
+    ac_years = helpers.ac_years_from_dates(dates)
+    present = dates.notnull()
+    expected = [old_ac_year_from_date(date) for date in dates[present]]
+    assert ac_years[present].tolist() == expected
+    assert ac_years[~present].isnull().all()
+    assert [helpers.ac_year_from_date(date) for date in dates[present][::97]] == \
+        expected[::97]
+
+
+def test_termids_to_ac_years():
+    termids = pd.Series([2000, 2001, 2101, 2400, 2402, 2500, 2503, 2600,
+                         12, 123, 12345, 0, float('nan'), 2400.0],
+                        dtype=object)
+    ac_years = helpers.termids_to_ac_years(termids)
+    expected = [old_termid_to_ac_year(termid) for termid in termids]
+    for result, old in zip(ac_years, expected):
+        if isinstance(old, float):
+            assert pd.isnull(result)
+        else:
+            assert result == old
+    assert [helpers.termid_to_ac_year(termid) for termid in termids[:8]] == \
+        expected[:8]
+
+
+def test_find_ac_years():
+    years = pd.Series([str(year) for year in range(1999, 2018)] * 3)
+    seasons = pd.Series(np.repeat(['fall', 'winter', 'spring'], 19))
+    ac_years = features.find_ac_years(years, seasons)
+    expected = [old_find_ac_year(year, season)
+                for year, season in zip(years, seasons)]
+    assert ac_years.tolist() == expected
+    assert features.find_ac_year('2014', 'fall') == '14_15'
+    assert features.find_ac_year('2014', 'winter') == '13_14'
+
+
+def test_hours_of_day():
+    timestrs = pd.Series(['{:02d}:{:02d}:{:02d}'.format(hour, minute, second)
+                          for hour in range(24) for minute, second in [(0, 0), (59, 59), (7, 30)]])
+    expected = [old_hour_of_day(timestr) for timestr in timestrs]
+    assert features.hours_of_day(timestrs).tolist() == expected
+    assert [features.hour_of_day(timestr) for timestr in timestrs[::5]] == expected[::5]
+
+
+def test_days_since_first_maps(dates):
+    datestrs = dates.dropna().dt.strftime('%m/%d/%Y').reset_index(drop=True)
+    expected = [old_days_since_first_map(datestr) for datestr in datestrs]
+    assert features.days_since_first_maps(datestrs).tolist() == expected
+    assert [features.days_since_first_map(datestr) for datestr in datestrs[::97]] == \
+        expected[::97]
+
+
+class RecordingEngine(object):
+    """records the statements run in each transaction"""
+
+    def __init__(self):
+        self.transactions = []
+
+    def begin(self):
+        engine = self
+
+        class Transaction(object):
+            def __enter__(self):
+                engine.transactions.append([])
+                return self
+
+            def execute(self, sql):
+                engine.transactions[-1].append(' '.join(sql.split()))
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                return False
+
+        return Transaction()
+
+
+def test_alter_features_add_columns_sql():
+    engine = RecordingEngine()
+    helpers.alter_features_add_columns('temp', ['att_absence', 'school'], 'eventual186', engine)
+    # everything happens in one transaction, in this order
+    assert engine.transactions == [[
+        'CREATE INDEX ON features.temp (studentid, measured_year, season)',
+        'CREATE TABLE features.eventual186_rebuild AS '
+        'SELECT t.*, f.att_absence, f.school '
+        'FROM features.eventual186 t '
+        'LEFT JOIN (SELECT DISTINCT ON (studentid, measured_year, season) '
+        'studentid, measured_year, season, att_absence, school '
+        'FROM features.temp) f '
+        'ON t.studentid = f.studentid '
+        'AND t.measured_year = f.measured_year '
+        'AND t.season = f.season '
+        'ORDER BY t.ctid',
+        'DROP TABLE features.eventual186',
+        'ALTER TABLE features.eventual186_rebuild RENAME TO eventual186',
+        'CREATE INDEX ON features.eventual186 (studentid, measured_year, season)']]
@@ -0,0 +1,46 @@
+"""
+Replacing the clean_data views made from raw tables.
+"""
+import pytest
+
+from tulsa.etl import make_view_from_raw
+
+
+class FakeResult(object):
+    def __init__(self, row):
+        self.row = row
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeCatalogEngine(object):
+    """answers pg_class lookups from relkinds and records everything else"""
+
+    def __init__(self, relkinds):
+        self.relkinds = relkinds
+        self.executed = []
+
+    def execute(self, sql):
+        if 'pg_catalog.pg_class' in sql:
+            name = sql.split("c.relname = '")[1].split("'")[0]
+            relkind = self.relkinds.get(name)
+            return FakeResult(None if relkind is None else (relkind,))
+        self.executed.append(' '.join(sql.split()))
+
+
+@pytest.mark.parametrize('relkind, materialize, dropped', [
+    (None, 'view', []),
+    (None, 'matview', []),
+    # a view replacing a view keeps the views built on it
+    ('v', 'view', []),
+    ('m', 'view', ['DROP MATERIALIZED VIEW clean_data.map CASCADE;']),
+    ('r', 'view', ['DROP TABLE clean_data.map CASCADE;']),
+    ('v', 'matview', ['DROP VIEW clean_data.map CASCADE;']),
+    ('m', 'matview', ['DROP MATERIALIZED VIEW clean_data.map CASCADE;']),
+    ('r', 'table', ['DROP TABLE clean_data.map CASCADE;']),
+])
+def test_drop_for_create(relkind, materialize, dropped):
+    engine = FakeCatalogEngine({'map': relkind})
+    make_view_from_raw.drop_for_create(engine, 'map', materialize)
+    assert engine.executed == dropped
@@ -0,0 +1,165 @@
+"""
+Ordering, fingerprinting and running the ETL steps.
+"""
+import pytest
+
+from tulsa.etl import pipeline
+
+
+def test_topological_order():
+    steps = {'c': {'upstream': ['a', 'b']},
+             'a': {'upstream': []},
+             'd': {'upstream': ['c']},
+             'b': {'upstream': ['a']},
+             'e': {'upstream': []}}
+    ordered = pipeline.topological_order(steps)
+    assert sorted(ordered) == sorted(steps)
+    for step_name, step in steps.items():
+        for upstream in step['upstream']:
+            assert ordered.index(upstream) < ordered.index(step_name)
+    # the order does not depend on the order of the dict
+    assert pipeline.topological_order(dict(reversed(list(steps.items())))) == ordered
+
+    ordered = pipeline.topological_order(pipeline.steps)
+    assert ordered.index('clean-attendance') < ordered.index('make-attendance-view')
+    assert ordered.index('clean-occt') < ordered.index('make-attendance-view')
+
+
+def test_topological_order_cycle():
+    steps = {'a': {'upstream': ['c']},
+             'b': {'upstream': ['a']},
+             'c': {'upstream': ['b']},
+             'd': {'upstream': []}}
+    with pytest.raises(ValueError, match='cycle'):
+        pipeline.topological_order(steps)
+    with pytest.raises(ValueError, match='cycle'):
+        pipeline.topological_order({'a': {'upstream': ['a']}})
+
+
+@pytest.fixture
+def etl_dir(monkeypatch, tmpdir):
+    sql_dir = tmpdir.mkdir('sql')
+    sql_dir.join('map_view.sql').write('CREATE VIEW clean_data.map AS SELECT 1')
+    tmpdir.join('make_view_from_raw.py').write('print("view")')
+    tmpdir.join('corrections.json').write('{"testritscore": "rit"}')
+    monkeypatch.setattr(pipeline, 'ETL_DIR', str(tmpdir))
+    monkeypatch.setattr(pipeline, 'SQL_DIR', str(sql_dir))
+    return tmpdir
+
+
+map_step = {'upstream': ['clean-rsa'],
+            'raw_prefixes': ['map'],
+            'sql': ['map_view.sql'],
+            'scripts': [['make_view_from_raw.py', '--config', '{config}',
+                         '--correction', '{map_corrections}', '--view_name', 'map']]}
+
+
+def test_step_fingerprint(etl_dir):
+    script_args = {'config': str(etl_dir.join('dbcreds.json')),
+                   'map_corrections': str(etl_dir.join('corrections.json'))}
+    upload_hashes = {'map_14_15': 'aaa', 'map_15_16': 'bbb', 'tripod_14_fall': 'ccc'}
+    upstream_fingerprints = {'clean-rsa': 'ddd'}
+
+    def fingerprint(step=map_step, upstream_fingerprints=upstream_fingerprints,
+                    upload_hashes=upload_hashes, script_args=script_args):
+        return pipeline.step_fingerprint('make-map-view', step, upstream_fingerprints,
+                                         upload_hashes, script_args)
+
+    first = fingerprint()
+    assert fingerprint() == first
+    # the db credentials and raw tables the step doesn't read don't matter
+    assert fingerprint(script_args=dict(script_args, config='other.json')) == first
+    assert fingerprint(upload_hashes=dict(upload_hashes, tripod_14_fall='eee')) == first
+    assert fingerprint(upload_hashes=dict(upload_hashes, att_by_day_12_16='fff')) == first
+    # but new raw files, upstream steps and script arguments do
+    assert fingerprint(upload_hashes=dict(upload_hashes, map_15_16='eee')) != first
+    assert fingerprint(upload_hashes=dict(upload_hashes, map_16_17='eee')) != first
+    assert fingerprint(upstream_fingerprints={'clean-rsa': 'eee'}) != first
+    changed_args = dict(map_step, scripts=[map_step['scripts'][0][:-1] + ['map_view']])
+    assert fingerprint(step=changed_args) != first
+
+    # and so do the sql, the script and the files it is given
+    for changed_file in [etl_dir.join('sql', 'map_view.sql'),
+                         etl_dir.join('make_view_from_raw.py'),
+                         etl_dir.join('corrections.json')]:
+        contents = changed_file.read()
+        changed_file.write(contents + '\n')
+        assert fingerprint() != first
+        changed_file.write(contents)
+        assert fingerprint() == first
+
+
+class FakeResult(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeStateEngine(object):
+    """an engine whose clean_data.etl_state and upload_log live in dicts"""
+
+    def __init__(self, recorded, upload_hashes):
+        self.recorded = dict(recorded)
+        self.upload_hashes = upload_hashes
+
+    def execute(self, sql, **params):
+        sql_str = str(sql)
+        if 'CREATE TABLE IF NOT EXISTS clean_data.etl_state' in sql_str:
+            return FakeResult([])
+        if 'FROM clean_data.etl_state' in sql_str:
+            return FakeResult(list(self.recorded.items()))
+        if 'FROM raw_data.upload_log' in sql_str:
+            return FakeResult(list(self.upload_hashes.items()))
+        if 'INSERT INTO clean_data.etl_state' in sql_str:
+            self.recorded[params['step']] = params['fingerprint']
+            return FakeResult([])
+        raise AssertionError('unexpected sql {}'.format(sql_str))
+
+
+fake_steps = {'clean-a': {'upstream': [], 'raw_prefixes': ['a']},
+              'clean-b': {'upstream': [], 'raw_prefixes': ['b']},
+              'view-ab': {'upstream': ['clean-a', 'clean-b'], 'raw_prefixes': []},
+              'view-abc': {'upstream': ['view-ab'], 'raw_prefixes': ['c']}}
+
+
+def fingerprints_of(upload_hashes):
+    fingerprints = {}
+    for step_name in pipeline.topological_order(fake_steps):
+        fingerprints[step_name] = pipeline.step_fingerprint(step_name, fake_steps[step_name],
+                                                            fingerprints, upload_hashes, {})
+    return fingerprints
+
+
+def test_run_pipeline_dry_run(monkeypatch, capsys):
+    old_hashes = {'a_15': 'aaa', 'b_15': 'bbb', 'c_15': 'ccc'}
+    new_hashes = dict(old_hashes, b_15='eee')
+    engine = FakeStateEngine(fingerprints_of(old_hashes), new_hashes)
+    monkeypatch.setattr(pipeline, 'run_step', lambda *args: pytest.fail('dry run ran a step'))
+    assert pipeline.run_pipeline(engine, {}, dry_run=True, steps=fake_steps) == []
+    out = capsys.readouterr().out.splitlines()
+    # a new b file rebuilds b and everything downstream of it
+    assert out == ['up to date clean-a',
+                   'would run clean-b',
+                   'would run view-ab',
+                   'would run view-abc']
+    assert engine.recorded == fingerprints_of(old_hashes)
+
+
+def test_run_pipeline_stops_downstream_of_failures(monkeypatch, capsys):
+    upload_hashes = {'a_15': 'aaa', 'b_15': 'bbb', 'c_15': 'ccc'}
+    engine = FakeStateEngine({}, upload_hashes)
+    ran = []
+
+    def fake_run_step(engine, step_name, step, script_args):
+        ran.append(step_name)
+        if step_name == 'clean-b':
+            raise RuntimeError('bad b file')
+
+    monkeypatch.setattr(pipeline, 'run_step', fake_run_step)
+    assert pipeline.run_pipeline(engine, {}, workers=2, steps=fake_steps) == ['clean-b']
+    assert sorted(ran) == ['clean-a', 'clean-b']
+    fingerprints = fingerprints_of(upload_hashes)
+    assert engine.recorded == {'clean-a': fingerprints['clean-a']}
+    assert 'not running, an upstream step failed: view-ab' in capsys.readouterr().out
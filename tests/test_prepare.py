@@ -0,0 +1,163 @@
+"""
+Imputing, scaling and one hot encoding the label and feature columns.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tulsa.etl.sql_str_normer import normalize_name_generic
+from tulsa.learn import prepare
+
+
+# the column at a time imputation make_imputed_df replaced, with the
+# sklearn Imputer mean written out in pandas
+def old_impute_mean(col, stuterm_df):
+    noninf_col = col.replace([np.inf, -np.inf], np.nan)
+    return pd.DataFrame(noninf_col.fillna(noninf_col.mean()), columns=[col.name])
+
+
+def old_cat_binarizer(col, stuterm_df):
+    from sklearn.preprocessing import LabelBinarizer
+    col_title = col.name
+    lb = LabelBinarizer()
+    col_missing = col.fillna(value='missing')
+    col_missing = col_missing.apply(lambda x: str(x))
+    lb.fit(col_missing)
+    transformed = lb.transform(col_missing)
+    normed_col_names = [normalize_name_generic(col_name, False) for
+                        col_name in lb.classes_]
+    titled_col_names = ['{}___{}'.format(col_title, norm_name) for
+                        norm_name in normed_col_names]
+    bin_cols = pd.DataFrame(transformed, columns=titled_col_names)
+    return bin_cols
+
+
+old_imp_funs = {prepare.impute_mean: old_impute_mean,
+                prepare.cat_binarizer: old_cat_binarizer}
+
+
+def old_make_imputed_col(colname, col, stuterm_df, scale):
+    imp_fun = prepare.imp_fun[colname]
+    imputed = old_imp_funs.get(imp_fun, imp_fun)(col, stuterm_df)
+    imputed_df = pd.DataFrame(imputed)  # make sure return type is dataframe
+    if not scale:  # i.e norm type is false
+        return imputed_df
+    else:
+        scaled_df = prepare.min_max_scale_df(imputed_df)
+        return scaled_df
+
+
+def old_impute_missing_values(label_feature_df, stuterm_df, label_name, scale):
+    imputed_label_feature_df = pd.DataFrame()
+    for col_name in label_feature_df.columns:
+        col = label_feature_df[col_name]
+        col_scale = False if col_name == label_name else scale
+        imputed_col = old_make_imputed_col(col_name, col, stuterm_df, col_scale)
+        imputed_label_feature_df = pd.concat(
+            (imputed_label_feature_df, imputed_col), axis=1)
+    return imputed_label_feature_df
+
+
+def synthetic_label_feature_df(seed, num_rows=200):
+    """a label and features of every kind of imputation, with missing values"""
+    rng = np.random.RandomState(seed)
+
+    def with_missing(values, share=0.2):
+        values = pd.Series(values, dtype=object if values.dtype.kind == 'U' else None)
+        values[rng.rand(num_rows) < share] = np.nan
+        return values
+
+    map_scores = with_missing(rng.normal(190, 15, size=num_rows))
+    map_scores[rng.rand(num_rows) < 0.05] = np.inf
+    return pd.DataFrame({
+        'eventual186': rng.randint(0, 2, size=num_rows),
+        'map_testritscore': map_scores,
+        'tripod_care_mean': with_missing(rng.rand(num_rows) * 5),
+        'female': rng.randint(-1, 2, size=num_rows),
+        'grade_mark_a': with_missing(rng.randint(0, 6, size=num_rows).astype(float)),
+        'att_absence': with_missing(rng.randint(1, 30, size=num_rows).astype(float), 0.6),
+        'ethnicity': with_missing(np.array(['1', '2', '3', '4'])[rng.randint(0, 4, size=num_rows)]),
+        'school': with_missing(np.array(['110', '120 A', '130'])[rng.randint(0, 3, size=num_rows)]),
+        'lunch_status': with_missing(np.array(['F', 'R'])[rng.randint(0, 2, size=num_rows)])})
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('scale', [False, True])
+def test_make_imputed_df_matches_per_column(seed, scale):
+    df = synthetic_label_feature_df(seed)
+    stuterm_df = pd.DataFrame(index=df.index)
+    imputed_df = prepare.make_imputed_df(df, stuterm_df, scale, unscaled_cols=['eventual186'])
+    old_df = old_impute_missing_values(df, stuterm_df, 'eventual186', scale)
+    assert list(imputed_df.columns) == list(old_df.columns)
+    pd.testing.assert_frame_equal(imputed_df, old_df, check_dtype=False)
+    assert imputed_df.notnull().all().all()
+
+
+def test_all_missing_columns_are_zero(caplog):
+    df = synthetic_label_feature_df(0)
+    df['tripod_care_mean'] = np.nan
+    stuterm_df = pd.DataFrame(index=df.index)
+    with caplog.at_level(logging.WARNING):
+        imputed_df = prepare.make_imputed_df(df, stuterm_df, 'l2', unscaled_cols=['eventual186'])
+    assert (imputed_df['tripod_care_mean'] == 0).all()
+    assert imputed_df.notnull().all().all()
+    assert 'tripod_care_mean' in caplog.text
+
+
+@pytest.mark.parametrize('fun', ['mean', 'median', 'most_frequent'])
+def test_impute_fun_all_missing(fun):
+    df = pd.DataFrame({'some': [1.0, np.nan, 1.0, 3.0],
+                       'none': [np.nan] * 4,
+                       'inf': [np.inf, np.nan, -np.inf, np.nan]})
+    imputed_df = prepare.impute_fun(df, fun)
+    assert imputed_df['some'].notnull().all()
+    assert (imputed_df[['none', 'inf']] == 0).all().all()
+    # one column at a time, with no column that has values
+    assert (prepare.impute_fun(df['none'], fun) == 0).all()
+    assert (prepare.impute_fun(df[['none', 'inf']], fun) == 0).all().all()
+
+
+@pytest.mark.parametrize('scale', [False, True])
+def test_sparse_make_imputed_df_matches_dense(scale):
+    df = synthetic_label_feature_df(1)
+    stuterm_df = pd.DataFrame(index=df.index)
+    dense_df = prepare.make_imputed_df(df, stuterm_df, scale, unscaled_cols=['eventual186'])
+    sparse_df = prepare.make_imputed_df(df, stuterm_df, scale, unscaled_cols=['eventual186'],
+                                        sparse=True)
+    binarized_cols = [col_name for col_name in dense_df.columns if '___' in col_name]
+    assert prepare.sparse_columns(sparse_df) == binarized_cols
+    pd.testing.assert_frame_equal(prepare.densify(sparse_df), dense_df, check_dtype=False)
+
+
+def test_cat_binarizer_sparse():
+    col = synthetic_label_feature_df(2)['school']
+    dense = prepare.cat_binarizer(col, None)
+    sparse = prepare.cat_binarizer(col, None, sparse=True)
+    assert list(sparse.columns) == list(dense.columns)
+    assert prepare.sparse_columns(sparse) == list(sparse.columns)
+    pd.testing.assert_frame_equal(prepare.densify(sparse), dense, check_dtype=False)
+
+
+def test_model_matrix_keeps_column_order():
+    df = synthetic_label_feature_df(3)
+    stuterm_df = pd.DataFrame(index=df.index)
+    # one hot encoded columns between the dense ones
+    features_df = df[['ethnicity', 'map_testritscore', 'school', 'grade_mark_a',
+                      'lunch_status', 'tripod_care_mean', 'female', 'att_absence']]
+    X = prepare.make_imputed_df(features_df, stuterm_df, 'l2', sparse=True)
+    dense_X = prepare.densify(X)
+    assert X.columns[0] == 'ethnicity___1' and X.columns[-1] == 'att_absence'
+
+    matrix = prepare.model_matrix(X, allow_sparse=True)
+    assert matrix.format == 'csr'
+    assert matrix.shape == X.shape
+    np.testing.assert_array_equal(matrix.toarray(), dense_X.values.astype(float))
+
+    not_sparse = prepare.model_matrix(X, allow_sparse=False)
+    pd.testing.assert_frame_equal(not_sparse, dense_X)
+    # frames without sparse columns and arrays are left as they are
+    assert prepare.model_matrix(dense_X, allow_sparse=True) is dense_X
+    dense_array = dense_X.values
+    assert prepare.model_matrix(dense_array, allow_sparse=True) is dense_array
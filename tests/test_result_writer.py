@@ -0,0 +1,66 @@
+"""
+Uploading results in the background.
+"""
+import threading
+
+import pandas as pd
+import pytest
+
+from tulsa.learn import model
+from tulsa.learn.result_writer import ResultWriter
+
+
+def test_close_writes_everything_in_order():
+    written = []
+    release = threading.Event()
+
+    def slow_write(df, table_name):
+        release.wait()
+        written.append((table_name, df['value'].tolist()))
+
+    writer = ResultWriter(slow_write)
+    for value in range(5):
+        writer.put(pd.DataFrame({'value': [value]}), 'results')
+    writer.put(pd.DataFrame({'value': [5]}), 'y_preds')
+    # nothing can have been written yet, close has to wait for all of it
+    assert written == []
+    release.set()
+    writer.close()
+    assert written == [('results', [value]) for value in range(5)] + [('y_preds', [5])]
+
+
+def test_close_raises_the_first_error():
+    written = []
+
+    def failing_write(df, table_name):
+        if table_name == 'feat_imp':
+            raise RuntimeError('copy failed for {}'.format(df['value'].tolist()))
+        written.append(table_name)
+
+    writer = ResultWriter(failing_write)
+    writer.put(pd.DataFrame({'value': [0]}), 'results')
+    writer.put(pd.DataFrame({'value': [1]}), 'feat_imp')
+    writer.put(pd.DataFrame({'value': [2]}), 'feat_imp')
+    writer.put(pd.DataFrame({'value': [3]}), 'results')
+    with pytest.raises(RuntimeError, match=r'\[1\]'):
+        writer.close()
+    # nothing after the failure is written
+    assert written == ['results']
+    assert not writer.thread.is_alive()
+
+
+def test_write_results_without_writer(monkeypatch, tmpdir):
+    uploads = []
+    monkeypatch.setattr(model, 'copy_df_to_db',
+                        lambda df, table_name, engine, **kwargs:
+                        uploads.append((df, table_name, kwargs)))
+    tm = model.TulsaModel(None, ['map_testritscore'], 'eventual186', {}, [], [],
+                          False, 'test_run', str(tmpdir), False)
+    assert tm.result_writer is None
+    tm.write_results(['LR', {'C': 1.0}, 'auc', 0.75, 1.5, '15_16', 'by_year',
+                      'eventual186', ['map_testritscore']])
+    (df, table_name, kwargs), = uploads
+    assert table_name == 'results'
+    assert kwargs == {'schema': 'results', 'if_exists': 'append'}
+    assert df.loc[0, 'params'] == "{'C': 1.0}"
+    assert df.loc[0, 'run_name'] == 'test_run_{}'.format(tm.run_number)
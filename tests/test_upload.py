@@ -0,0 +1,76 @@
+"""
+Uploading raw files to postgres.
+"""
+import pandas as pd
+import pytest
+
+from tulsa.etl import upload_csv_xls_tsv_to_postgres as upload
+
+
+class FakeEngine(object):
+    """hands out connections that remember whether they were committed"""
+
+    def __init__(self):
+        self.transactions = []
+
+    def begin(self):
+        engine = self
+
+        class Transaction(object):
+            def __enter__(self):
+                self.connection = object()
+                self.state = 'open'
+                engine.transactions.append(self)
+                return self.connection
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                self.state = 'committed' if exc_type is None else 'rolled back'
+                return False
+
+        return Transaction()
+
+
+@pytest.fixture
+def copies(monkeypatch):
+    calls = []
+    monkeypatch.setattr(upload, 'copy_df_to_connection',
+                        lambda df, table_name, connection, schema, if_exists:
+                        calls.append((len(df), connection, if_exists)))
+    return calls
+
+
+def test_upload_chunks_in_one_transaction(copies):
+    engine = FakeEngine()
+    chunks = [pd.DataFrame({'studentid': [1, 2], 'score': [1.5, 2.0]}),
+              pd.DataFrame({'studentid': [3], 'score': [float('nan')]}),
+              pd.DataFrame({'studentid': [4, 5, 6], 'score': [3.0, 4.0, 5.0]})]
+    assert upload.upload_chunks_to_db(engine, 'map', iter(chunks)) == 6
+    assert len(engine.transactions) == 1
+    transaction = engine.transactions[0]
+    assert transaction.state == 'committed'
+    assert copies == [(2, transaction.connection, 'replace'),
+                      (1, transaction.connection, 'append'),
+                      (3, transaction.connection, 'append')]
+
+
+def test_upload_chunks_type_drift_rolls_back(copies):
+    engine = FakeEngine()
+    chunks = [pd.DataFrame({'studentid': [1, 2], 'score': [1.5, 2.0]}),
+              pd.DataFrame({'studentid': [3], 'score': ['absent']})]
+    with pytest.raises(ValueError):
+        upload.upload_chunks_to_db(engine, 'map', iter(chunks))
+    # the first chunk was copied, but never committed
+    assert len(copies) == 1
+    assert [transaction.state for transaction in engine.transactions] == ['rolled back']
+
+
+def test_read_file_to_df(tmpdir):
+    csv_file = tmpdir.join('map.csv')
+    csv_file.write('StudentID,Score\n1,"1,5"\n2,\n')
+    tsv_file = tmpdir.join('map.tsv')
+    tsv_file.write('StudentID\tScore\n1\t1.5\n')
+    csv_dict = upload.read_file_to_df(str(csv_file), 'map')
+    assert list(csv_dict) == ['map']
+    assert csv_dict['map'].iloc[:, 1].isnull().tolist() == [False, True]
+    tsv_dict = upload.read_file_to_df(str(tsv_file), 'map')
+    assert tsv_dict['map'].iloc[:, 1].tolist() == [1.5]
@@ -0,0 +1,172 @@
+"""
+Bulk upload of DataFrames to postgres.
+
+DataFrame.to_sql sends one INSERT per row, which is slow for the raw files
+and the feature tables. copy_df_to_db lets to_sql create the table (so
+column types are picked the same way as before) and then streams the rows
+through COPY ... FROM STDIN as CSV, a chunk at a time, all in one
+transaction. List cells are written as postgres array literals, the way
+to_sql stored them.
+"""
+import io
+import logging
+import time
+
+import pandas as pd
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, Time
+
+NULL_STR = '\\N'
+
+# the types to_sql gives object columns, by what pandas infers their values are
+object_sql_types = {'datetime': DateTime,
+                    'datetime64': DateTime,
+                    'date': Date,
+                    'time': Time,
+                    'boolean': Boolean,
+                    'integer': BigInteger,
+                    'floating': Float,
+                    'mixed-integer-float': Float}
+
+
+def quote_ident(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def object_column_types(df):
+    """
+    The sql types of the object columns of df, inferred from all their values
+    the way to_sql would. The table is created from an empty frame, where
+    every object column would otherwise be inferred as text.
+
+    :param df: the DataFrame to upload
+    :type df: pandas DataFrame
+    :returns: column names and their sqlalchemy types, text columns left out
+    :rtype: dict
+    """
+    col_types = {}
+    for col in df.columns:
+        if df[col].dtype == object:
+            inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+            if inferred in object_sql_types:
+                col_types[col] = object_sql_types[inferred]
+    return col_types
+
+
+def is_array(value):
+    return isinstance(value, (list, tuple))
+
+
+def array_literal(values):
+    """
+    A list or tuple as a postgres array literal like {a,"b c",NULL}, the
+    text a list sent through to_sql was stored as. Elements are quoted
+    only where postgres would quote them.
+
+    :param values: the cell to convert, nested lists make nested arrays
+    :type values: list or tuple
+    :rtype: str
+    """
+    elements = []
+    for value in values:
+        if is_array(value):
+            elements.append(array_literal(value))
+        elif value is None or (isinstance(value, float) and value != value):
+            elements.append('NULL')
+        else:
+            element = str(value)
+            if (not element or element.upper() == 'NULL' or
+                    any(char in element for char in '{},"\\ \t\n\r')):
+                element = '"{}"'.format(element.replace('\\', '\\\\').replace('"', '\\"'))
+            elements.append(element)
+    return '{' + ','.join(elements) + '}'
+
+
+def write_copy_csv(df, buffer):
+    """
+    Write the rows of df to buffer as the CSV COPY ... FROM STDIN reads,
+    with NULL_STR for missing values and list cells as array literals
+
+    :param df: the rows to write
+    :param buffer: where to write them
+    :type df: pandas DataFrame
+    :type buffer: file like
+    """
+    array_cols = [col for col in df.columns
+                  if df[col].dtype == object and df[col].map(is_array).any()]
+    if array_cols:
+        df = df.copy()
+        for col in array_cols:
+            df[col] = df[col].map(lambda value: array_literal(value) if is_array(value) else value)
+    df.to_csv(buffer, index=False, header=False, na_rep=NULL_STR)
+
+
+def copy_df_to_db(df, table_name, engine, schema=None, if_exists='fail',
+                  chunksize=100000):
+    """
+    Upload df to table_name using COPY, in a transaction of its own.
+    Takes the same if_exists values as DataFrame.to_sql.
+
+    :param df: the DataFrame to upload, its index is not uploaded
+    :param table_name: the table to upload to
+    :param engine: the engine to use
+    :param schema: the schema of the table
+    :param if_exists: 'fail', 'replace' or 'append'
+    :param chunksize: how many rows to buffer for each COPY
+    :type df: pandas DataFrame
+    :type table_name: str
+    :type engine: sqlalchemy engine
+    :type schema: str
+    :type if_exists: str
+    :type chunksize: int
+    """
+    # the table is only created or replaced if all the rows get copied
+    with engine.begin() as connection:
+        copy_df_to_connection(df, table_name, connection, schema=schema,
+                              if_exists=if_exists, chunksize=chunksize)
+
+
+def copy_df_to_connection(df, table_name, connection, schema=None, if_exists='fail',
+                          chunksize=100000):
+    """
+    Upload df to table_name using COPY over connection, inside whatever
+    transaction the caller has open, so several frames can be loaded
+    all or nothing.
+    Takes the same if_exists values as DataFrame.to_sql.
+
+    :param df: the DataFrame to upload, its index is not uploaded
+    :param table_name: the table to upload to
+    :param connection: the connection to use, in a transaction
+    :param schema: the schema of the table
+    :param if_exists: 'fail', 'replace' or 'append'
+    :param chunksize: how many rows to buffer for each COPY
+    :type df: pandas DataFrame
+    :type table_name: str
+    :type connection: sqlalchemy connection
+    :type schema: str
+    :type if_exists: str
+    :type chunksize: int
+    """
+    start_time = time.time()
+
+    qualified_name = quote_ident(table_name)
+    if schema:
+        qualified_name = '{}.{}'.format(quote_ident(schema), qualified_name)
+    cols_str = ', '.join(quote_ident(col) for col in df.columns)
+    copy_sql = """COPY {qualified_name} ({cols_str})
+                  FROM STDIN WITH (FORMAT csv, NULL '{null_str}')
+                  """.format(qualified_name=qualified_name,
+                             cols_str=cols_str,
+                             null_str=NULL_STR)
+
+    # create, replace, or check the table with the types to_sql would use
+    df.head(0).to_sql(table_name, connection, schema=schema,
+                      if_exists=if_exists, index=False,
+                      dtype=object_column_types(df))
+    cursor = connection.connection.cursor()
+    for chunk_start in range(0, len(df), chunksize):
+        chunk_buffer = io.StringIO()
+        write_copy_csv(df.iloc[chunk_start:chunk_start + chunksize], chunk_buffer)
+        chunk_buffer.seek(0)
+        cursor.copy_expert(copy_sql, chunk_buffer)
+    logging.debug('copied %s rows to %s in %s seconds',
+                  len(df), qualified_name, time.time() - start_time)
@@ -0,0 +1,72 @@
+"""
+Content hashes of the files loaded into raw_data
+
+Every successful upload is recorded in raw_data.upload_log with the sha1
+of the file it came from, so a file that has not changed since its last
+load can be skipped.
+"""
+import hashlib
+
+import sqlalchemy
+
+UPLOAD_LOG_SQL = """CREATE TABLE IF NOT EXISTS raw_data.upload_log (
+                        file_name text,
+                        table_name text,
+                        sha1 text,
+                        num_rows bigint,
+                        loaded_at timestamp DEFAULT now()
+                    )"""
+
+
+def file_sha1(filename, block_size=2 ** 20):
+    """
+    sha1 of the contents of filename
+
+    :param str filename: the file to hash
+    :returns: hex digest
+    :rtype: str
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def ensure_upload_log(engine):
+    engine.execute(UPLOAD_LOG_SQL)
+
+
+def last_upload_hash(engine, file_name):
+    """
+    The sha1 of the last successful load of file_name
+
+    :params sqlalchemy Engine engine: sql engine to use
+    :params str file_name: the base name of the file
+    :returns: hex digest, or None if it was never loaded
+    :rtype: str
+    """
+    last_hash_sql = sqlalchemy.text("""SELECT sha1
+                                       FROM raw_data.upload_log
+                                       WHERE file_name = :file_name
+                                       ORDER BY loaded_at DESC
+                                       LIMIT 1""")
+    row = engine.execute(last_hash_sql, file_name=file_name).fetchone()
+    return row[0] if row else None
+
+
+def record_upload(engine, file_name, table_name, sha1, num_rows):
+    """
+    Log a successful load of file_name into table_name
+
+    :params sqlalchemy Engine engine: sql engine to use
+    :params str file_name: the base name of the file
+    :params str table_name: the table (or table prefix for workbooks) loaded
+    :params str sha1: the hash of the file that was loaded
+    :params int num_rows: how many rows were loaded
+    """
+    record_sql = sqlalchemy.text("""INSERT INTO raw_data.upload_log
+                                        (file_name, table_name, sha1, num_rows)
+                                    VALUES (:file_name, :table_name, :sha1, :num_rows)""")
+    engine.execute(record_sql, file_name=file_name, table_name=table_name,
+                   sha1=sha1, num_rows=num_rows)
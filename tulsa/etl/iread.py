@@ -3,6 +3,7 @@ Create clean iRead tables and view
 """
 import pandas as pd
 
+from tulsa.bulk_copy import copy_df_to_db
 from tulsa.config import create_engine_from_config_file
 
 config_file = '/path/to/configs/dbcreds.json'
@@ -77,7 +78,7 @@ df = d[cols_to_keep_for_view]
 df = df.append(d2[cols_to_keep_for_view])
 iread_15 = df.loc[df.duplicated('SIS_ID') == False]
 iread_15.columns = [clean_column_name(x) for x in iread_15.columns]
-iread_15.to_sql('iread_14_15', engine, schema='clean_data', index=False)
+copy_df_to_db(iread_15, 'iread_14_15', engine, schema='clean_data')
 
 # 2015-16
 # Like 2013-14 but no missing cols
@@ -5,6 +5,7 @@ Make view of attendance data from clean attendance tables
 import re
 
 from tulsa.config import create_engine_from_config_file
+from tulsa.etl.make_view_from_raw import drop_relation
 
 config_file = '/path/to/configs/dbcreds.json'
 engine = create_engine_from_config_file(config_file)
@@ -45,4 +46,7 @@ def create_view_statement(tablename_dict):
     return view_statement
 
 view_statement = create_view_statement(tablename_year_dict)
+# the view may have been materialized by make_view_from_raw.py --materialize_existing
+drop_relation(engine, 'attendance', 'clean_data')
+drop_relation(engine, 'attendance_view', 'clean_data')
 engine.execute(view_statement)
@@ -107,6 +107,150 @@ def drop_table(engine, table, schemaname):
     engine.execute(dropsql)
 
 
+# how to create and drop each kind of relation clean_data views can be
+create_statements = {'view': 'CREATE OR REPLACE VIEW',
+                     'table': 'CREATE TABLE',
+                     'matview': 'CREATE MATERIALIZED VIEW'}
+drop_statements = {'view': 'DROP VIEW',
+                   'table': 'DROP TABLE',
+                   'matview': 'DROP MATERIALIZED VIEW'}
+
+# columns to index materialized relations on, when they have all of them
+index_col_sets = [['studentid', 'measured_year', 'season'],
+                  ['student_number', 'measured_year'],
+                  ['discipline']]
+
+
+def relation_kind(engine, name, schemaname):
+    '''
+    what kind of relation name is in a schema
+
+    :param engine: the engine to use
+    :type engine: sqlalchemy engine
+    :param name: the relation name
+    :type name: str
+    :param schemaname: the schema name to look in
+    :type schemaname: str
+    :returns: str -- 'table', 'view', 'matview' or None if it doesn't exist
+    '''
+    kind_sql = """SELECT c.relkind
+                  FROM pg_catalog.pg_class c
+                  JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                  WHERE n.nspname = '{schemaname}'
+                    AND c.relname = '{name}';
+                  """.format(schemaname=schemaname, name=name)
+    row = engine.execute(kind_sql).fetchone()
+    if row is None:
+        return None
+    return {'r': 'table', 'v': 'view', 'm': 'matview'}.get(row[0])
+
+
+def drop_relation(engine, name, schemaname):
+    '''
+    drop a table, view or materialized view, cascading if necessary
+
+    :param engine: the engine to use
+    :type engine: sqlalchemy engine
+    :param name: the relation name to drop
+    :type name: str
+    :param schemaname: the schema name from which the relation exists
+    :type schemaname: str
+    '''
+    kind = relation_kind(engine, name, schemaname)
+    if kind in drop_statements:
+        engine.execute('{drop} {schemaname}.{name} CASCADE;'.format(drop=drop_statements[kind],
+                                                                     schemaname=schemaname,
+                                                                     name=name))
+
+
+def drop_for_create(engine, view_name, materialize):
+    '''
+    drop whatever clean_data.view_name is that would stop it being created
+    as materialize. A view being replaced by a view is kept, CREATE OR REPLACE
+    VIEW keeps the views built on it.
+
+    :param engine: the engine to use
+    :type engine: sqlalchemy engine
+    :param view_name: the relation about to be created
+    :type view_name: str
+    :param materialize: one of 'view', 'table' or 'matview'
+    :type materialize: str
+    '''
+    kind = relation_kind(engine, view_name, 'clean_data')
+    if kind is not None and (materialize != 'view' or kind != 'view'):
+        drop_relation(engine, view_name, 'clean_data')
+
+
+def create_index_statements(view_name, colnames_list):
+    '''
+    makes CREATE INDEX statements for the index_col_sets a relation has
+
+    :param view_name: the relation in clean_data to index
+    :type view_name: str
+    :param colnames_list: the columns of the relation
+    :type colnames_list: list[str]
+    :returns: list[str] -- sql create index statements
+    '''
+    return ['CREATE INDEX ON clean_data.{view_name} ({cols});'.format(view_name=view_name,
+                                                                     cols=', '.join(col_set))
+            for col_set in index_col_sets
+            if all(col in colnames_list for col in col_set)]
+
+
+def index_relation(engine, view_name):
+    '''
+    index a materialized relation in clean_data and update its statistics
+    '''
+    colnames_list = list(engine.execute('''SELECT * FROM clean_data.{view_name} LIMIT 0
+                                        '''.format(view_name=view_name)).keys())
+    for index_statement in create_index_statements(view_name, colnames_list):
+        print(index_statement)
+        engine.execute(index_statement)
+    engine.execute('ANALYZE clean_data.{view_name};'.format(view_name=view_name))
+
+
+def refresh_materialized(engine, view_name):
+    '''
+    refresh a materialized view in clean_data.
+    a materialized table is rebuilt by running this script again instead.
+    '''
+    kind = relation_kind(engine, view_name, 'clean_data')
+    if kind == 'matview':
+        engine.execute('REFRESH MATERIALIZED VIEW clean_data.{view_name};'.format(view_name=view_name))
+        engine.execute('ANALYZE clean_data.{view_name};'.format(view_name=view_name))
+        print('refreshed clean_data.{}'.format(view_name))
+    else:
+        print('clean_data.{} is a {}, not a materialized view, nothing to refresh'.format(view_name, kind))
+
+
+def materialize_existing_view(engine, view_name):
+    '''
+    turn a plain view in clean_data, like the demographics view made from the
+    sql files, into an indexed materialized view of the same name.
+    the plain view is kept as {view_name}_view so the materialized view can
+    be refreshed from it.
+
+    :param engine: the engine to use
+    :type engine: sqlalchemy engine
+    :param view_name: the view to materialize
+    :type view_name: str
+    '''
+    kind = relation_kind(engine, view_name, 'clean_data')
+    if kind == 'matview':
+        refresh_materialized(engine, view_name)
+        return
+    elif kind != 'view':
+        raise ValueError('clean_data.{} is a {}, not a view'.format(view_name, kind))
+    drop_relation(engine, view_name + '_view', 'clean_data')
+    engine.execute('''ALTER VIEW clean_data.{view_name} RENAME TO {view_name}_view;
+                   '''.format(view_name=view_name))
+    engine.execute('''CREATE MATERIALIZED VIEW clean_data.{view_name} AS
+                      SELECT * FROM clean_data.{view_name}_view;
+                   '''.format(view_name=view_name))
+    index_relation(engine, view_name)
+    print('materialized clean_data.{}'.format(view_name))
+
+
 def clean_data_create_select_column_from_old(
         old_colnames_list, columns_in_all_tables, corrections):
     '''
@@ -228,10 +372,11 @@ def create_select_statement(tablename, colnames_list, time_from_title):
     return select_statement
 
 
-def create_view_statement(columns_dict, view_name, time_from_title):
+def create_view_statement(columns_dict, view_name, time_from_title, materialize='view'):
     """
     create view statement from all the tables and columns in columns dict
     additionally making dates form titles if specificed
+    materialize as a table or materialized view to run the UNION only once
 
     :param columns_dict: a mapping between table names and their column names
     :type columns_dict: dict[str: list]
@@ -239,6 +384,8 @@ def create_view_statement(columns_dict, view_name, time_from_title):
     :type view_name: str
     :param time_from_title: whether to try and get date information from title
     :type time_from_tile: bool
+    :param materialize: one of 'view', 'table' or 'matview'
+    :type materialize: str
     :returns str: sql create view statement
     """
 
@@ -249,9 +396,10 @@ def create_view_statement(columns_dict, view_name, time_from_title):
                               in columns_dict.items()]
     select_statements = ''' UNION
                         '''.join(select_statements_list)
-    view_statement = """CREATE OR REPLACE VIEW clean_data.{view_name} AS
+    view_statement = """{create} clean_data.{view_name} AS
                         {select_statements};
-                    """.format(select_statements=select_statements,
+                    """.format(create=create_statements[materialize],
+                               select_statements=select_statements,
                                view_name=view_name)
     return view_statement
 
@@ -315,10 +463,15 @@ def main(engine, options):
     clean_dict = {clean_table: column_names(engine, clean_table, 'clean_data')
                   for clean_table in clean_tables}
 
+    materialize = options.materialize
+    drop_for_create(engine, options.view_name, materialize)
     view_statement = create_view_statement(clean_dict,
                                            options.view_name,
-                                           options.time_from_title)
+                                           options.time_from_title,
+                                           materialize)
     engine.execute(view_statement)
+    if materialize != 'view':
+        index_relation(engine, options.view_name)
 
 
 if __name__ == '__main__':
@@ -340,6 +493,18 @@ if __name__ == '__main__':
                       dest='corrections',
                       help='''point to a json dict of column names you want to
                               change''')
+    parser.add_option('-m', '--materialize', dest='materialize',
+                      type='choice', choices=['view', 'table', 'matview'],
+                      default='view',
+                      help='''make the view a plain "view", or an indexed "table"
+                              or "matview" so queries don't rerun the UNION''')
+    parser.add_option('-r', '--refresh', dest='refresh',
+                      action='store_true', default=False,
+                      help='only refresh the materialized view view_name')
+    parser.add_option('-x', '--materialize_existing', dest='materialize_existing',
+                      action='store_true', default=False,
+                      help='''turn the existing plain view view_name into an
+                              indexed materialized view''')
 
     (options, args) = parser.parse_args()
 
@@ -351,5 +516,9 @@ if __name__ == '__main__':
     if not options.view_name:
         print('no destination view name specified use --view_name name')
         sys.exit(1)
+    elif options.refresh:
+        refresh_materialized(engine, options.view_name)
+    elif options.materialize_existing:
+        materialize_existing_view(engine, options.view_name)
     else:
         main(engine, options)
@@ -0,0 +1,345 @@
+"""
+Tulsa Schools Project
+
+Run the ETL steps of the Drakefile, rebuilding only what changed.
+
+Every step has a fingerprint made from
+    * the contents of its sql files and python scripts (and their arguments)
+    * the sha1s of the raw files last loaded into the raw tables it reads
+      (from raw_data.upload_log, see fingerprint.py)
+    * the fingerprints of the steps it depends on
+A step is run only when its fingerprint differs from the one recorded in
+clean_data.etl_state after its last successful run, so a new MAP file
+rebuilds the map view and nothing else. Steps that don't depend on each
+other run at the same time.
+"""
+
+import hashlib
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from optparse import OptionParser
+from os.path import abspath, dirname, isfile, join
+
+import sqlalchemy
+
+from tulsa.config import create_engine_from_config_file
+
+ETL_DIR = dirname(abspath(__file__))
+SQL_DIR = join(ETL_DIR, 'sql')
+
+# the Drakefile steps
+# upstream: steps that have to run first
+# raw_prefixes: prefixes of the raw tables (as named in upload_log) it reads
+# sql: files in sql/ to run in order
+# scripts: python scripts in this dir and their arguments, run in order
+#          after the sql, {config} and {map_corrections} are filled in from
+#          the command line
+steps = {'demographics-view': {'upstream': [],
+                               'raw_prefixes': ['demographics'],
+                               'sql': ['drop_demographics_view.sql',
+                                       'demographics_10_11_pk.sql',
+                                       'demographics_11_12_pk_k.sql',
+                                       'demographics_12_13_pk_1st.sql',
+                                       'demographics_13_14_pk_2nd.sql',
+                                       'demographics_14_15_pk_3rd.sql',
+                                       'demographics_15_16_pk_4th.sql',
+                                       'demographics_view.sql',
+                                       'demographics_dob_fix.sql'],
+                               'scripts': [['make_view_from_raw.py',
+                                            '--config', '{config}',
+                                            '--view_name', 'demographics',
+                                            '--materialize_existing']]},
+         'make-map-view': {'upstream': [],
+                           'raw_prefixes': ['map'],
+                           'scripts': [['make_view_from_raw.py',
+                                        '--config', '{config}',
+                                        '--table_prefix', 'map',
+                                        '--view_name', 'map',
+                                        '--date_cols_from_title',
+                                        '--correction', '{map_corrections}',
+                                        '--materialize', 'matview']]},
+         'make-reenroll-view': {'upstream': [],
+                                'raw_prefixes': ['reenrollment'],
+                                'scripts': [['make_view_from_raw.py',
+                                             '--config', '{config}',
+                                             '--table', 'reenrollment_11_16_renrollment_data_2011_-_2016_fo',
+                                             '--view_name', 'reenroll']]},
+         # the tripod sql joins the clean_data roster tables, made from
+         # the survey_roster and roster raw uploads
+         'clean-tripod': {'upstream': [],
+                          'raw_prefixes': ['tripod', 'survey_roster', 'roster'],
+                          'sql': ['tripod_drop_view.sql',
+                                  'tripod_14_fall.sql',
+                                  'tripod_15_spring.sql',
+                                  'tripod_15_fall.sql',
+                                  'tripod_16_spring.sql',
+                                  'tripod_view.sql']},
+         'make-iread-view': {'upstream': [],
+                             'raw_prefixes': ['iread'],
+                             'scripts': [['iread.py']]},
+         'clean-rsa': {'upstream': [],
+                       'raw_prefixes': ['rsa_logs'],
+                       'sql': ['rsa_logs.sql']},
+         'clean-tfa': {'upstream': [],
+                       'raw_prefixes': ['tfa'],
+                       'sql': ['tfa_13_14.sql',
+                               'tfa_14_15.sql',
+                               'tfa_view.sql']},
+         'clean-attendance': {'upstream': [],
+                              'raw_prefixes': ['attendance'],
+                              'scripts': [['clean_attendance_from_raw.py']]},
+         'make-season-calendar': {'upstream': [],
+                                  'raw_prefixes': [],
+                                  'sql': ['season_calendar.sql']},
+         'clean-daily-attendance': {'upstream': [],
+                                    'raw_prefixes': ['att_by_day'],
+                                    'sql': ['att_by_day_12_16.sql']},
+         'clean-occt': {'upstream': [],
+                        'raw_prefixes': ['occt'],
+                        'sql': ['drop_occt_view.sql',
+                                'occt_2015.sql',
+                                'occt_2014.sql',
+                                'occt_2013.sql',
+                                'occt_view.sql']},
+         # reads the clean_data attendance tables clean-attendance makes
+         'make-attendance-view': {'upstream': ['clean-occt', 'clean-attendance'],
+                                  'raw_prefixes': [],
+                                  'scripts': [['make_view_attendance.py'],
+                                              ['make_view_from_raw.py',
+                                               '--config', '{config}',
+                                               '--view_name', 'attendance',
+                                               '--materialize_existing']]},
+         }
+
+ETL_STATE_SQL = """CREATE TABLE IF NOT EXISTS clean_data.etl_state (
+                       step text PRIMARY KEY,
+                       fingerprint text,
+                       finished_at timestamp DEFAULT now()
+                   )"""
+
+
+def topological_order(steps):
+    """
+    Order the steps so every step comes after its upstream steps
+
+    :param dict steps: step names and their definitions
+    :returns: step names
+    :rtype: list[str]
+    """
+    ordered = []
+    visiting = set()
+
+    def visit(step_name):
+        if step_name in ordered:
+            return
+        if step_name in visiting:
+            raise ValueError('cycle in etl steps at {}'.format(step_name))
+        visiting.add(step_name)
+        for upstream in steps[step_name]['upstream']:
+            visit(upstream)
+        visiting.remove(step_name)
+        ordered.append(step_name)
+
+    for step_name in sorted(steps):
+        visit(step_name)
+    return ordered
+
+
+def read_upload_hashes(engine):
+    """
+    The sha1 of the last load of every raw file, keyed by its table name
+
+    :param engine: the engine to use
+    :type engine: sqlalchemy engine
+    :rtype: dict[str, str]
+    """
+    upload_hashes_sql = """SELECT DISTINCT ON (file_name) table_name, sha1
+                           FROM raw_data.upload_log
+                           ORDER BY file_name, loaded_at DESC"""
+    try:
+        rows = engine.execute(upload_hashes_sql).fetchall()
+    except sqlalchemy.exc.ProgrammingError:
+        # nothing has been uploaded with the fingerprinting uploader yet
+        return {}
+    return {table_name: sha1 for table_name, sha1 in rows}
+
+
+def step_fingerprint(step_name, step, upstream_fingerprints, upload_hashes, script_args):
+    """
+    Hash everything a step's output depends on
+
+    :param str step_name: the step
+    :param dict step: the step definition
+    :param dict upstream_fingerprints: fingerprints of the upstream steps
+    :param dict upload_hashes: raw table names and their file sha1
+    :param dict script_args: values to fill into script arguments
+    :rtype: str
+    """
+    sha1 = hashlib.sha1(step_name.encode())
+    for sql_name in step.get('sql', []):
+        with open(join(SQL_DIR, sql_name), 'rb') as f:
+            sha1.update(f.read())
+    for script in step.get('scripts', []):
+        with open(join(ETL_DIR, script[0]), 'rb') as f:
+            sha1.update(f.read())
+        for arg in script[1:]:
+            # the db credentials don't change the output, other files might
+            sha1.update(arg.encode())
+            if arg != '{config}':
+                value = arg.format(**script_args)
+                if isfile(value):
+                    with open(value, 'rb') as f:
+                        sha1.update(f.read())
+    for table_name in sorted(upload_hashes):
+        if any(table_name.startswith(prefix) for prefix in step['raw_prefixes']):
+            sha1.update('{}={}'.format(table_name, upload_hashes[table_name]).encode())
+    for upstream in sorted(step['upstream']):
+        sha1.update(upstream_fingerprints[upstream].encode())
+    return sha1.hexdigest()
+
+
+def run_sql_file(engine, sql_name):
+    """
+    Run a whole sql file in one transaction.
+    The raw DBAPI cursor is used so % in the sql is left alone.
+    """
+    with open(join(SQL_DIR, sql_name), 'r') as f:
+        sql_str = f.read()
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql_str)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def run_step(engine, step_name, step, script_args):
+    """
+    Run the sql files or script of a step
+    """
+    print('running', step_name)
+    for sql_name in step.get('sql', []):
+        run_sql_file(engine, sql_name)
+    for script in step.get('scripts', []):
+        args = [arg.format(**script_args) for arg in script[1:]]
+        subprocess.check_call([sys.executable, join(ETL_DIR, script[0])] + args,
+                              cwd=ETL_DIR)
+    print('finished', step_name)
+
+
+def record_step(engine, step_name, fingerprint):
+    record_sql = sqlalchemy.text("""INSERT INTO clean_data.etl_state (step, fingerprint, finished_at)
+                                    VALUES (:step, :fingerprint, now())
+                                    ON CONFLICT (step) DO UPDATE
+                                    SET fingerprint = EXCLUDED.fingerprint,
+                                        finished_at = EXCLUDED.finished_at""")
+    engine.execute(record_sql, step=step_name, fingerprint=fingerprint)
+
+
+def run_pipeline(engine, script_args, workers=4, dry_run=False, steps=steps):
+    """
+    Rebuild the steps whose fingerprint changed, running independent steps
+    at the same time. A failed step stops the steps downstream of it.
+
+    :param engine: the engine to use
+    :param dict script_args: values to fill into script arguments
+    :param int workers: how many steps to run at the same time
+    :param bool dry_run: only print the steps that would run
+    :returns: names of the steps that failed
+    :rtype: list[str]
+    """
+    engine.execute(ETL_STATE_SQL)
+    recorded = dict(engine.execute('SELECT step, fingerprint FROM clean_data.etl_state').fetchall())
+    upload_hashes = read_upload_hashes(engine)
+
+    fingerprints = {}
+    for step_name in topological_order(steps):
+        fingerprints[step_name] = step_fingerprint(step_name, steps[step_name],
+                                                   fingerprints, upload_hashes,
+                                                   script_args)
+    to_run = {step_name for step_name in steps
+              if recorded.get(step_name) != fingerprints[step_name]}
+    for step_name in sorted(set(steps) - to_run):
+        print('up to date', step_name)
+    if dry_run:
+        for step_name in sorted(to_run):
+            print('would run', step_name)
+        return []
+
+    done = set(steps) - to_run
+    failed = []
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while to_run or running:
+            # start everything whose upstream steps are done
+            ready = [step_name for step_name in sorted(to_run)
+                     if all(upstream in done for upstream in steps[step_name]['upstream'])]
+            for step_name in ready:
+                to_run.remove(step_name)
+                running[executor.submit(run_step, engine, step_name,
+                                        steps[step_name], script_args)] = step_name
+            if not running:
+                # whatever is left is downstream of a failed step
+                for step_name in sorted(to_run):
+                    print('not running, an upstream step failed:', step_name)
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step_name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print('failed', step_name, e)
+                    failed.append(step_name)
+                    continue
+                record_step(engine, step_name, fingerprints[step_name])
+                done.add(step_name)
+    return failed
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-c', '--config', dest='config_file',
+                      help='where to get database credential file')
+    parser.add_option('-d', '--dir', dest='dir_to_upload',
+                      help='upload the raw files in this dir first')
+    parser.add_option('-n', '--names', dest='file_table_names_file_path',
+                      help='where the file_table_names json file is stored')
+    parser.add_option('-m', '--map_corrections', dest='map_corrections',
+                      help='json dict of MAP column names to change')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=4,
+                      help='how many steps to run at the same time')
+    parser.add_option('--dry_run', dest='dry_run', action='store_true', default=False,
+                      help='only print the steps that would run')
+
+    (options, args) = parser.parse_args()
+
+    if not options.config_file:
+        print('no database credentials json file specified use --config /path')
+        sys.exit(1)
+    if not options.map_corrections:
+        print('no MAP corrections json file specified use --map_corrections /path')
+        sys.exit(1)
+
+    if options.dir_to_upload:
+        subprocess.check_call([sys.executable,
+                               join(ETL_DIR, 'upload_csv_xls_tsv_to_postgres.py'),
+                               '--config', options.config_file,
+                               '--dir', options.dir_to_upload,
+                               '--names', options.file_table_names_file_path,
+                               '--workers', str(options.workers)],
+                              cwd=ETL_DIR)
+
+    engine = create_engine_from_config_file(options.config_file)
+    script_args = {'config': options.config_file,
+                   'map_corrections': options.map_corrections}
+    failed = run_pipeline(engine, script_args, options.workers, options.dry_run)
+    if failed:
+        print('these steps failed:', failed)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
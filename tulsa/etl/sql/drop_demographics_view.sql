@@ -1 +1,9 @@
-DROP VIEW IF EXISTS clean_data.demographics;
\ No newline at end of file
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews
+               WHERE schemaname = 'clean_data' AND matviewname = 'demographics') THEN
+        DROP MATERIALIZED VIEW clean_data.demographics;
+    END IF;
+END $$;
+DROP VIEW IF EXISTS clean_data.demographics_view;
+DROP VIEW IF EXISTS clean_data.demographics;
@@ -0,0 +1,39 @@
+--season calendar, the measured_year, season and cal_year of every date.
+--features join dates to terms on cal_date instead of building the
+--season windows over and over. fall starts an academic year in August,
+--winter runs from January to March, and spring from March to August.
+BEGIN;
+DROP TABLE IF EXISTS clean_data.season_calendar;
+CREATE TABLE clean_data.season_calendar AS
+WITH dates AS (
+    SELECT
+        cal_date::date AS cal_date,
+        EXTRACT(YEAR FROM cal_date)::int AS year,
+        EXTRACT(MONTH FROM cal_date)::int AS month
+    FROM
+        generate_series('2000-01-01'::date, '2039-12-31'::date, '1 day') AS cal_date
+),
+terms AS (
+    SELECT
+        cal_date,
+        year,
+        CASE WHEN month >= 8 THEN year ELSE year - 1 END AS start_year,
+        CASE
+            WHEN month >= 8 THEN 'fall'
+            WHEN month < 3 THEN 'winter'
+            ELSE 'spring'
+        END AS season
+    FROM
+        dates
+)
+SELECT
+    cal_date,
+    LPAD((start_year % 100)::text, 2, '0') || '_' ||
+        LPAD(((start_year + 1) % 100)::text, 2, '0') AS measured_year,
+    season,
+    year % 100 AS cal_year
+FROM
+    terms;
+ALTER TABLE clean_data.season_calendar ADD PRIMARY KEY (cal_date);
+CREATE INDEX ON clean_data.season_calendar (measured_year, season);
+COMMIT;
@@ -7,32 +7,35 @@ Tulsa team, DSSG 2016
 
 import json
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from optparse import OptionParser
-from os import listdir
-from os.path import abspath, basename, isfile, join
+from os import listdir, stat
+from os.path import abspath, basename, getsize, isfile, join
 import pandas as pd
 
+from tulsa.bulk_copy import copy_df_to_connection, copy_df_to_db
 from tulsa.config import create_engine_from_config_file
+from tulsa.etl import fingerprint
 from tulsa.etl.sql_str_normer import normalize_name_generic
 
 
-def read_file_to_df(filename):
+def read_file_to_df(filename, table_name):
     """
     Take tablenames and a filename, read format from file extension (csv, tsv, or xsl(x))
     and return a dictionary of dataframes, keyed by table name.
 
     :param str filename: the filename to read
+    :param str table_name: the table (or table prefix for workbooks) to load into
     :returns: dictionary of table_names and their DataFrames
     :rtype: dict[str,pandas.DataFrame]
     """
     basefile = basename(filename)
-    global file_table_names
-    table_name = file_table_names[basefile]
     filename_parts = basefile.split('.')
     filename_extension = filename_parts[-1]
 
-    read_methods = {'csv': lambda x: pd.read_csv(x, engine='python'),
-                    'tsv': lambda x: pd.read_csv(x, sep='\t'),
+    read_methods = {'csv': lambda x: pd.read_csv(x, engine='c'),
+                    'tsv': lambda x: pd.read_csv(x, sep='\t', engine='c'),
                     'xls': lambda x: pd.read_excel(x, sheetname=None),
                     'xlsx': lambda x: pd.read_excel(x, sheetname=None)}
     read_result = read_methods[filename_extension](filename)
@@ -57,22 +60,137 @@ def read_file_to_df(filename):
     return df_dict
 
 
+def read_file_chunks(filename, table_name, chunksize):
+    """
+    Read a csv or tsv file chunksize rows at a time with the C parser.
+    Column names are normalized once and given to every chunk.
+
+    :param str filename: the filename to read
+    :param str table_name: the table to load into, used in error messages
+    :param int chunksize: how many rows to read at a time
+    :returns: generator of DataFrames
+    :rtype: generator
+    """
+    filename_extension = basename(filename).split('.')[-1]
+    seps = {'csv': ',',
+            'tsv': '\t'}
+    if filename_extension not in seps:
+        raise ValueError("Unsupported extension for streaming {table_name}: {ext}".format(
+            table_name=table_name, ext=filename_extension))
+    reader = pd.read_csv(filename, sep=seps[filename_extension],
+                         engine='c', chunksize=chunksize)
+
+    def normalized_chunks():
+        columns = None
+        for chunk in reader:
+            if columns is None:
+                # rename columns to not have symbols
+                columns = [normalize_name_generic(str(x), remove_leading_nums=False)
+                           for x in chunk.columns]
+            chunk.columns = columns
+            yield chunk
+    return normalized_chunks()
+
+
+def upload_chunks_to_db(engine, table_name, chunks, schema='raw_data'):
+    """
+    Upload DataFrame chunks of one file to a single table.
+    The table is made from the first chunk, with integer columns widened to
+    float since a later chunk may have missing values in them.
+    Later chunks that have text where the table has numbers raise a
+    ValueError, upload that file without streaming instead.
+    All the chunks are copied in one transaction, so if any of them fails
+    the table is left as it was before the upload.
+
+    :params sqlalchemy Engine engine: sql engine to upload to
+    :params str table_name: table to upload to
+    :params generator chunks: DataFrames to upload
+    returns: how many rows were uploaded
+    rtype: int
+    """
+    numeric_cols = None
+    num_rows = 0
+    with engine.begin() as connection:
+        for chunk in chunks:
+            if numeric_cols is None:
+                int_cols = chunk.select_dtypes(include=['integer']).columns
+                chunk[int_cols] = chunk[int_cols].astype(float)
+                numeric_cols = set(chunk.select_dtypes(include=['number']).columns)
+                if_exists = 'replace'
+            else:
+                text_cols = numeric_cols - set(chunk.select_dtypes(include=['number']).columns)
+                if text_cols:
+                    raise ValueError('{table_name}: columns {cols} are numbers in the first '
+                                     'chunk but not after row {num_rows}'.format(
+                                         table_name=table_name,
+                                         cols=sorted(text_cols),
+                                         num_rows=num_rows))
+                if_exists = 'append'
+            copy_df_to_connection(chunk, table_name, connection, schema=schema,
+                                  if_exists=if_exists)
+            num_rows += len(chunk)
+    print('success', table_name, num_rows, 'rows')
+    return num_rows
+
+
 def upload_df_to_db(engine, df_dict, schema='raw_data'):
     """
     Take an engine and dataframe to upload dataframe to engine.
-    Use chunking strategy to prevent memory issues.
+    Rows are sent with COPY, a chunk at a time to prevent memory issues.
 
     :params sqlalchemy Engine engine: sql engine to upload to
     :params dict df_dict: dict of dataframes to upload
-    returns: None
-    rtype: None
+    returns: how many rows were uploaded
+    rtype: int
     """
+    num_rows = 0
     for table_name, df in df_dict.items():
-        df_shape = df.shape
-        chunksize = df_shape[0] // 10 + 1
-        df.to_sql(table_name, engine, index=False, schema=schema,
-                  if_exists='replace', chunksize=chunksize)
+        copy_df_to_db(df, table_name, engine, schema=schema, if_exists='replace')
+        num_rows += len(df)
         print('success', table_name)
+    return num_rows
+
+
+def file_version(filename):
+    file_stat = stat(filename)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def upload_file(filename, table_name, config_file, chunksize=None, force=False):
+    """
+    Hash, read and upload one file over its own connection, unless it is the
+    same as its last successful load.
+    This runs in a worker process, so it makes its own engine, and files are
+    hashed in parallel too.
+
+    :param str filename: the file to upload
+    :param str table_name: the table (or table prefix for workbooks) to load into
+    :param str config_file: where to get database credential file
+    :param int chunksize: stream csv and tsv files this many rows at a time
+    :param bool force: upload the file even if it has not changed
+    :returns: how many rows were uploaded, how long it took in seconds, and
+              the sha1 of the file, or None if the file was skipped
+    :rtype: tuple (int, float, str)
+    """
+    start_time = time.time()
+    engine = create_engine_from_config_file(config_file)
+    try:
+        version = file_version(filename)
+        sha1 = fingerprint.file_sha1(filename)
+        if not force and fingerprint.last_upload_hash(engine, basename(filename)) == sha1:
+            return None
+        if chunksize and filename.split('.')[-1] in ('csv', 'tsv'):
+            chunks = read_file_chunks(filename, table_name, chunksize)
+            num_rows = upload_chunks_to_db(engine, table_name, chunks)
+        else:
+            df_dict = read_file_to_df(filename, table_name)
+            num_rows = upload_df_to_db(engine, df_dict)
+        # the sha1 has to be of what was loaded
+        if file_version(filename) != version:
+            raise ValueError('{} changed while it was being uploaded'.format(filename))
+    finally:
+        engine.dispose()
+    return num_rows, time.time() - start_time, sha1
 
 
 def main():
@@ -89,6 +207,12 @@ def main():
                       help='where to get database credential file')
     parser.add_option('-n', '--names', dest='file_table_names_file_path',
                       help='where the file_table_names json file is stored')
+    parser.add_option('-s', '--chunksize', dest='chunksize', type='int',
+                      help='stream csv and tsv files this many rows at a time')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=1,
+                      help='how many files to upload at the same time')
+    parser.add_option('--force', dest='force', action='store_true', default=False,
+                      help='upload files even if they have not changed since their last load')
 
     (options, args) = parser.parse_args()
 
@@ -111,12 +235,45 @@ def main():
     engine = create_engine_from_config_file(options.config_file)
 
     with open(options.file_table_names_file_path, 'r') as f:
-        global file_table_names
         file_table_names = json.load(f)
 
-    for filename in filenames_to_upload:
-        df_dict = read_file_to_df(filename)
-        upload_df_to_db(engine, df_dict)
+    # the workers skip files that are the same as their last successful load
+    fingerprint.ensure_upload_log(engine)
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = {executor.submit(upload_file, filename,
+                                   file_table_names[basename(filename)],
+                                   options.config_file, options.chunksize,
+                                   options.force):
+                   (filename, file_table_names[basename(filename)])
+                   for filename in filenames_to_upload}
+        for future in as_completed(futures):
+            filename, table_name = futures[future]
+            try:
+                uploaded = future.result()
+            except Exception as e:
+                print('failed', basename(filename), e)
+                failed.append(filename)
+                continue
+            if uploaded is None:
+                print('unchanged since last load, skipping', basename(filename))
+                continue
+            num_rows, seconds, sha1 = uploaded
+            fingerprint.record_upload(engine, basename(filename), table_name,
+                                      sha1, num_rows)
+            seconds = max(seconds, 1e-6)
+            print('loaded {file_name}: {num_rows} rows in {seconds:.1f}s, '
+                  '{rows_per_s:.0f} rows/s, {mb_per_s:.2f} MB/s'.format(
+                      file_name=basename(filename),
+                      num_rows=num_rows,
+                      seconds=seconds,
+                      rows_per_s=num_rows / seconds,
+                      mb_per_s=getsize(filename) / 1e6 / seconds))
+
+    if failed:
+        print('these files failed to upload:', failed)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
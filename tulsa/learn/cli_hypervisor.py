@@ -1,4 +1,5 @@
 from tulsa.learn import model
+from tulsa.learn.feature_store import make_feature_store
 from tulsa.learn.feature_groups import feature_groups
 from tulsa.config import create_engine_from_config_file
 
@@ -34,8 +35,20 @@ import json
                       Set to "standard" to output risks
                       Set to "with_recs" to use experimental function that recommends
                               areas of improvement''')
+@click.option('--feature-workers', default=1,
+              help='how many features to generate at the same time, keep below the db connection limit')
+@click.option('--feature-store', default='postgres',
+              type=click.Choice(['postgres', 'npy']),
+              help='where to save and load features, "npy" keeps a file per column')
+@click.option('--feature-store-location', default='/mnt/data/tulsa/features',
+              help='root directory of the "npy" feature store')
+@click.option('--feature-version', default='1',
+              help='version of the features in the "npy" store, bump it when features change')
+@click.option('--model-workers', default=1,
+              help='how many models to fit at the same time, each gets its share of the cores')
 def main(dbcreds, params_file, log_level, log_location, regenerate,
-         run_name, state_location, report):
+         run_name, state_location, report, feature_workers,
+         feature_store, feature_store_location, feature_version, model_workers):
     """Run all the models!!!!
 
     You will need to specify the database credentials for DBCREDS and a
@@ -57,7 +70,8 @@ def main(dbcreds, params_file, log_level, log_location, regenerate,
             },
             "metrics_to_make": [],
             "split_strategy": ["predict_new"],
-            "scale": true
+            "scale": true,
+            "sparse": false
         }
 
     The potential values for each key are as follows:
@@ -72,6 +86,8 @@ def main(dbcreds, params_file, log_level, log_location, regenerate,
                                   see metrics.py for more information
         * split_strategy: ['cohort', 'predict_new']
                                   see splits.py for more information
+        * sparse: true to keep one hot encoded categorical features (like
+                  school and tfa_teacher) sparse, optional
 
 
     Note that each "model to make" takes a dictionary that is used by
@@ -103,6 +119,10 @@ def main(dbcreds, params_file, log_level, log_location, regenerate,
         scale = params['scale']
     except KeyError:
         scale = None
+    try:
+        sparse = params['sparse']
+    except KeyError:
+        sparse = False
     # create engine
     engine = create_engine_from_config_file(dbcreds)
 
@@ -125,7 +145,15 @@ def main(dbcreds, params_file, log_level, log_location, regenerate,
                               regenerate,
                               run_name,
                               state_location,
-                              scale)
+                              scale,
+                              feature_workers,
+                              make_feature_store(feature_store,
+                                                 engine,
+                                                 label_name,
+                                                 feature_store_location,
+                                                 feature_version),
+                              model_workers,
+                              sparse)
 
         logging.info('Initializing Tulsa model')
 
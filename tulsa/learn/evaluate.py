@@ -6,19 +6,21 @@ test/train split groups for its respective scikit-learn's machine learning
 algorithm.
 """
 from tulsa.learn import metrics
+from tulsa.learn import prepare
 from tulsa.learn.importances import feature_importance 
 
 import logging
 import time
+from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import cpu_count
 import pandas as pd
 
 from sklearn import svm
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 from sklearn.ensemble import GradientBoostingClassifier, AdaBoostClassifier
-from sklearn.grid_search import ParameterGrid
-from sklearn.linear_model import LogisticRegression, Perceptron, SGDClassifier, OrthogonalMatchingPursuit, RandomizedLogisticRegression
-from sklearn.neighbors.nearest_centroid import NearestCentroid
+from sklearn.linear_model import LogisticRegression, Perceptron, SGDClassifier, OrthogonalMatchingPursuit
+from sklearn.model_selection import ParameterGrid
 from sklearn.naive_bayes import GaussianNB, MultinomialNB, BernoulliNB
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.neighbors import KNeighborsClassifier
@@ -35,74 +37,191 @@ clfs = {'LR': LogisticRegression(),
         'KNN': KNeighborsClassifier()
         }
 
+# classifiers that are given sparse features as a CSR matrix, the others
+# get sparse features made dense
+sparse_clfs = frozenset(['LR', 'RF', 'ET', 'SVM', 'DT', 'SGD', 'KNN'])
 
-def fit_models_and_metrics(X_train, X_test, y_train, y_test, models_to_make,
-                           metrics_to_make):
+
+def fit_model(model_name, params, X_train, y_train, X_test, n_jobs):
     """
-    Runs all the models with the respective parameters and generates all
-    the metrics.
+    Fits a fresh copy of clfs[model_name] with params and predicts X_test.
+    This is the unit of work that gets sent to worker processes, so it
+    never touches the shared classifiers in clfs.
+
+    :param model_name: a key of clfs
+    :param params: one point of the model's parameter grid
+    :param n_jobs: how many cores the classifier may use, if it can
+    :type model_name: str
+    :type params: dict
+    :type n_jobs: int
+    :returns: y_pred_probs, run_time, and feat_imp_df (None if the model
+              does not support feature importances)
+    :rtype: tuple (numpy array, float, pandas DataFrame)
+    """
+    clf = clone(clfs[model_name])
+    # try to multithread if possible
+    try:
+        clf.set_params(n_jobs=n_jobs, **params)
+    except ValueError:
+        clf.set_params(**params)
+
+    logging.debug('classifier is %s', clf)
+
+    # do the machine learning
+    start_time = time.time()
+    allow_sparse = model_name in sparse_clfs
+    fitted_model = clf.fit(prepare.model_matrix(X_train, allow_sparse), y_train)
+    X_test_matrix = prepare.model_matrix(X_test, allow_sparse)
+    if hasattr(clf, 'predict_proba'):
+        y_pred_probs = fitted_model.predict_proba(X_test_matrix)[:, 1]
+        logging.info("I'm using predict_proba")
+    else:
+        y_pred_probs = fitted_model.decision_function(X_test_matrix)
+        logging.info("I'm using decision_function")
+    end_time = time.time()
+    run_time = end_time - start_time
+
+    # make feature importances if we can
+    feat_imp_df = None
+    if model_name in ['RF', 'LR']:  # only things that support fi.
+        feat_imp_df = feature_importance(model_name,
+                                         fitted_model,
+                                         X_train,
+                                         params)
+    return y_pred_probs, run_time, feat_imp_df
+
+
+# the splits of the running fit_splits, set once in each worker process so
+# the feature matrices are not pickled again for every grid task
+_worker_splits = None
+
+
+def init_worker(splits):
+    global _worker_splits
+    _worker_splits = splits
+
+
+def fit_split_model(split_index, model_name, params, n_jobs):
+    """
+    fit_model on split split_index of the splits the worker process was
+    started with by init_worker
+    """
+    X_train, X_test, y_train, y_test = _worker_splits[split_index]
+    return fit_model(model_name, params, X_train, y_train, X_test, n_jobs)
+
+
+def make_grid_tasks(models_to_make):
+    """
+    Lists every (model name, params) to fit
 
+    :param models_to_make: model names and their parameter grids
+    :type models_to_make: dict
+    :returns: the grid tasks, and how big each model's grid is
+    :rtype: tuple (list of tuples (model_name, params), dict[str, int])
+    """
+    grid_tasks = []
+    grid_sizes = {}
+    for model_name, params_dict in models_to_make.items():
+        param_grid = ParameterGrid(params_dict)
+        grid_sizes[model_name] = len(param_grid)
+        grid_tasks.extend((model_name, params) for params in param_grid)
+    return grid_tasks, grid_sizes
+
+
+def make_results(grid_tasks, grid_sizes, fits, X_test, y_test, metrics_to_make):
+    """
+    Makes the metrics, feat_imps and y_preds of one split from its fits
+
+    :param fits: the output of fit_model for each of grid_tasks
     :returns: model metric results, and feat_imps, and feat_crosstab, and y_preds
-    :rtype: list of tuples (model_name, params_list, metric_name,
-            metric_value)
     """
     result_list = []
     feat_imp_df = pd.DataFrame()
     feat_crosstab = pd.DataFrame()
     y_preds_df = pd.DataFrame()
 
-    # iterate ver model name and params
-    for model_name, params_dict in models_to_make.items():
-        clf = clfs[model_name]
-        param_grid = ParameterGrid(params_dict)
-        for params in param_grid:
-
-            # try to multithread if possible
-            try:
-                n_jobs = cpu_count()
-                clf.set_params(n_jobs=n_jobs, **params)
-            except ValueError:
-                clf.set_params(**params)
-
-            logging.debug('classifier is %s', clf)
-
-            # do the machine learning
-            start_time = time.time()
-            fitted_model = clf.fit(X_train, y_train)
-            if hasattr(clf, 'predict_proba'):
-                y_pred_probs = fitted_model.predict_proba(X_test)[:, 1]
-                logging.info("I'm using predict_proba")
+    for (model_name, params), (y_pred_probs, run_time, curr_feat_imp_df) in zip(grid_tasks, fits):
+        # make metrics given y preds
+        metric_values = metrics.make_metrics(metrics_to_make, y_pred_probs,
+                                             y_test, X_test, model_name, params)
+        for metric_name, metric_value in zip(metrics_to_make, metric_values):
+            if ('crosstab_at_' in metric_name):
+                metric_value['model_name'] = model_name
+                feat_crosstab = feat_crosstab.append(metric_value)
             else:
-                y_pred_probs = fitted_model.decision_function(X_test)
-                logging.info("I'm using decision_function")
-            end_time = time.time()
-            run_time = end_time - start_time
-
-            # make metrics given y preds
-            for metric_name in metrics_to_make:
-                metric_value = metrics.make_metric(metric_name, y_pred_probs,
-                                                   y_test, X_test, model_name, params)
-
-                if ('crosstab_at_' in metric_name):
-                    metric_value['model_name'] = model_name
-                    feat_crosstab = feat_crosstab.append(metric_value)
-                else:
-                    model_metric_list = [model_name, params, metric_name, metric_value, run_time]
-                    result_list.append(model_metric_list)
-
-            # make feature importances if we can
-            if model_name in ['RF', 'LR']:  # only things that support fi.
-                curr_feat_imp_df = feature_importance(model_name,
-                                                      fitted_model,
-                                                      X_train,
-                                                      params)
-                feat_imp_df = feat_imp_df.append(curr_feat_imp_df)
-
-            # export the predictions
-            # but ONLY IF THE PARAM GRID IF LENGTH ONE.
-            # so pretune your model, find the params you like
-            # then get your preds.
-            if len(param_grid) == 1:
-                y_preds_df = pd.DataFrame(y_pred_probs, columns=['y_preds'])
+                model_metric_list = [model_name, params, metric_name, metric_value, run_time]
+                result_list.append(model_metric_list)
+
+        if curr_feat_imp_df is not None:
+            feat_imp_df = feat_imp_df.append(curr_feat_imp_df)
+
+        # export the predictions
+        # but ONLY IF THE PARAM GRID IF LENGTH ONE.
+        # so pretune your model, find the params you like
+        # then get your preds.
+        if grid_sizes[model_name] == 1:
+            y_preds_df = pd.DataFrame(y_pred_probs, columns=['y_preds'])
 
     return result_list, feat_imp_df, feat_crosstab, y_preds_df
+
+
+def fit_splits(splits, models_to_make, metrics_to_make, n_workers=1):
+    """
+    Runs all the models with the respective parameters on every split, and
+    generates all the metrics.
+    With n_workers above 1 every (split, model, params) fit is queued at once
+    on one pool of that many worker processes, and each classifier gets an
+    even share of the cores as its n_jobs so the two levels of parallelism
+    don't oversubscribe the machine.
+    The splits are sent to each worker process once, when it starts, and
+    the fits only send which split to use.
+    Results are yielded split by split in the order of splits, as soon as all
+    of a split's fits are done, with metrics made in grid order so the output
+    is the same as running serially.
+
+    :param splits: (X_train, X_test, y_train, y_test) of each split
+    :param n_workers: how many models to fit at the same time
+    :type splits: list of tuples
+    :type n_workers: int
+    :returns: generator of model metric results, and feat_imps, and
+              feat_crosstab, and y_preds, one for each split
+    """
+    grid_tasks, grid_sizes = make_grid_tasks(models_to_make)
+    n_jobs = max(1, cpu_count() // n_workers)
+
+    if n_workers > 1:
+        splits = list(splits)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker,
+                                 initargs=(splits,)) as executor:
+            split_futures = [[executor.submit(fit_split_model, split_index,
+                                              model_name, params, n_jobs)
+                              for model_name, params in grid_tasks]
+                             for split_index in range(len(splits))]
+            for (X_train, X_test, y_train, y_test), futures in zip(splits, split_futures):
+                fits = [future.result() for future in futures]
+                yield make_results(grid_tasks, grid_sizes, fits,
+                                   X_test, y_test, metrics_to_make)
+    else:
+        for X_train, X_test, y_train, y_test in splits:
+            fits = [fit_model(model_name, params, X_train, y_train, X_test, n_jobs)
+                    for model_name, params in grid_tasks]
+            yield make_results(grid_tasks, grid_sizes, fits,
+                               X_test, y_test, metrics_to_make)
+
+
+def fit_models_and_metrics(X_train, X_test, y_train, y_test, models_to_make,
+                           metrics_to_make, n_workers=1):
+    """
+    Runs all the models with the respective parameters and generates all
+    the metrics, for a single split. See fit_splits.
+
+    :param n_workers: how many models to fit at the same time
+    :type n_workers: int
+    :returns: model metric results, and feat_imps, and feat_crosstab, and y_preds
+    :rtype: list of tuples (model_name, params_list, metric_name,
+            metric_value)
+    """
+    return next(fit_splits([(X_train, X_test, y_train, y_test)],
+                           models_to_make,
+                           metrics_to_make,
+                           n_workers))
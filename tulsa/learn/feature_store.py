@@ -0,0 +1,185 @@
+"""
+Backends that persist the label and feature matrix of a run between runs.
+
+Every store keeps, for one label, the stuterm columns (studentid,
+measured_year, season), the label and the features, and can hand back any
+subset of those columns.
+
+    * postgres: the features.<label> table, as it has always been
+    * npy: one NumPy file per column under <location>/<label>/<version>,
+           numeric columns are memory-mapped when they are loaded so only
+           the columns asked for are ever read
+"""
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from tulsa.bulk_copy import copy_df_to_db
+from tulsa.learn import helpers
+
+
+class PostgresFeatureStore(object):
+    """ Features stored in the table features.<label_name>
+
+    :param engine: a db engine to use
+    :param label_name: the label the features belong to
+    :type engine: sqlalchemy engine
+    :type label_name: str
+    """
+    def __init__(self, engine, label_name):
+        self.engine = engine
+        self.label_name = label_name
+
+    def existing_columns(self):
+        """The columns already stored for this label
+        :returns: list[str]
+        """
+        get_columns_query = """SELECT column_name
+                                FROM information_schema.columns
+                                WHERE table_schema = 'features'
+                                  AND table_name   = '{label_name}'
+                                  """.format(label_name=self.label_name)
+        fetched = self.engine.execute(get_columns_query).fetchall()
+        return [row[0] for row in fetched]
+
+    def load_columns(self, cols):
+        """Load columns cols from the store
+        :param cols: the columns to load
+        :type cols: list[str]
+        :returns: pandas DataFrame of columns
+        """
+        cols_str = ', '.join(cols)
+        load_feats_sql = """SELECT {cols_str}
+                         FROM features.{label_name}
+                         ;""".format(cols_str=cols_str,
+                                     label_name=self.label_name)
+        return pd.read_sql(load_feats_sql, self.engine)
+
+    def save_all(self, all_data_df):
+        """Replace everything stored for this label with all_data_df
+        :param all_data_df: stuterm columns, label and features
+        :type all_data_df: pandas DataFrame
+        """
+        copy_df_to_db(all_data_df, self.label_name, self.engine,
+                      schema='features', if_exists='replace')
+
+    def add_columns(self, stuterm_df, new_feats_df):
+        """Add new_feats_df to what is stored, matching rows on stuterm
+        :param stuterm_df: the studentid, measured_year, season of each row
+        :param new_feats_df: the feature columns to add
+        :type stuterm_df: pandas DataFrame
+        :type new_feats_df: pandas DataFrame
+        """
+        temp_data_df = pd.concat([stuterm_df, new_feats_df], axis=1)
+        copy_df_to_db(temp_data_df, 'temp', self.engine,
+                      schema='features', if_exists='replace')
+        logging.debug('trying to add %s to features table', list(new_feats_df.columns))
+        helpers.alter_features_add_columns('temp', list(new_feats_df.columns),
+                                           self.label_name, self.engine)
+
+
+class NpyFeatureStore(object):
+    """ Features stored as one .npy file per column in
+    location/label_name/version. Rows are kept in the order they were saved,
+    so columns added later line up with the stuterm columns read back from
+    the same store.
+
+    :param location: the root directory of the store
+    :param label_name: the label the features belong to
+    :param version: the feature version, change it when features change
+    :type location: str
+    :type label_name: str
+    :type version: str
+    """
+    def __init__(self, location, label_name, version):
+        self.dir = os.path.join(location, label_name, version)
+
+    def col_path(self, col):
+        return os.path.join(self.dir, '{}.npy'.format(col))
+
+    def existing_columns(self):
+        """The columns already stored for this label
+        :returns: list[str]
+        """
+        if not os.path.isdir(self.dir):
+            return []
+        return [file_name[:-len('.npy')] for file_name in os.listdir(self.dir)
+                if file_name.endswith('.npy')]
+
+    def load_columns(self, cols):
+        """Load columns cols from the store.
+        Numeric columns come back memory-mapped and read only, strings and
+        other objects are unpickled. The frame is built without copying or
+        consolidating its columns, so each numeric column stays backed by
+        its memory map (pandas 2 and later, older pandas copies them into
+        blocks).
+        :param cols: the columns to load
+        :type cols: list[str]
+        :returns: pandas DataFrame of columns
+        """
+        loaded = {}
+        for col in cols:
+            try:
+                loaded[col] = np.load(self.col_path(col), mmap_mode='r')
+            except ValueError:  # object arrays can't be memory-mapped
+                loaded[col] = np.load(self.col_path(col), allow_pickle=True)
+        return pd.DataFrame(loaded, columns=cols, copy=False)
+
+    def save_columns(self, df):
+        """Write every column of df to its own file, replacing old ones
+        :param df: the columns to write
+        :type df: pandas DataFrame
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        for col in df.columns:
+            values = df[col].to_numpy()
+            # strings and anything else that is not a plain NumPy type are
+            # pickled, like pandas string arrays
+            if values.dtype.kind not in 'biufcmM':
+                values = np.asarray(values, dtype=object)
+            # write to a temp file so a crash never leaves a half written column
+            temp_path = self.col_path(col) + '.tmp'
+            with open(temp_path, 'wb') as col_file:
+                np.save(col_file, values, allow_pickle=values.dtype == object)
+            os.replace(temp_path, self.col_path(col))
+
+    def save_all(self, all_data_df):
+        """Replace everything stored for this label with all_data_df
+        :param all_data_df: stuterm columns, label and features
+        :type all_data_df: pandas DataFrame
+        """
+        for col in self.existing_columns():
+            os.remove(self.col_path(col))
+        self.save_columns(all_data_df)
+
+    def add_columns(self, stuterm_df, new_feats_df):
+        """Add new_feats_df to what is stored
+        :param stuterm_df: the studentid, measured_year, season of each row,
+                           in the order they were loaded from this store
+        :param new_feats_df: the feature columns to add
+        :type stuterm_df: pandas DataFrame
+        :type new_feats_df: pandas DataFrame
+        """
+        self.save_columns(new_feats_df)
+
+
+def make_feature_store(store_type, engine, label_name, location=None, version=None):
+    """Find the feature store to use from its name
+    :param store_type: 'postgres' or 'npy'
+    :param engine: a db engine to use
+    :param label_name: the label the features belong to
+    :param location: root directory of file based stores
+    :param version: the feature version of file based stores
+    :type store_type: str
+    :type engine: sqlalchemy engine
+    :type label_name: str
+    :type location: str
+    :type version: str
+    """
+    if store_type == 'postgres':
+        return PostgresFeatureStore(engine, label_name)
+    elif store_type == 'npy':
+        return NpyFeatureStore(location, label_name, version)
+    else:
+        raise ValueError('unknown feature store {}'.format(store_type))
@@ -7,9 +7,29 @@ features for the model evaluation step.
 
 import pandas as pd
 import numpy as np
-import datetime
 
 from tulsa.learn import helpers
+from tulsa.learn.source_cache import SourceCache
+
+# the columns features need from each table that is read whole
+source_table_columns = {
+    'clean_data.map': ['studentid', 'measured_year', 'season', 'discipline',
+                       'testritscore'],
+    'clean_data.demographics': ['student_number', 'id', 'measured_year',
+                                'start_year', 'grade_level', 'gender',
+                                'ethnicity', 'ok_ell', 'ok_ell_language_code',
+                                'ok_primary_disability_code',
+                                'tps_service_delivery_code', 'lunch_status',
+                                'ok_homeless', 'tps_demographics_lives_with',
+                                'school_id'],
+    'clean_data.rsa_logs': ['student_number', 'subtype', 'entry_date',
+                            'discipline_incidentdate'],
+    'clean_data.season_calendar': ['cal_date', 'measured_year', 'season',
+                                   'cal_year']
+}
+
+# shared by every feature of a run, cleared by the model when it is done
+source_cache = SourceCache(source_table_columns)
 
 
 def stuterm_labels_map_generic(stuterm_df, engine, latest_grade, flipped=False):
@@ -217,91 +237,113 @@ def stuterm_labels_eventual_186_omit_passing(latest_grade, flipped=True):
         stuterm_labels_map_generic_omit_passing(stuterm_df, engine, latest_grade, flipped=True)
 
 
-def get_dem_sql(dem_col, static=False):
+def get_dem_df(engine, static=False):
     """
-    SQL shell for demographics data. If feature is static, then
+    Demographics data from the source cache. If feature is static, then
     most recent record is applied for that student.
 
-    :param dem_col: specific demographics table column name
-    :type dem_col: str
+    :param engine: a db engine to use
+    :type engine: sqlalchemy engine
     :param static: whether demographics feature is static
     :type static: bool
 
-    :returns: full sql statement
-    :rtype: str
+    :returns: demographics data
+    :rtype: pandas DataFrame
     """
-    dem_sql = """
-              SELECT
-                dem.measured_year,
-                dem.student_number
-                , {dem_column}
-              FROM
-                  clean_data.demographics AS dem
-              """.format(dem_column=dem_col)
+    dem_df = source_cache.read_table('clean_data.demographics', engine)
     if static:
-        dem_sql = dem_sql + """INNER JOIN
-                                   (SELECT
-                                       student_number,
-                                       MAX(start_year) AS start_year
-                                   FROM
-                                       clean_data.demographics
-                                   GROUP BY
-                                          student_number) AS most_recent_record
-                               USING (student_number, start_year)"""
-    return dem_sql
+        most_recent_year = dem_df.groupby('student_number')['start_year'] \
+                                 .transform(max)
+        dem_df = dem_df[dem_df['start_year'] == most_recent_year]
+    return dem_df
 
 
-def female_feature(stuterm_df, engine):
+def get_date_terms(dates, engine):
     """
-    Generates whether student is female feature, based on last demographics
-    file student is represented in
+    The measured_year, season and cal_year of dates, from the season calendar
 
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
+    :param dates: the dates to find terms for
+    :type dates: pandas Series of datetimes
     :param engine: a db engine to use
     :type engine: sqlalchemy engine
 
-    :returns: is female feature
+    :returns: terms of the dates, with the index of dates
     :rtype: pandas DataFrame
     """
-    gender_col = """CASE gender
-                        WHEN 'F' THEN 1
-                        WHEN 'M' THEN 0
-                        ELSE -1
-                    END AS is_female
-                 """
-    gender_sql = get_dem_sql(gender_col, static=True)
-    is_female_df = pd.read_sql_query(gender_sql, engine)
-    stuterm_female_df = stuterm_df.merge(is_female_df[['student_number',
-                                                       'is_female']],
-                                         how='left',
-                                         left_on='studentid',
-                                         right_on='student_number')
-    return stuterm_female_df['is_female']
+    calendar_df = source_cache.read_table('clean_data.season_calendar', engine)
+    return helpers.terms_from_dates(dates, calendar_df)
+
 
+def fill_dem_zero(values):
+    return values.fillna('0')
 
-def ethnicity_feature(stuterm_df, engine):
+
+# demographics feature name: (demographics column, whether it is static,
+#                             function making the feature from the column)
+# static features come from the last demographics file a student is
+# represented in, the others from the measured year of the stuterm
+dem_features = {'female': ('gender', True,
+                           lambda gender: gender.map({'F': 1, 'M': 0}).fillna(-1).astype(int)),
+                'ethnicity': ('ethnicity', True, lambda ethnicity: ethnicity),
+                'ell': ('ok_ell', False, fill_dem_zero),
+                'ell_language': ('ok_ell_language_code', False, fill_dem_zero),
+                'disability_code': ('ok_primary_disability_code', False, fill_dem_zero),
+                'service_delivery': ('tps_service_delivery_code', False, fill_dem_zero),
+                'lunch_status': ('lunch_status', False, fill_dem_zero),
+                'homeless': ('ok_homeless', False, fill_dem_zero),
+                'lives_with': ('tps_demographics_lives_with', False, fill_dem_zero),
+                'school': ('school_id', False, fill_dem_zero)}
+
+
+def build_demographics_features(stuterm_df, engine, feature_strs):
     """
-    Generates student ethnicity binary matrix, based on last demographics
-    file student is represented in
+    Generates demographics features from one read of demographics, with
+    one row per student for the static features and one per student and
+    measured year for the others, each joined onto the stuterms once
 
     :param stuterm_df: studentid, year, season data
     :type stuterm_df: pandas DataFrame
     :param engine: a db engine to use
     :type engine: sqlalchemy engine
+    :param feature_strs: names of demographics features in dem_features
+    :type feature_strs: list[str]
 
-    :returns: ethnicity feature 
+    :returns: demographics features
     :rtype: pandas DataFrame
     """
-    ethnicity_col = "ethnicity"
-    ethnicity_sql = get_dem_sql(ethnicity_col, static=True)
-    ethnicity_df = pd.read_sql_query(ethnicity_sql, engine)
-    stuterm_eth_df = stuterm_df.merge(ethnicity_df[['student_number',
-                                                    'ethnicity']],
-                                      how='left',
-                                      left_on='studentid',
-                                      right_on='student_number')
-    return stuterm_eth_df['ethnicity']
+    dem_df = get_dem_df(engine)
+    dem_feats_df = dem_df[['student_number', 'measured_year', 'start_year']].copy()
+    for feature_str in feature_strs:
+        col, static, value_fun = dem_features[feature_str]
+        dem_feats_df[feature_str] = value_fun(dem_df[col])
+
+    static_strs = [feature_str for feature_str in feature_strs
+                   if dem_features[feature_str][1]]
+    yearly_strs = [feature_str for feature_str in feature_strs
+                   if not dem_features[feature_str][1]]
+    stuterm_dem_df = stuterm_df[['studentid', 'measured_year']]
+    if static_strs:
+        most_recent_year = dem_feats_df.groupby('student_number')['start_year'] \
+                                       .transform(max)
+        static_df = dem_feats_df[dem_feats_df['start_year'] == most_recent_year] \
+            .drop_duplicates('student_number') \
+            .set_index('student_number')[static_strs]
+        stuterm_dem_df = stuterm_dem_df.join(static_df, on='studentid')
+    if yearly_strs:
+        yearly_df = dem_feats_df.drop_duplicates(['student_number', 'measured_year']) \
+                                .set_index(['student_number', 'measured_year'])[yearly_strs]
+        stuterm_dem_df = stuterm_dem_df.join(yearly_df, on=['studentid', 'measured_year'])
+    return stuterm_dem_df[feature_strs].reset_index(drop=True)
+
+
+def make_demographics_feature(feature_str):
+    """Make features that utilize the demographics dataset
+    :param feature_str: the name of the feature to make, a key of dem_features
+    :type feature_str: str
+    :returns: function that will accept stuterm_df and engine
+    """
+    return lambda stuterm_df, engine: build_demographics_features(stuterm_df, engine,
+                                                                  [feature_str])[feature_str]
 
 
 def age_feature(stuterm_df, engine):
@@ -364,275 +406,125 @@ def age_feature(stuterm_df, engine):
     return stuterm_age_df['age_in_months']
 
 
-def ell_feature(stuterm_df, engine):
-    """
-    Generates whether students are in ELL feature for that measured year
-
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
-
-    :returns: in ell feature
-    :rtype: pandas DataFrame
-    """
-    ell_col = "CASE WHEN ok_ell IS NULL THEN '0' ELSE ok_ell END AS in_ell"
-    ell_sql = get_dem_sql(ell_col)
-    in_ell_df = pd.read_sql_query(ell_sql, engine)
-    stuterm_ell_df = stuterm_df.merge(in_ell_df, how='left',
-                                      left_on=['studentid',
-                                               'measured_year'],
-                                      right_on=['student_number',
-                                                'measured_year'])
-    return stuterm_ell_df['in_ell']
-
-
-def ell_lang_feature(stuterm_df, engine):
-    """
-    Generates student ELL language feature (if any) for that measured year
-
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
-
-    :returns: ell language code feature
-    :rtype: pandas DataFrame
-    """
-    ell_lang_col = """CASE WHEN ok_ell_language_code IS NULL
-                          THEN '0'
-                      ELSE ok_ell_language_code
-                      END AS language_code"""
-    ell_lang_sql = get_dem_sql(ell_lang_col)
-    ell_lang_df = pd.read_sql_query(ell_lang_sql, engine)
-    stuterm_lang_df = stuterm_df.merge(ell_lang_df, how='left',
-                                       left_on=['studentid',
-                                                'measured_year'],
-                                       right_on=['student_number',
-                                                 'measured_year'])
-    return stuterm_lang_df['language_code']
-
-
-def disability_code_feature(stuterm_df, engine):
-    """
-    Generates student disability type feature for that measured year
-
+def map_season(stuterm_df, engine):
+    """which academic season a test was taken in
     :param stuterm_df: studentid, year, season data
     :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
-
-    :returns: disability code feature
-    :rtype: pandas DataFrame
+    :returns: pandas DataFrame -- map season feature
     """
-    disability_col = """CASE WHEN ok_primary_disability_code IS NULL
-                            THEN '0'
-                        ELSE ok_primary_disability_code
-                        END AS disability_code"""
-    disability_sql = get_dem_sql(disability_col)
-    disability_df = pd.read_sql_query(disability_sql, engine)
-    stuterm_disability_df = stuterm_df.merge(disability_df, how='left',
-                                             left_on=['studentid',
-                                                      'measured_year'],
-                                             right_on=['student_number',
-                                                       'measured_year'])
-    return stuterm_disability_df['disability_code']
-
+    return stuterm_df['season']
 
-def service_delivery_feature(stuterm_df, engine):
-    """
-    Generates student service delivery feature for that measured year
 
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
+def hours_of_day(timestrs):
+    """hour of time of day -- 24H, for each time string
 
-    :returns: service delivery code feature
-    :rtype: pandas DataFrame
+    :param timestrs: time strings in format '%H:%M:%S'
+    :type timestrs: pandas Series
+    :returns: pandas Series of ints
     """
-    service_delivery_col = """CASE WHEN tps_service_delivery_code IS NULL
-                                  THEN '0'
-                              ELSE tps_service_delivery_code
-                              END AS service_delivery_code"""
-    service_delivery_sql = get_dem_sql(service_delivery_col)
-    service_delivery_df = pd.read_sql_query(service_delivery_sql, engine)
-    stuterm_service_delivery_df = stuterm_df.merge(service_delivery_df,
-                                                   how='left',
-                                                   left_on=['studentid',
-                                                            'measured_year'],
-                                                   right_on=['student_number',
-                                                             'measured_year'])
-    return stuterm_service_delivery_df['service_delivery_code']
+    return pd.to_datetime(timestrs, format='%H:%M:%S').dt.hour
 
 
-def lunch_feature(stuterm_df, engine):
-    """
-    Generates student lunch type for that measured year
-
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
+def hour_of_day(timestr):
+    """hour of time of day -- 24H
 
-    :returns: lunch status feature
-    :rtype: pandas DataFrame
+    :param timestr: time string in format '%H:%M:%S'
+    :type timestr: str
+    :returns: int representing hour
     """
-    lunch_col = """CASE WHEN lunch_status IS NULL
-                       THEN '0'
-                       ELSE lunch_status
-                   END AS lunch"""
-    lunch_sql = get_dem_sql(lunch_col)
-    lunch_df = pd.read_sql_query(lunch_sql, engine)
-    stuterm_lunch_df = stuterm_df.merge(lunch_df, how='left',
-                                        left_on=['studentid',
-                                                 'measured_year'],
-                                        right_on=['student_number',
-                                                  'measured_year'])
-    return stuterm_lunch_df['lunch']
+    return hours_of_day(pd.Series([timestr])).iloc[0]
 
 
-def homeless_feature(stuterm_df, engine):
-    """
-    Generates student homelessness for that measured year
-
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
+def days_since_first_maps(datestrs):
+    """number of days since the first MAP test in tulsa was issued,
+    for each date string
+    uses hardcoded first day as 2013/09/09, like map_col_exprs
 
-    :returns: is homeless feature
-    :rtype: pandas DataFrame
+    :param datestrs: date strings in format '%m/%d/%Y'
+    :type datestrs: pandas Series
+    :returns: pandas Series of day counts
     """
-    homeless_col = """CASE WHEN ok_homeless IS NULL
-                          THEN '0'
-                          ELSE ok_homeless
-                      END AS homeless"""
-    homeless_sql = get_dem_sql(homeless_col)
-    homeless_df = pd.read_sql_query(homeless_sql, engine)
-    stuterm_homeless_df = stuterm_df.merge(homeless_df, how='left',
-                                           left_on=['studentid',
-                                                    'measured_year'],
-                                           right_on=['student_number',
-                                                     'measured_year'])
-    return stuterm_homeless_df['homeless']
-
+    first_map = pd.Timestamp(2013, 9, 9)
+    return (pd.to_datetime(datestrs, format='%m/%d/%Y') - first_map).dt.days
 
-def lives_with_feature(stuterm_df, engine):
-    """
-    Generates student guardianship for that measured year
 
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :param engine: a db engine to use
-    :type engine: sqlalchemy engine
+def days_since_first_map(datestr):
+    """number of days since the first MAP test in tulsa was issued
+    uses hardcoded first day as 2013/09/09
 
-    :returns: lives with [parent] type feature
-    :rtype: pandas DataFrame
+    :param datestr: date string in format '%m/%d/%Y'
+    :type datestr: str
+    :returns: int representing day count
     """
-    lives_with_col = """CASE WHEN tps_demographics_lives_with IS NULL
-                            THEN '0'
-                            ELSE tps_demographics_lives_with
-                        END AS lives_with"""
-    lives_with_sql = get_dem_sql(lives_with_col)
-    lives_with_df = pd.read_sql_query(lives_with_sql, engine)
-    stuterm_lives_with_df = stuterm_df.merge(lives_with_df, how='left',
-                                             left_on=['studentid',
-                                                      'measured_year'],
-                                             right_on=['student_number',
-                                                       'measured_year'])
-    return stuterm_lives_with_df['lives_with']
+    return days_since_first_maps(pd.Series([datestr])).iloc[0]
 
 
-def school_feature(stuterm_df, engine):
+def get_map_df(engine, discipline=None):
     """
-    Generates what schools students are enrolled in for that measured year
+    MAP data from the source cache, optionally only for one discipline
 
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
     :param engine: a db engine to use
+    :param discipline: the discipline to keep, like 'Reading', or None for all
     :type engine: sqlalchemy engine
-
-    :returns: school feature
-    :rtype: pandas DataFrame
+    :type discipline: str
+    :returns: pandas DataFrame of map tests
     """
-    school_col = """CASE WHEN school_id IS NULL
-                       THEN '0'
-                       ELSE school_id
-                   END AS school_id"""
-    school_sql = get_dem_sql(school_col)
-    school_df = pd.read_sql_query(school_sql, engine)
-    stuterm_school_df = stuterm_df.merge(school_df, how='left',
-                                         left_on=['studentid',
-                                                  'measured_year'],
-                                         right_on=['student_number',
-                                                   'measured_year'])
-    return stuterm_school_df['school_id']
+    map_df = source_cache.read_table('clean_data.map', engine)
+    if discipline:
+        map_df = map_df[map_df['discipline'] == discipline]
+    return map_df
 
 
-def map_season(stuterm_df, engine):
-    """which academic season a test was taken in
-    :param stuterm_df: studentid, year, season data
-    :type stuterm_df: pandas DataFrame
-    :returns: pandas DataFrame -- map season feature
-    """
-    return stuterm_df['season']
-
-
-def hour_of_day(timestr):
-    """hour of time of day -- 24H
+# the MAP columns that features take the per term max of, the dates are
+# counted in days since the first MAP test in tulsa (2013/09/09)
+map_col_exprs = {'testritscore': 'testritscore',
+                 'testpercentile': 'testpercentile',
+                 'testdurationminutes': 'testdurationminutes',
+                 'percentcorrect': 'percentcorrect',
+                 'start_date': "TO_DATE(teststartdate, 'MM/DD/YYYY') - DATE '2013-09-09'",
+                 'start_hour': 'EXTRACT(HOUR FROM teststarttime::time)::int'}
 
-    :param timestr: time string in format '%H:%M:%S'
-    :type timestr: str
-    :returns: int representing hour
-    """
-    time = datetime.datetime.strptime(timestr, '%H:%M:%S')
-    return time.hour
+# MAP feature name: its aggregate over a stuterm's tests
+map_aggregates = {}
+for map_col, col_expr in map_col_exprs.items():
+    map_aggregates['map_' + map_col] = 'MAX({})'.format(col_expr)
+    map_aggregates['map_reading_' + map_col] = \
+        "MAX(CASE WHEN discipline = 'Reading' THEN {} END)".format(col_expr)
 
 
-def days_since_first_map(datestr):
-    """number of days since the the first MAP test in tulsa was issued
-    uses hardcoded first day as 2013/09/09
+def map_aggregate_sql(feature_strs):
+    """One GROUP BY over clean_data.map that makes all of feature_strs
 
-    :param timestr: time string in format '%H:%M:%S'
-    :type timestr: str
-    :returns: int representing day count
+    :param feature_strs: names of MAP features in map_aggregates
+    :type feature_strs: list[str]
+    :returns: str -- sql with a row per stuterm and a column per feature
     """
-    first_map = datetime.datetime(2013, 9, 9).toordinal()
-    this_map = datetime.datetime.strptime(datestr, '%m/%d/%Y').toordinal()
-    return this_map - first_map
+    aggs_str = ',\n                   '.join('{agg} AS {feature_str}'.format(agg=map_aggregates[feature_str],
+                                                                             feature_str=feature_str)
+                                           for feature_str in sorted(feature_strs))
+    return """SELECT studentid, measured_year, season,
+                   {aggs_str}
+              FROM clean_data.map
+              GROUP BY studentid, measured_year, season""".format(aggs_str=aggs_str)
 
 
-def map_feat_generic(stuterm_df, engine, map_col, where_statement, agg_fun):
-    """Generic function to make map features
+def build_map_features(stuterm_df, engine, feature_strs):
+    """Make MAP features server side, with one query and one merge for all of them
 
-    :param map_col: the column to use in the clean_dat.map table
     :param stuterm_df: studentid, year, season data
-    :param agg_fun: the aggregration function to pass to groupby
     :param engine: a db engine to use
-    :type map_col: str
+    :param feature_strs: names of MAP features in map_aggregates
     :type stuterm_df: pandas DataFrame
-    :type agg_fun: function
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
     """
-    map_select_sql = """select {map_col}, studentid, measured_year, season
-    from clean_data.map {where_statement}""".format(map_col=map_col, where_statement=where_statement)
-
-    map_col_df = pd.read_sql_query(map_select_sql, engine)
-    maxperterm_df = map_col_df.groupby(by=['studentid', 'measured_year',
-                                           'season']).agg(agg_fun) \
-                                                     .reset_index()
-    merged_df = stuterm_df.merge(maxperterm_df,
-                                 how='left',
-                                 left_on=['studentid',
-                                          'measured_year',
-                                          'season'],
-                                 right_on=['studentid',
-                                           'measured_year',
-                                           'season'])
-
-    return merged_df[map_col]
+    map_agg_df = source_cache.read_query(map_aggregate_sql(feature_strs), engine)
+    merged_df = stuterm_df[['studentid', 'measured_year', 'season']].merge(
+        map_agg_df,
+        how='left',
+        on=['studentid', 'measured_year', 'season'])
+    return merged_df[feature_strs]
 
 
 def make_map_feature(feature_str):
@@ -642,50 +534,8 @@ def make_map_feature(feature_str):
     :type feature_str: str
     :returns: function that will accept stuterm_df and engine
     """
-    map_args = {'map_testritscore': {'map_col': 'testritscore',
-                                     'where_statement': "",
-                                     'agg_fun': np.max},
-                'map_testpercentile': {'map_col': 'testpercentile',
-                                       'where_statement': "",
-                                       'agg_fun': np.max},
-                'map_testdurationminutes': {'map_col': 'testdurationminutes',
-                                            'where_statement': "",
-                                            'agg_fun': np.max},
-                'map_percentcorrect': {'map_col': 'percentcorrect',
-                                       'where_statement': "",
-                                       'agg_fun': np.max},
-                'map_start_date': {'map_col': 'teststartdate',
-                                   'where_statement': "",
-                                   'agg_fun': lambda x: np.max(x.apply(days_since_first_map))},
-                'map_start_hour': {'map_col': 'teststarttime',
-                                   'where_statement': "",
-                                   'agg_fun': lambda x: np.max(x.apply(hour_of_day))},
-                'map_reading_testritscore': {'map_col': 'testritscore',
-                                             'where_statement': "where discipline = 'Reading'",
-                                             'agg_fun': np.max},
-                'map_reading_testpercentile': {'map_col': 'testpercentile',
-                                               'where_statement': "where discipline = 'Reading'",
-                                               'agg_fun': np.max},
-                'map_reading_testdurationminutes': {'map_col': 'testdurationminutes',
-                                                    'where_statement': "where discipline = 'Reading'",
-                                                    'agg_fun': np.max},
-                'map_reading_percentcorrect': {'map_col': 'percentcorrect',
-                                               'where_statement': "where discipline = 'Reading'",
-                                               'agg_fun': np.max},
-                'map_reading_start_date': {'map_col': 'teststartdate',
-                                           'where_statement': "where discipline = 'Reading'",
-                                           'agg_fun': lambda x: np.max(x.apply(days_since_first_map))},
-                'map_reading_start_hour': {'map_col': 'teststarttime',
-                                           'where_statement': "where discipline = 'Reading'",
-                                           'agg_fun': lambda x: np.max(x.apply(hour_of_day))}
-                }
-
-    map_col = map_args[feature_str]['map_col']
-    where_statement = map_args[feature_str]['where_statement']
-    agg_fun = map_args[feature_str]['agg_fun']
-
-    return lambda stuterm_df, engine: map_feat_generic(stuterm_df, engine,
-                                                       map_col, where_statement, agg_fun)
+    return lambda stuterm_df, engine: build_map_features(stuterm_df, engine,
+                                                         [feature_str])[feature_str]
 
 
 def find_ac_year(year, season):
@@ -699,27 +549,28 @@ def find_ac_year(year, season):
     :type season: str
     :returns str:
     """
-    if season == 'fall':
-        start, end = year[-2:], str(int(year) + 1)[-2:]
-    elif season in ['winter', 'spring']:
-        start, end = str(int(year) - 1)[-2:], year[-2:]
-    return '{}_{}'.format(start, end)
+    return find_ac_years(pd.Series([year]), pd.Series([season])).iloc[0]
 
 
-def tripod_feat_generic(stuterm_df, engine, tripod_col, agg_fun):
-    """Generic function to make map features
-    :param tripod_col: the column to use in the clean_data.tripod table
-    :param stuterm_df: studentid, year, season data
-    :param agg_fun: the aggregration function to pass to groupby
-    :param engine: a db engine to use
-    :type tripod_col: str
-    :type stuterm_df: pandas DataFrame
-    :type agg_fun: function
-    :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
+def find_ac_years(years, seasons):
+    """find_ac_year for whole columns of years and seasons at once
+
+    :param years: 4 digit years
+    :param seasons: 'fall', 'spring' or 'winter'
+    :type years: pandas Series
+    :type seasons: pandas Series
+    :returns: pandas Series of academic years like 14_15
     """
-    tripod_select_sql = """select * from
-                    (SELECT {tripod_col}, yr, season as tripod_season, teacher_id 
+    year_nums = years.astype(int)
+    start_years = year_nums.where(seasons == 'fall', year_nums - 1)
+    return (start_years % 100).astype(str).str.zfill(2) + '_' + \
+        ((start_years + 1) % 100).astype(str).str.zfill(2)
+
+
+tripod_select_sql = """select * from
+                    (SELECT challenge, classroom_management, captivate, care,
+                            clarify, consolidate, confer, cs,
+                            yr, season as tripod_season, teacher_id
                     FROM clean_data.tripod) as t
 
                     inner join
@@ -729,18 +580,45 @@ def tripod_feat_generic(stuterm_df, engine, tripod_col, agg_fun):
 
                     on t.teacher_id = r.teachernumber 
                        and t.yr = cast(r.measured_year as int)
-                       and lower(t.tripod_season) = lower(r.season)""".format(tripod_col=tripod_col)
+                       and lower(t.tripod_season) = lower(r.season)"""
 
-    tripod_col_df = pd.read_sql_query(tripod_select_sql, engine)
-    tripod_col_df['ac_measured_year'] = tripod_col_df[['measured_year', 'season']].apply(
-        lambda x: find_ac_year(x['measured_year'], x['season']), axis=1)
-    aggperterm_df = tripod_col_df.groupby(by=['student_number', 'ac_measured_year', 'season']).agg(agg_fun).reset_index()
-    merged_df = stuterm_df.merge(aggperterm_df,
-                                 how='left',
-                                 left_on=['studentid', 'measured_year', 'season'],
-                                 right_on=['student_number', 'ac_measured_year', 'season'])
 
-    return merged_df[tripod_col]
+# the tripod dimensions, each made into a feature per aggregate
+tripod_cols = ['challenge', 'classroom_management', 'captivate', 'care',
+               'clarify', 'consolidate', 'confer', 'cs']
+tripod_aggs = ['min', 'max', 'mean', 'std']
+tripod_features = ['tripod_{}_{}'.format(tripod_col, agg)
+                   for tripod_col in tripod_cols for agg in tripod_aggs]
+
+
+def build_tripod_features(stuterm_df, engine, feature_strs):
+    """Make tripod features with one join and one groupby for all of them
+    std is the sample standard deviation, like groupby(...).agg(np.std)
+
+    :param stuterm_df: studentid, year, season data
+    :param engine: a db engine to use
+    :param feature_strs: names of tripod features in tripod_features
+    :type stuterm_df: pandas DataFrame
+    :type engine: sqlalchemy engine
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
+    needed_cols = [tripod_col for tripod_col in tripod_cols
+                   if any('tripod_{}_{}'.format(tripod_col, agg) in feature_strs
+                          for agg in tripod_aggs)]
+    tripod_df = source_cache.read_query(tripod_select_sql, engine)
+    tripod_df['ac_measured_year'] = find_ac_years(tripod_df['measured_year'],
+                                                  tripod_df['season'])
+    aggperterm_df = tripod_df.groupby(by=['student_number', 'ac_measured_year', 'season'])[needed_cols] \
+                             .agg(tripod_aggs)
+    aggperterm_df.columns = ['tripod_{}_{}'.format(tripod_col, agg)
+                             for tripod_col, agg in aggperterm_df.columns]
+    merged_df = stuterm_df[['studentid', 'measured_year', 'season']].merge(
+        aggperterm_df.reset_index(),
+        how='left',
+        left_on=['studentid', 'measured_year', 'season'],
+        right_on=['student_number', 'ac_measured_year', 'season'])
+    return merged_df[feature_strs]
 
 
 def make_tripod_feature(feature_str):
@@ -749,453 +627,306 @@ def make_tripod_feature(feature_str):
     :type feature_str: str
     :returns: function that will accept stuterm_df and engine
     """
-    tripod_args = {'tripod_challenge_min': {'tripod_col': 'challenge',
-                                            'agg_fun': np.min},
-                   'tripod_challenge_max': {'tripod_col': 'challenge',
-                                            'agg_fun': np.max},
-                   'tripod_challenge_mean': {'tripod_col': 'challenge',
-                                             'agg_fun': np.mean},
-                   'tripod_challenge_std': {'tripod_col': 'challenge',
-                                            'agg_fun': np.std},
-                   'tripod_classroom_management_min': {'tripod_col': 'classroom_management',
-                                                       'agg_fun': np.min},
-                   'tripod_classroom_management_max': {'tripod_col': 'classroom_management',
-                                                       'agg_fun': np.max},
-                   'tripod_classroom_management_mean': {'tripod_col': 'classroom_management',
-                                                        'agg_fun': np.mean},
-                   'tripod_classroom_management_std': {'tripod_col': 'classroom_management',
-                                                       'agg_fun': np.std},
-                   'tripod_captivate_min': {'tripod_col': 'captivate',
-                                            'agg_fun': np.min},
-                   'tripod_captivate_max': {'tripod_col': 'captivate',
-                                            'agg_fun': np.max},
-                   'tripod_captivate_mean': {'tripod_col': 'captivate',
-                                             'agg_fun': np.mean},
-                   'tripod_captivate_std': {'tripod_col': 'captivate',
-                                            'agg_fun': np.std},
-                   'tripod_care_min': {'tripod_col': 'care',
-                                       'agg_fun': np.min},
-                   'tripod_care_max': {'tripod_col': 'care',
-                                       'agg_fun': np.max},
-                   'tripod_care_mean': {'tripod_col': 'care',
-                                        'agg_fun': np.mean},
-                   'tripod_care_std': {'tripod_col': 'care',
-                                       'agg_fun': np.std},
-                   'tripod_clarify_min': {'tripod_col': 'clarify',
-                                          'agg_fun': np.min},
-                   'tripod_clarify_max': {'tripod_col': 'clarify',
-                                          'agg_fun': np.max},
-                   'tripod_clarify_mean': {'tripod_col': 'clarify',
-                                           'agg_fun': np.mean},
-                   'tripod_clarify_std': {'tripod_col': 'clarify',
-                                          'agg_fun': np.std},
-                   'tripod_consolidate_min': {'tripod_col': 'consolidate',
-                                              'agg_fun': np.min},
-                   'tripod_consolidate_max': {'tripod_col': 'consolidate',
-                                              'agg_fun': np.max},
-                   'tripod_consolidate_mean': {'tripod_col': 'consolidate',
-                                               'agg_fun': np.mean},
-                   'tripod_consolidate_std': {'tripod_col': 'consolidate',
-                                              'agg_fun': np.std},
-                   'tripod_confer_min': {'tripod_col': 'confer',
-                                         'agg_fun': np.min},
-                   'tripod_confer_max': {'tripod_col': 'confer',
-                                         'agg_fun': np.max},
-                   'tripod_confer_mean': {'tripod_col': 'confer',
-                                          'agg_fun': np.mean},
-                   'tripod_confer_std': {'tripod_col': 'confer',
-                                         'agg_fun': np.std},
-                   'tripod_cs_min': {'tripod_col': 'cs',
-                                     'agg_fun': np.min},
-                   'tripod_cs_max': {'tripod_col': 'cs',
-                                     'agg_fun': np.max},
-                   'tripod_cs_mean': {'tripod_col': 'cs',
-                                      'agg_fun': np.mean},
-                   'tripod_cs_std': {'tripod_col': 'cs',
-                                     'agg_fun': np.std}}
-
-    tripod_col = tripod_args[feature_str]['tripod_col']
-    agg_fun = tripod_args[feature_str]['agg_fun']
-
-    return lambda stuterm_df, engine: tripod_feat_generic(stuterm_df, engine, tripod_col, agg_fun)
-
-
-def iread_enrolled(stuterm_df, engine):
-    """
-    Whether or not student is enrolled in iRead program (s44jr program)
-    :param stuterm_df: studentid, year, season data
-    :param engine: a db engine to use
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :returns: pandas DataFrame -- binary variable representing enrolled Y/N
-    """
-    query = """
-                 SELECT
-                 DISTINCT ON (sis_id, measured_year)
-                    sis_id, measured_year, grade
-                    , CASE s44jr_enrolled
-                            WHEN 'Yes' THEN 1
-                            WHEN 'No' THEN 0
-                            ELSE -1
-                       END AS iread_is_enrolled
-                 FROM
-                    clean_data.iread
-                 GROUP BY sis_id, measured_year, grade, iread_is_enrolled   
-                 ORDER BY sis_id, measured_year, iread_is_enrolled DESC;
-            """
-    is_enrolled_df = pd.read_sql_query(query, engine)
-    stuterm_enrolled_df = stuterm_df.merge(is_enrolled_df, how='left',
-                                           left_on=['studentid', 'measured_year'],
-                                           right_on=['sis_id', 'measured_year'])
-    return stuterm_enrolled_df['iread_is_enrolled']
+    return lambda stuterm_df, engine: build_tripod_features(stuterm_df, engine,
+                                                            [feature_str])[feature_str]
 
 
-def iread_data_missing(stuterm_df, engine):
-    """
-    Whether or not data on iRead is missing (s44jr program)
-    :param stuterm_df: studentid, year, season data
-    :param engine: a db engine to use
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :returns: pandas DataFrame -- binary variable representing data missing Y/N
+# iread feature name: the clean_data.iread column it is
+iread_feature_cols = {'iread_screener_placement_series': 'iread_screener_placement_series',
+                      'iread_highest_unit_reached': 'iread_daterange_highest_unit_reached',
+                      'iread_total_sessions': 'iread_daterange_total_sessions',
+                      'iread_total_topics_completed': 'iread_daterange_total_topics_completed',
+                      'iread_total_time': 'iread_daterange_total_time'}
+iread_features = ['iread_is_enrolled', 'iread_data_missing', 'iread_took_screener',
+                  'iread_average_time_per_topic', 'iread_average_sessions_per_week',
+                  'iread_current_series', 'iread_current_topic'] + list(iread_feature_cols)
+
+
+def iread_query_statement():
     """
-    query = """
-                 SELECT
-                 DISTINCT ON (sis_id, measured_year)
-                    sis_id, measured_year, grade
-                    , CASE s44jr_enrolled
-                            WHEN 'Yes' THEN 1
-                            WHEN 'No' THEN 0
-                            ELSE -1
-                       END AS iread_is_enrolled
-                 FROM
-                    clean_data.iread
-                 GROUP BY sis_id, measured_year, grade, iread_is_enrolled   
-                 ORDER BY sis_id, measured_year, iread_is_enrolled DESC;
-            """
-    is_enrolled_df = pd.read_sql_query(query, engine)
-    stuterm_enrolled_df = stuterm_df.merge(is_enrolled_df, how='left',
-                                           left_on=['studentid', 'measured_year'],
-                                           right_on=['sis_id', 'measured_year'])
-    df_dem = pd.read_sql_query('SELECT student_number, grade_level, measured_year from clean_data.demographics', engine)
-    stuterm_dem_df = stuterm_enrolled_df.merge(df_dem, how='left',
-                                               left_on=['studentid', 'measured_year'],
-                                               right_on=['student_number', 'measured_year'])
-    stuterm_dem_df['iread_data_missing'] = np.nan
-    # only students below grade 3 take iRead
-    stuterm_dem_df.loc[(np.isnan(stuterm_dem_df['iread_is_enrolled'])) & (stuterm_dem_df['grade_level']!=3), 'iread_data_missing'] = 1
-    stuterm_dem_df.loc[(np.isfinite(stuterm_dem_df['iread_is_enrolled'])) & (stuterm_dem_df['grade_level']!=3), 'iread_data_missing'] = 0
-    return stuterm_dem_df['iread_data_missing']
-
-
-def iread_query_statement(column_names):
-    """
-    Creates a generic sql statement used in most of the iread feature generating functions
-    :param column_names: specifies one or more column names to pull
-    :type column_names: str or list
+    Creates the sql statement all the iread features are made from, one row
+    per student and year with every column the features use.
+    iread_is_enrolled is 1 if any row of the student and year is enrolled,
+    0 if any is not, and -1 otherwise.
     :returns: string to be used as sql statement
     """
-    if isinstance(column_names, list):
-        col_names = ','.join(column_names)
-    else:
-        col_names = column_names
+    col_names = ', '.join(['iread_screener_date_administered',
+                           'export_start_date', 'export_end_date',
+                           'iread_daterange_current_series_topic'] +
+                          list(iread_feature_cols.values()))
     query = """
                 SELECT
                  DISTINCT ON (sis_id, measured_year)
-                    sis_id, measured_year, grade, s44jr_enrolled, {col_names} 
+                    sis_id, measured_year, grade, s44jr_enrolled, {col_names}
+                    , MAX(CASE s44jr_enrolled
+                              WHEN 'Yes' THEN 1
+                              WHEN 'No' THEN 0
+                              ELSE -1
+                          END) OVER (PARTITION BY sis_id, measured_year) AS iread_is_enrolled
                  FROM
                     clean_data.iread
-                 GROUP BY sis_id, measured_year, grade, s44jr_enrolled, {col_names}
                  ORDER BY sis_id, measured_year, s44jr_enrolled DESC;
-                 """.format(col_names = col_names)
+                 """.format(col_names=col_names)
     return query
 
 
-def iread_took_screener(stuterm_df, engine):
+def iread_export_dates(export_dates):
     """
-    Whether or not student took iRead program screener
-    :param stuterm_df: studentid, year, season data
-    :param engine: a db engine to use
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :returns: pandas DataFrame -- binary variable representing took screener Y/N
-    """
-    query = iread_query_statement('iread_screener_date_administered')
-    took_screener_df = pd.read_sql_query(query, engine)
-    took_screener_df['took_screener'] = np.nan
-    took_screener_df.loc[(took_screener_df['s44jr_enrolled'] == "Yes") & (took_screener_df['iread_screener_date_administered'].isnull()), 'took_screener' ] = 0
-    took_screener_df.loc[(took_screener_df['s44jr_enrolled'] == "Yes") & (took_screener_df['iread_screener_date_administered'].notnull()), 'took_screener' ] = 1
-    stuterm_took_screener_df = stuterm_df.merge(took_screener_df, how='left',
-                                                left_on=['studentid', 'measured_year'],
-                                                right_on=['sis_id', 'measured_year'])
-    
-    return stuterm_took_screener_df['took_screener']
-
-
-def iread_feature_generic(stuterm_df, iread_col, engine):
-    """
-    Generic function to make iread features
-    :param stuterm_df: studentid, year, season data
-    :param iread_col: string representing which iread column to extract
-    :param engine: a db engine to use
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :type iread_col: str
-    :returns: pandas DataFrame or Series with numeric features
+    Parses iread export dates, ints or strs like 20150801
+    :param export_dates: the export dates
+    :type export_dates: pandas Series
+    :returns: pandas Series of datetimes, NaT where there is no date
     """
-    query = iread_query_statement(iread_col)
-    feature_df = pd.read_sql_query(query, engine)
-    stuterm_feature_df = stuterm_df.merge(feature_df, how='left',
-                                          left_on=['studentid', 'measured_year'],
-                                          right_on=['sis_id', 'measured_year'])
-    return stuterm_feature_df[iread_col]
+    return pd.to_datetime(export_dates.astype(str).str[:8], format='%Y%m%d',
+                          errors='coerce')
 
 
-def iread_average_time_per_topic(stuterm_df, engine):
+def iread_series_topics(series_topics):
     """
-    Returns average time (in minutes) student spent on each topic
-    :param stuterm_df: studentid, year, season data
-    :param engine: a db engine to use
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :returns: pandas DataFrame numeric representing minutes
+    The current series and topic being completed by students
+    :param series_topics: the raw 'iread_daterange_current_series_topic' column,
+                          depending on year either in format 'series_x_topic_x'
+                          or 'xx.xx'
+    :type series_topics: pandas Series
+    :returns: pandas DataFrame -- series and topic numbers
     """
-    query = iread_query_statement(['iread_daterange_total_topics_completed', 'iread_daterange_total_time'])
-    feature_df = pd.read_sql_query(query, engine)
-    feature_df['iread_average_time_per_topic'] = feature_df['iread_daterange_total_time']/ feature_df['iread_daterange_total_topics_completed']
-    stuterm_feature_df = stuterm_df.merge(feature_df, how='left',
-                                          left_on=['studentid', 'measured_year'],
-                                          right_on=['sis_id', 'measured_year'])
-    return stuterm_feature_df['iread_average_time_per_topic']
+    series_topic_df = series_topics.str.extract(r'(\d+)\D+(\d+)', expand=True) \
+                                   .astype(float)
+    series_topic_df.columns = ['series', 'topic']
+    return series_topic_df
 
 
-def iread_average_sessions_per_week(stuterm_df, engine):
+def build_iread_features(stuterm_df, engine, feature_strs):
     """
-    Returns average number of sessions per week spent on iRead
+    Makes iread features (s44jr program) from one extraction of clean_data.iread
+        * iread_is_enrolled: 1 enrolled, 0 not, -1 unknown
+        * iread_data_missing: 1 if there is no iread data for a student
+          below grade 3, 0 if there is
+        * iread_took_screener: for enrolled students, whether they took
+          the screener
+        * iread_average_time_per_topic: minutes spent on each topic
+        * iread_average_sessions_per_week: sessions per week between the
+          export dates
+        * iread_current_series, iread_current_topic: where the student is
+        * the iread columns in iread_feature_cols
     :param stuterm_df: studentid, year, season data
     :param engine: a db engine to use
+    :param feature_strs: names of iread features in iread_features
     :type stuterm_df: pandas DataFrame
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame numeric representing average sessions
-    """
-    query = iread_query_statement(['iread_daterange_total_sessions', 'export_start_date', 'export_end_date'])
-    feature_df = pd.read_sql_query(query, engine)
-    feature_df['end_date'] = feature_df['export_end_date'].apply(lambda x: datetime.datetime.strptime(str(x), '%Y%m%d').toordinal())
-    feature_df['start_date'] = feature_df['export_start_date'].apply(lambda x: datetime.datetime.strptime(str(x), '%Y%m%d').toordinal())
-    feature_df['weeks'] = (feature_df['end_date'] - feature_df['start_date'])/7
-    feature_df['iread_average_sessions_per_week'] = feature_df['iread_daterange_total_sessions']/ feature_df['weeks'] 
-    stuterm_feature_df = stuterm_df.merge(feature_df, how='left',
-                                          left_on=['studentid', 'measured_year'],
-                                          right_on=['sis_id', 'measured_year'])
-    return stuterm_feature_df['iread_average_sessions_per_week']
-
-
-def convert_current_series_topic(x, level_type):
-    """
-    Returns an integer representing the current series or topic being completed by a student
-    (helper function)
-    :param x: a string from the raw 'iread_daterange_current_series_topic' column
-    :param level_type: either 'series' or 'topic'
-    :type x: str, depending on year is either in format 'series_x_topic_x' or 'xx.xx'
-    :type level_type: str
-    :returns: int representing current series or topic
-    """
-    if x == None:
-        current_series = None
-        current_topic = None
-    elif 'series' in x:
-        current_series = int(x.split('_')[1])
-        current_topic = int(x.split('_')[3])
-    else:
-        current_series = int(x.split('.')[0])
-        current_topic = int(x.split('.')[1])
-    if level_type == 'series':
-        return current_series
-    else:
-        return current_topic
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
+    iread_df = source_cache.read_query(iread_query_statement(), engine)
+    enrolled = iread_df['s44jr_enrolled'] == 'Yes'
+    screener_dates = iread_df['iread_screener_date_administered']
+    iread_df['iread_took_screener'] = np.nan
+    iread_df.loc[enrolled & screener_dates.isnull(), 'iread_took_screener'] = 0
+    iread_df.loc[enrolled & screener_dates.notnull(), 'iread_took_screener'] = 1
+    iread_df['iread_average_time_per_topic'] = iread_df['iread_daterange_total_time'] / \
+        iread_df['iread_daterange_total_topics_completed']
+    weeks = (iread_export_dates(iread_df['export_end_date']) -
+             iread_export_dates(iread_df['export_start_date'])).dt.days / 7
+    iread_df['iread_average_sessions_per_week'] = iread_df['iread_daterange_total_sessions'] / weeks
+    series_topic_df = iread_series_topics(iread_df['iread_daterange_current_series_topic'])
+    iread_df['iread_current_series'] = series_topic_df['series']
+    iread_df['iread_current_topic'] = series_topic_df['topic']
+    for feature_str, iread_col in iread_feature_cols.items():
+        iread_df[feature_str] = iread_df[iread_col]
+
+    stuterm_iread_df = stuterm_df[['studentid', 'measured_year']].merge(
+        iread_df[['sis_id', 'measured_year'] + [feature_str for feature_str in iread_features
+                                                if feature_str != 'iread_data_missing']],
+        how='left',
+        left_on=['studentid', 'measured_year'],
+        right_on=['sis_id', 'measured_year'])
+    if 'iread_data_missing' in feature_strs:
+        df_dem = get_dem_df(engine)[['student_number', 'grade_level', 'measured_year']] \
+            .drop_duplicates(['student_number', 'measured_year'])
+        grade_levels = stuterm_iread_df.merge(df_dem, how='left',
+                                              left_on=['studentid', 'measured_year'],
+                                              right_on=['student_number', 'measured_year'])['grade_level']
+        # only students below grade 3 take iRead
+        below_3 = grade_levels != 3
+        is_enrolled = stuterm_iread_df['iread_is_enrolled']
+        stuterm_iread_df['iread_data_missing'] = np.nan
+        stuterm_iread_df.loc[is_enrolled.isnull() & below_3, 'iread_data_missing'] = 1
+        stuterm_iread_df.loc[is_enrolled.notnull() & below_3, 'iread_data_missing'] = 0
+    return stuterm_iread_df[feature_strs]
 
 
-def iread_current_series_topic(stuterm_df, engine, level_type):
-    """
-    Returns current series or topic
-    :param stuterm_df: studentid, year, season data
-    :param engine: a db engine to use
-    :param level_type: either 'series' or 'topic'
-    :type stuterm_df: pandas DataFrame
-    :type engine: sqlalchemy engine
-    :type level_type: str
-    :returns: pandas DataFrame int representing series or topic
-    """
-    query = iread_query_statement('iread_daterange_current_series_topic')
-    feature_df = pd.read_sql_query(query, engine)
-    feature_df['current_' + level_type] = feature_df['iread_daterange_current_series_topic'].apply(lambda x: convert_current_series_topic(x, level_type)) 
-    stuterm_feature_df = stuterm_df.merge(feature_df, how='left',
-                                          left_on=['studentid', 'measured_year'],
-                                          right_on=['sis_id', 'measured_year'])
-    return stuterm_feature_df['current_' + level_type]
-
-def make_iread_current_series_topic(level_type):
-    """
-    Returns a function to generate current series or topic
-    :param level_type: specifying 'series' or 'topic'
-    :type level_type: str
-    :returns: function that will accept stuterm_df and engine
-    """
-    return lambda stuterm_df, engine: iread_current_series_topic(stuterm_df, engine, level_type)
-
 def make_iread_feature(feature_str):
     """Make features that utilize the iread dataset
-    :param feature_str: the name of the feature to make
+    :param feature_str: the name of the feature to make, in iread_features
     :type feature_str: str
     :returns: function that will accept stuterm_df and engine
     """
-    iread_args = {'iread_screener_placement_series': 'iread_screener_placement_series',
-                  'iread_highest_unit_reached': 'iread_daterange_highest_unit_reached',
-                  'iread_total_sessions': 'iread_daterange_total_sessions',
-                  'iread_total_topics_completed': 'iread_daterange_total_topics_completed',
-                  'iread_total_time': 'iread_daterange_total_time'}
+    return lambda stuterm_df, engine: build_iread_features(stuterm_df, engine,
+                                                           [feature_str])[feature_str]
 
-    iread_col = iread_args[feature_str]
 
-    return lambda stuterm_df, engine: iread_feature_generic(stuterm_df, iread_col, engine)
+course_cats = ['art', 'pe', 'read', 'science', 'math', 'social', 'computer',
+               'non_grade', 'language']
+grade_cats = ['a', 'b', 'c', 'd', 'f', 's', 'n', 'u', 'e', 'p', 'ng']
+grades_features = ['course_taken_' + course_cat for course_cat in course_cats] + \
+                  ['grade_mark_' + grade_cat for grade_cat in grade_cats]
 
 
-def course_taken_generic(stuterm_df, engine, course_or_grade, cg_value):                                                    
-    """Generic function to make grades features
+def build_grades_features(stuterm_df, engine, feature_strs):
+    """Make grades features, per student and year the number of courses
+    taken in each course category (course_taken_*) and the number of each
+    grade mark (grade_mark_*). Categorizes the grades once and counts every
+    category in one groupby.
     :param stuterm_df: studentid, year, season data
-    :param course_or_grade: one of ['course', 'grade']
-    :param cg_value: the course category to subset one of
-                                ['art', 'pe', 'read', 'science', 'math',
-                                'social', 'computer', 'non-grade', 'language']
-                     the grade category should be one of
-                                ['a', 'b', 'c', 'd', 'e', 'f',
-                                's', 'n', 'u', 'p', 'ng']
     :param engine: a db engine to use
+    :param feature_strs: names of grades features in grades_features
     :type stuterm_df: pandas DataFrame
-    :type course: str
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
     """
     grades_sql = """SELECT student_number, grade, course_name, termid
                     FROM clean_data.grades_16_uofc_grades_1st___3rd_2013_to_2
                     where grade_level <4"""
-    grades_df = pd.read_sql(grades_sql, engine)
-    grades_df['measured_year'] = grades_df['termid'] \
-        .apply(helpers.termid_to_ac_year)
-    if course_or_grade == 'course':
-        select_col = 'course_name'
-        cat_fun = helpers.categorize_courses
-    elif course_or_grade == 'grade':
-        select_col = 'grade'
-        cat_fun = helpers.categorize_grades
-    else:
-        raise ValueError('course_or_grade must be "course" or "grade"')
-    grades_df['cat'] = grades_df[select_col] \
-        .apply(cat_fun)
-    course_cat_only = grades_df[grades_df['cat'] == cg_value]
-    course_minimal = course_cat_only[['student_number', 'measured_year',
-                                      'cat']]
-    course_per_stuterm = course_minimal.groupby(by=['student_number',
-                                                    'measured_year']) \
-        .agg(len).reset_index()
-    merged_df = stuterm_df.merge(course_per_stuterm,
+    grades_df = source_cache.read_query(grades_sql, engine)
+    grades_df['measured_year'] = helpers.termids_to_ac_years(grades_df['termid'])
+    # every grade is counted once for its course category and once for its mark
+    stuterm_cats_df = pd.concat([
+        pd.DataFrame({'student_number': grades_df['student_number'],
+                      'measured_year': grades_df['measured_year'],
+                      'cat': 'course_taken_' + helpers.categorize_course_names(grades_df['course_name'])}),
+        pd.DataFrame({'student_number': grades_df['student_number'],
+                      'measured_year': grades_df['measured_year'],
+                      'cat': 'grade_mark_' + helpers.categorize_grade_marks(grades_df['grade'])})],
+        ignore_index=True)
+    cats_per_stuterm = stuterm_cats_df.groupby(['student_number', 'measured_year', 'cat']) \
+                                      .size().unstack('cat')
+    cats_per_stuterm = cats_per_stuterm.reindex(columns=feature_strs)
+    merged_df = stuterm_df.merge(cats_per_stuterm.reset_index(),
                                  how='left',
                                  left_on=['studentid', 'measured_year'],
                                  right_on=['student_number', 'measured_year'])
-    return merged_df['cat']
+    return merged_df[feature_strs]
 
 
 def make_course_feature(course_or_grade, cg_value):
     """Make features that utilize the grades dataset
-    :param feature_str: the name of the feature to make
-    :type feature_str: str
+    :param course_or_grade: one of ['course', 'grade']
+    :param cg_value: the course category in course_cats or grade in grade_cats
+    :type course_or_grade: str
+    :type cg_value: str
     :returns: function that will accept stuterm_df and engine
     """
-    return lambda stuterm_df, engine: course_taken_generic(stuterm_df, engine,
-                                                           course_or_grade,
-                                                           cg_value)
+    if course_or_grade == 'course':
+        feature_str = 'course_taken_' + cg_value
+    elif course_or_grade == 'grade':
+        feature_str = 'grade_mark_' + cg_value
+    else:
+        raise ValueError('course_or_grade must be "course" or "grade"')
+    return lambda stuterm_df, engine: build_grades_features(stuterm_df, engine,
+                                                            [feature_str])[feature_str]
 
 
-def rsa_logs_generic(stuterm_df, engine, subtype):
-    """Generic function to make grades features
+# rsa log feature name: subtype counted
+rsa_log_subtypes = {'rsa_log_rsa_retained': 'RSA_RETAINED',
+                    'rsa_log_passed_itbs': 'PASSED_ITBS',
+                    'rsa_log_probation_promoted': 'PROBATION_PROMOTED',
+                    'rsa_log_passed_occt': 'PASSED_OCCT',
+                    'rsa_log_exemption': 'EXEMPTION',
+                    'rsa_log_meets_rsa_criteria': 'MEETS_RSA_CRITERIA'}
+
+
+def build_rsa_log_features(stuterm_df, engine, feature_strs):
+    """Make rsa log features, the count of each subtype of RSA event per
+    stuterm, from one read and one crosstab.
+    Stuterms with no events of a subtype are NaN.
+
     :param stuterm_df: studentid, year, season data
-    :param subtype: the type of RSA event must be one of
-                    ["RSA_RETAINED","PASSED_ITBS","PROBATION_PROMOTED",
-                     "PASSED_OCCT","EXEMPTION","MEETS_RSA_CRITERIA"]
     :param engine: a db engine to use
+    :param feature_strs: names of rsa log features in rsa_log_subtypes
     :type stuterm_df: pandas DataFrame
-    :type course: str
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
-    """
-    rsa_sql = """SELECT student_number, subtype, entry_date, discipline_incidentdate
-                 FROM clean_data.rsa_logs
-                 WHERE subtype like '{subtype}';""".format(subtype=subtype)
-    rsa_df = pd.read_sql(rsa_sql, engine)
-    rsa_df['measured_year'] = rsa_df['discipline_incidentdate'].apply(helpers.ac_year_from_date)
-    rsa_df['season'] = rsa_df['discipline_incidentdate'].apply(helpers.season_from_date)
-    count_per_term = rsa_df.groupby(by=['student_number', 'measured_year',
-                                        'season']).agg(len).reset_index()
-    merged_df = stuterm_df.merge(count_per_term,
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
+    rsa_df = source_cache.read_table('clean_data.rsa_logs', engine)
+    rsa_df = rsa_df[['student_number', 'subtype', 'discipline_incidentdate']].copy()
+    rsa_terms_df = get_date_terms(rsa_df['discipline_incidentdate'], engine)
+    rsa_df['measured_year'] = rsa_terms_df['measured_year']
+    rsa_df['season'] = rsa_terms_df['season']
+    count_per_term = rsa_df.groupby(['student_number', 'measured_year', 'season', 'subtype'])\
+                           .size().unstack('subtype')
+    count_per_term = count_per_term.reindex(columns=[rsa_log_subtypes[feature_str]
+                                                     for feature_str in feature_strs])
+    count_per_term.columns = feature_strs
+    merged_df = stuterm_df.merge(count_per_term.reset_index(),
                                  how='left',
                                  left_on=['studentid', 'measured_year', 'season'],
                                  right_on=['student_number', 'measured_year', 'season'])
-    return merged_df['subtype']
+    return merged_df[feature_strs]
 
 
 def make_rsa_log_feature(subtype):
     """Make features that utilize the rsa_log dataset
-    :param feature_str: the name of the feature to make
-    :type feature_str: str
+    :param subtype: the type of RSA event, a value of rsa_log_subtypes
+    :type subtype: str
     :returns: function that will accept stuterm_df and engine
     """
-    return lambda stuterm_df, engine: rsa_logs_generic(stuterm_df, engine, subtype)
+    feature_str = next(feature_str for feature_str, log_subtype in rsa_log_subtypes.items()
+                       if log_subtype == subtype)
+    return lambda stuterm_df, engine: build_rsa_log_features(stuterm_df, engine,
+                                                             [feature_str])[feature_str]
+
+
+reenroll_features = ['reenroll_num', 'reenroll_off_peak', 'reenroll_pss',
+                     'reenroll_pns', 'reenroll_other']
+
 
+def build_reenroll_features(stuterm_df, engine, feature_strs):
+    """Make reenrollment features, counts of reenrollments of each kind per
+    stuterm, from one read and one groupby.
+    Stuterms with no reenrollments are NaN.
+        * num: all reenrollments
+        * off_peak: entered in any month but August
+        * pss: promoted same school
+        * pns: promoted next school
+        * other: neither promoted same school nor promoted next school
 
-def reenroll_generic(stuterm_df, engine, reen):
-    """Generic function to make reenrollment features
     :param stuterm_df: studentid, year, season data
-    :param reen: the reenrollment type
-                                ['num', 'offpeak', 'pss', 'pns', 'other']
     :param engine: a db engine to use
+    :param feature_strs: names of reenroll features in reenroll_features
     :type stuterm_df: pandas DataFrame
-    :type reen: str
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
-    """
-    strats = {'num': {'col': 'entrycomment',
-                      'sub_fun': lambda x: 1},
-              'off_peak': {'col': 'entrydate',
-                           'sub_fun': lambda x: x.month != 8},
-              'pss': {'col': 'entrycomment',
-                      'sub_fun': lambda x: x == 'Promote Same School'},
-              'pns': {'col': 'entrycomment',
-                      'sub_fun': lambda x: x == 'Promoted Next School'},
-              'other': {'col': 'entrycomment',
-                        'sub_fun': lambda x: x != 'Promoted Same School' and\
-                        x != 'Promoted Next School'}
-              }
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
     rsql = """select student_number, reenrollment_id,
     current_school, schoolid, entrydate, entrycode,
     entrycomment, exitdate, exitcode, exitcomment
         from clean_data.reenroll"""
 
-    r = pd.read_sql(rsql, engine)
+    r = source_cache.read_query(rsql, engine)
 
     dateful = r[r['entrydate'].notnull()]
-    dateful['season'] = dateful['entrydate'].apply(helpers.season_from_date)
-    dateful['measured_year'] = dateful['entrydate'].apply(helpers.ac_year_from_date)
-    col = strats[reen]['col']
-    sub_fun = strats[reen]['sub_fun']
-    dateful['cat'] = dateful[col].apply(sub_fun)
-    dateful_minimal = dateful[['student_number', 'measured_year', 'season', 'cat']]
-    dateful_stuterm = dateful_minimal.groupby(by=['student_number', 'measured_year', 'season'])\
-                                     .agg(sum).reset_index()
-    merged_df = stuterm_df.merge(dateful_stuterm,
+    entrydates = pd.to_datetime(dateful['entrydate'])
+    comments = dateful['entrycomment']
+    entry_terms_df = get_date_terms(entrydates, engine)
+    cats = pd.DataFrame({'student_number': dateful['student_number'],
+                         'season': entry_terms_df['season'],
+                         'measured_year': entry_terms_df['measured_year'],
+                         'reenroll_num': 1,
+                         'reenroll_off_peak': entrydates.dt.month != 8,
+                         'reenroll_pss': comments == 'Promote Same School',
+                         'reenroll_pns': comments == 'Promoted Next School',
+                         'reenroll_other': ~comments.isin(['Promoted Same School',
+                                                           'Promoted Next School'])})
+    counts_df = cats.groupby(['student_number', 'measured_year', 'season'])[feature_strs]\
+                    .sum().reset_index()
+    merged_df = stuterm_df.merge(counts_df,
                                  how='left',
                                  left_on=['studentid', 'measured_year', 'season'],
                                  right_on=['student_number', 'measured_year', 'season'])
-    return merged_df['cat']
+    return merged_df[feature_strs]
 
 
 def make_reenroll_feature(reen_feat):
@@ -1204,74 +935,67 @@ def make_reenroll_feature(reen_feat):
     :type reen_feat: str
     :returns: function that will accept stuterm_df and engine
     """
-    return lambda stuterm_df, engine: reenroll_generic(stuterm_df, engine, reen_feat)
+    feature_str = 'reenroll_' + reen_feat
+    return lambda stuterm_df, engine: build_reenroll_features(stuterm_df, engine,
+                                                              [feature_str])[feature_str]
+
+
+# the discipline incident categories from helpers.disc_group that are features,
+# discipline_num counts every incident
+discipline_cats = ['disobeyed_rules', 'disrespectful_behavior',
+                   'harassment_bullying', 'no_information', 'skipping_class',
+                   'repeated_behavior', 'disorderly_conduct',
+                   'sexual_misconduct', 'possess_weapon', 'stealing',
+                   'disruptive_conduct', 'physical', 'vandalism']
+discipline_features = ['discipline_num'] + ['discipline_' + disc for disc in discipline_cats]
+
 
+def build_discipline_features(stuterm_df, engine, feature_strs):
+    """Make discipline features, counts of incidents per stuterm, with one
+    read of the incidents and one groupby for all of them.
+    Stuterms with no incidents at all are NaN, those with incidents are 0
+    for the categories they have none of.
 
-def discipline_generic(stuterm_df, engine, disc):
-    """Generic function to make discipline features
     :param stuterm_df: studentid, year, season data
-    :param dic: the discipline type
     :param engine: a db engine to use
+    :param feature_strs: names of discipline features in discipline_features
     :type stuterm_df: pandas DataFrame
-    :type reen: str
     :type engine: sqlalchemy engine
-    :returns: pandas DataFrame or Series with numeric features
-    """
-    strats = {'num': {'col': 'incidenttype',
-                      'sub_fun': lambda x: 1},
-              'disobeyed_rules': {'col': 'incidenttype',
-                                  'sub_fun': lambda x: helpers.disc_group(x) == 'disobeyed_rules'},
-              'disrespectful_behavior': {'col': 'incidenttype',
-                                         'sub_fun': lambda x: helpers.disc_group(x) == 'disrespectful_behavior'},
-              'harassment_bullying': {'col': 'incidenttype',
-                                      'sub_fun': lambda x: helpers.disc_group(x) == 'harassment_bullying'},
-              'no_information': {'col': 'incidenttype',
-                                 'sub_fun': lambda x: helpers.disc_group(x) == 'no_information'},
-              'skipping_class': {'col': 'incidenttype',
-                                 'sub_fun': lambda x: helpers.disc_group(x) == 'skipping_class'},
-              'repeated_behavior': {'col': 'incidenttype',
-                                    'sub_fun': lambda x: helpers.disc_group(x) == 'repeated_behavior'},
-              'disorderly_conduct': {'col': 'incidenttype',
-                                     'sub_fun': lambda x: helpers.disc_group(x) == 'disorderly_conduct'},
-              'sexual_misconduct': {'col': 'incidenttype',
-                                    'sub_fun': lambda x: helpers.disc_group(x) == 'sexual_misconduct'},
-              'possess_weapon': {'col': 'incidenttype',
-                                 'sub_fun': lambda x: helpers.disc_group(x) == 'possess_weapon'},
-              'stealing': {'col': 'incidenttype',
-                           'sub_fun': lambda x: helpers.disc_group(x) == 'stealing'},
-              'disruptive_conduct': {'col': 'incidenttype',
-                                     'sub_fun': lambda x: helpers.disc_group(x) == 'disruptive_conduct'},
-              'physical': {'col': 'incidenttype',
-                           'sub_fun': lambda x: helpers.disc_group(x) == 'physical'},
-              'vandalism': {'col': 'incidenttype',
-                            'sub_fun': lambda x: helpers.disc_group(x) == 'vandalism'}
-              }
-    dem = pd.read_sql_query("SELECT DISTINCT student_number, id FROM clean_data.demographics", engine)
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
+    dem = get_dem_df(engine)[['student_number', 'id']].drop_duplicates()
     stuterm_dem_df = stuterm_df.merge(dem, how='left',
                                       left_on=['studentid'],
                                       right_on=['student_number'])
     rsql = """select studentid, incidenttype, incidentdate
         from raw_data.discipline_16_u_of_c_discipline_pk_3rd_data"""
 
-    r = pd.read_sql(rsql, engine)
+    r = source_cache.read_query(rsql, engine)
     r = r[(r['incidentdate'].notnull())]
-    r['date'] = r['incidentdate'].apply(lambda x:
-                                        datetime.datetime.strptime(x, "%Y-%m-%d %H:%M:%S")\
-                                        if len(x) == 19 else None)
-    dateful = r[(r['date'].notnull())]
-    dateful['season'] = dateful['date'].apply(helpers.season_from_date)
-    dateful['measured_year'] = dateful['date'].apply(helpers.ac_year_from_date)
-    col = strats[disc]['col']
-    sub_fun = strats[disc]['sub_fun']
-    dateful['cat'] = dateful[col].apply(sub_fun)
-    dateful_minimal = dateful[['studentid', 'season', 'measured_year', 'incidenttype', 'cat']]
-    dateful_stuterm = dateful_minimal.groupby(by=['studentid', 'measured_year', 'season'])\
-                                     .agg(sum).reset_index()
-    merged_df = stuterm_dem_df.merge(dateful_stuterm,
+    # only full timestamps are dates, anything else is left out
+    full_dates = r['incidentdate'].where(r['incidentdate'].str.len() == 19)
+    r['date'] = pd.to_datetime(full_dates, format="%Y-%m-%d %H:%M:%S")
+    dateful = r[(r['date'].notnull())].copy()
+    incident_terms_df = get_date_terms(dateful['date'], engine)
+    dateful['season'] = incident_terms_df['season']
+    dateful['measured_year'] = incident_terms_df['measured_year']
+    # categorize each distinct incident type once
+    incident_types = dateful['incidenttype'].dropna().unique()
+    incident_cats = {incident_type: helpers.disc_group(incident_type)
+                     for incident_type in incident_types}
+    dateful['cat'] = dateful['incidenttype'].map(incident_cats).fillna('other')
+
+    counts_df = dateful.groupby(['studentid', 'measured_year', 'season', 'cat']) \
+                       .size().unstack('cat', fill_value=0)
+    disc_counts_df = counts_df.reindex(columns=discipline_cats, fill_value=0)
+    disc_counts_df.columns = ['discipline_' + disc for disc in discipline_cats]
+    disc_counts_df['discipline_num'] = counts_df.sum(axis=1)
+    merged_df = stuterm_dem_df.merge(disc_counts_df.reset_index(),
                                      how='left',
                                      left_on=['id', 'measured_year', 'season'],
                                      right_on=['studentid', 'measured_year', 'season'])
-    return merged_df['cat']
+    return merged_df[feature_strs]
 
 
 def make_discipline_feature(disc_feat):
@@ -1280,7 +1004,9 @@ def make_discipline_feature(disc_feat):
     :type disc_feat: str
     :returns: function that will accept stuterm_df and engine
     """
-    return lambda stuterm_df, engine: discipline_generic(stuterm_df, engine, disc_feat)
+    feature_str = 'discipline_' + disc_feat
+    return lambda stuterm_df, engine: build_discipline_features(stuterm_df, engine,
+                                                                [feature_str])[feature_str]
 
 
 def rsa_summer_enrolled(stuterm_df, engine):
@@ -1295,7 +1021,7 @@ def rsa_summer_enrolled(stuterm_df, engine):
     """
     rsa_feature = pd.read_sql_query("SELECT * from clean_data.rsa_summer", engine)
     rsa_feature.loc[rsa_feature['course_number'].isnull(), 'course_number'] = ""
-    dem = pd.read_sql_query("SELECT student_number, id, measured_year, grade_level FROM clean_data.demographics", engine)
+    dem = get_dem_df(engine)[['student_number', 'id', 'measured_year', 'grade_level']]
     stuterm_dem_df = stuterm_df.merge(dem, how='left',
                                       left_on=['studentid', 'measured_year'],
                                       right_on=['student_number', 'measured_year'])
@@ -1520,19 +1246,42 @@ def tfa_teacher(stuterm_df, engine):
     return stuterm_tfa_teacher_df['teacher_name']
 
 
-def get_att_sql(att_col_name, att_code):
+# attendance feature name: att_code in clean_data.att_by_day_12_16
+att_codes = {'att_tardiness': 'tardy',
+             'att_absence': 'absent',
+             'att_with_explanation': 'with explanation',
+             'att_other': 'other',
+             'att_excused_absence': 'excused',
+             'att_unexcused_absence': 'unexcused',
+             'att_leave_early': 'leaves early',
+             'att_school_activity': 'school activity',
+             'att_nurse': 'nurse',
+             'att_half_day_absence': 'half day absent',
+             'att_in_school_suspension': 'in-school suspension',
+             'att_truancy': 'truancy',
+             'att_counselor': 'counselor',
+             'att_administrator': 'administrator'}
+
+
+def get_att_sql(att_col_codes):
     """
-    SQL shell for demographics data. If feature is static, then
-    most recent record is applied for that student.
+    SQL for attendance counts per stuterm of several attendance codes at
+    once, one scan of the daily attendance with a filtered count per code.
+    Days are put in terms by joining them to clean_data.season_calendar.
+    Counts of 0 are NULL, as stuterms without any days of a code have
+    always been.
 
-    :param att_col_name: name of feature to be reflected in later DataFrame
-    :type dem_col: str
-    :param att_code: code of attendance feature in attendance table
-    :type static: str
+    :param att_col_codes: names of the feature columns and the code each counts
+    :type att_col_codes: dict[str, str]
 
     :returns: full sql statement
     :rtype: str
     """
+    counts_str = ',\n                '.join(
+        "NULLIF(COUNT(*) FILTER (WHERE att.att_code = '{code}'), 0) AS {col_name}"
+        .format(col_name=col_name, code=code)
+        for col_name, code in att_col_codes.items())
+    codes_str = ', '.join("'{}'".format(code) for code in att_col_codes.values())
     att_sql = """
               WITH dem AS (
                   SELECT
@@ -1543,86 +1292,51 @@ def get_att_sql(att_col_name, att_code):
               ),
               att AS (
                 SELECT
-                    att_by_day_12_16.*,
+                    att_by_day_12_16.att_date,
+                    att_by_day_12_16.att_code,
                     dem.student_number
                 FROM
                     clean_data.att_by_day_12_16
                     INNER JOIN dem
                         ON (att_by_day_12_16.studentid = dem.id)
                 WHERE
-                  att_code = '{code}'
-              ),
-              map_season_date AS (
-                SELECT
-                    DISTINCT measured_year,
-                    season,
-                    CASE season
-                        WHEN 'fall'
-                            THEN TO_DATE('20' || map.cal_year || '-08-01',
-                                         'YYYY-MM-DD')
-                        WHEN 'winter'
-                            THEN TO_DATE('20' || map.cal_year || '-01-01',
-                                         'YYYY-MM-DD')
-                        WHEN 'spring'
-                            THEN TO_DATE('20' || map.cal_year || '-03-01',
-                                         'YYYY-MM-DD')
-                    END season_start,
-                    CASE season
-                        WHEN 'fall'
-                            THEN TO_DATE('20' || map.cal_year+1 || '-01-01',
-                                         'YYYY-MM-DD')
-                        WHEN 'winter'
-                            THEN TO_DATE('20' || map.cal_year || '-03-01',
-                                         'YYYY-MM-DD')
-                        WHEN 'spring'
-                            THEN TO_DATE('20' || map.cal_year || '-08-01',
-                                         'YYYY-MM-DD')
-                    END season_end
-                FROM
-                    clean_data.map
+                  att_code IN ({codes_str})
               )
 
               SELECT
-                map_season_date.measured_year,
-                map_season_date.season,
+                season_calendar.measured_year,
+                season_calendar.season,
                 att.student_number,
-                COUNT(*) AS {col_name}
+                {counts_str}
               FROM
                 att
-                INNER JOIN map_season_date
-                    ON (att.att_date >= map_season_date.season_start
-                        AND att.att_date < map_season_date.season_end)
+                INNER JOIN clean_data.season_calendar
+                    ON (att.att_date = season_calendar.cal_date)
               GROUP BY
                 measured_year,
                 season,
                 student_number;
-                """.format(col_name=att_col_name, code=att_code)
+                """.format(counts_str=counts_str, codes_str=codes_str)
     return att_sql
 
 
-def make_attendance_feature(att_code, att_col_name):
-    """Make features that utilize the attendance dataset
-    :param feature_str: the name of the feature to make
-    :type feature_str: str
-    :returns: function that will accept stuterm_df and engine
-    """
-    return lambda stuterm_df, engine: att_feature(stuterm_df, engine,
-                                                  att_code, att_col_name)
-
-
-def att_feature(stuterm_df, engine, att_code, att_col_name):
+def build_att_features(stuterm_df, engine, feature_strs):
     """
-    Generates attendance metrics per term for each student
+    Generates attendance metrics per term for each student, all the
+    attendance features asked for come from one query
 
-    :param att_code: code in attendance table for that att feature
-    :type att_code: str
-    :param att_col_name: column name for that attendance feature
-    :type att_col_name: str
+    :param stuterm_df: studentid, year, season data
+    :param engine: a db engine to use
+    :param feature_strs: names of attendance features in att_codes
+    :type stuterm_df: pandas DataFrame
+    :type engine: sqlalchemy engine
+    :type feature_strs: list[str]
 
-    :returns: attendance feature
+    :returns: attendance features
     :rtype: pandas DataFrame
     """
-    att_sql = get_att_sql(att_col_name, att_code)
+    att_sql = get_att_sql({feature_str: att_codes[feature_str]
+                           for feature_str in feature_strs})
     att_df = pd.read_sql_query(att_sql, engine)
     stuterm_att_df = stuterm_df.merge(att_df, how='left',
                                       left_on=['studentid',
@@ -1631,40 +1345,62 @@ def att_feature(stuterm_df, engine, att_code, att_col_name):
                                       right_on=['student_number',
                                                 'measured_year',
                                                 'season'])
-    return stuterm_att_df[att_col_name]
+    return stuterm_att_df[feature_strs]
+
+
+def make_attendance_feature(att_code, att_col_name):
+    """Make features that utilize the attendance dataset
+    :param att_code: code in attendance table for that att feature
+    :param att_col_name: column name for that attendance feature
+    :type att_code: str
+    :type att_col_name: str
+    :returns: function that will accept stuterm_df and engine
+    """
+    return lambda stuterm_df, engine: build_att_features(stuterm_df, engine,
+                                                         [att_col_name])[att_col_name]
 
 
 def map_max_score(stuterm_df, engine):
     stuterm_df_copy = stuterm_df
     stuterm_df_copy['map_testritscore'] = make_feature_from_str('map_testritscore', engine, stuterm_df)
-    stuterm_df_copy['season_order'] = stuterm_df_copy['season'].apply(lambda x:{'fall': 1, 'winter': 2, 'spring': 3}[x])
-    max_scores = stuterm_df_copy.sort_values(['studentid', 'measured_year', 'season_order'])\
-                                .groupby('studentid').apply(max_score_to_date).reset_index()
-    stuterm_df_copy = stuterm_df_copy.reset_index().merge(max_scores, how='left',
-                                                          left_on=stuterm_df_copy.reset_index()['index'],
-                                                          right_on=max_scores['level_1'])
-    return stuterm_df_copy['max_score']
+    stuterm_df_copy['season_order'] = stuterm_df_copy['season'].map({'fall': 1, 'winter': 2, 'spring': 3})
+    max_scores = max_score_to_date(stuterm_df_copy.sort_values(['studentid', 'measured_year', 'season_order']))
+    return pd.Series(max_scores.reindex(stuterm_df_copy.index).values, name='max_score')
 
 
 def max_score_to_date(df):
-    df['max_score'] = df['map_testritscore']
-    for (prev_index, prev_row), (this_index, this_row) in helpers.pairwise(df.iterrows()):
-        if len(df) == 1:
-            pass
-        elif this_row['map_testritscore'] > df.loc[prev_index, 'max_score']:
-            df.loc[this_index, 'max_score'] = df.loc[this_index, 'map_testritscore']
-        else:
-            df.loc[this_index, 'max_score'] = df.loc[prev_index, 'max_score']
-    return df['max_score']
+    """Highest map_testritscore a student has had up to each term.
+    A missing score keeps the previous maximum, and a student whose first
+    score is missing never gets one.
+
+    :param df: studentid and map_testritscore, sorted by student then term
+    :type df: pandas DataFrame
+    :returns: pandas Series of max scores with the index of df
+    """
+    scores = df['map_testritscore']
+    students = df['studentid']
+    max_score = scores.groupby(students).cummax().groupby(students).ffill()
+    first_rows = students != students.shift(1)
+    first_missing = (first_rows & scores.isnull()).groupby(students).transform(max)
+    max_score[first_missing.astype(bool)] = np.nan
+    max_score.name = 'max_score'
+    return max_score
 
 
 def num_consecutive_negs(df):
-    df['num_consecutive_negs'] = 0
-    df.ix[df.index[0], 'num_consecutive_negs'] = int(df.ix[df.index[0], 'diffs'] < 0)
-    for (prev_index, prev_row), (this_index, this_row) in helpers.pairwise(df.iterrows()):
-        if this_row['diffs'] < 0:
-            df.loc[this_index, 'num_consecutive_negs'] = df.loc[prev_index, 'num_consecutive_negs'] +1
-    return df['num_consecutive_negs']
+    """Length of the run of negative diffs each student is on at each term,
+    restarting at every non negative diff and at every new student.
+
+    :param df: studentid and diffs, sorted by student then term
+    :type df: pandas DataFrame
+    :returns: pandas Series of run lengths with the index of df
+    """
+    negs = df['diffs'] < 0
+    students = df['studentid']
+    run_starts = ~negs | (students != students.shift(1))
+    cons_negs = negs.astype(int).groupby(run_starts.cumsum()).cumsum()
+    cons_negs.name = 'num_consecutive_negs'
+    return cons_negs
 
 
 def map_derived_feature(feature_type, stuterm_df, engine):
@@ -1726,11 +1462,8 @@ def map_derived_feature(feature_type, stuterm_df, engine):
                                       right_on=['studentid', 'measured_year', 'season'])
         return stuterm_df['number_tests_taken']
     elif feature_type == 'num_tests_term':
-        map_col = "testritscore"
-        where_statement = "where discipline = 'Reading'"
-        map_select_sql = """select {map_col}, studentid, measured_year, season
-                    from clean_data.map {where_statement}""".format(map_col=map_col, where_statement=where_statement)
-        map_col_df = pd.read_sql_query(map_select_sql, engine)
+        map_col_df = get_map_df(engine, 'Reading')[['testritscore', 'studentid',
+                                                    'measured_year', 'season']]
         test_counts = map_col_df.groupby(['studentid',
                                           'measured_year',
                                           'season']).count()['testritscore'].reset_index()
@@ -1740,21 +1473,18 @@ def map_derived_feature(feature_type, stuterm_df, engine):
                                       right_on=['studentid', 'measured_year', 'season'])
         return stuterm_df['number_tests_term']
     elif feature_type == 'num_consecutive_negs':
-        cons_negs = stuterm_df.sort_values(['studentid',
-                                            'measured_year',
-                                            'season'])\
-                              .groupby('studentid').apply(num_consecutive_negs).reset_index()
-        stuterm_df = stuterm_df.reset_index().merge(cons_negs, how='left',
-                                                    left_on=stuterm_df.reset_index()['index'],
-                                                    right_on=cons_negs['level_1'])
-        return stuterm_df['num_consecutive_negs']
+        cons_negs = num_consecutive_negs(stuterm_df.sort_values(['studentid',
+                                                                 'measured_year',
+                                                                 'season']))
+        return pd.Series(cons_negs.reindex(stuterm_df.index).values,
+                         name='num_consecutive_negs')
 
 
 def make_map_feature_derived(feature_str):
     return lambda stuterm_df, engine: map_derived_feature(feature_str, stuterm_df, engine)
 
 feat_fun = {
-    'female': female_feature,
+    'female': make_demographics_feature('female'),
     'eventual186': stuterm_labels_eventual_not_186(3, True),
     'eventualnot186': stuterm_labels_eventual_not_186(3),
     'eventualnot186_with2nd': stuterm_labels_eventual_not_186(2),
@@ -1831,28 +1561,28 @@ feat_fun = {
     'rsa_log_passed_occt': make_rsa_log_feature('PASSED_OCCT'),
     'rsa_log_exemption': make_rsa_log_feature('EXEMPTION'),
     'rsa_log_meets_rsa_criteria': make_rsa_log_feature('MEETS_RSA_CRITERIA'),
-    'iread_is_enrolled': iread_enrolled,
-    'iread_data_missing': iread_data_missing,
-    'iread_took_screener': iread_took_screener,
-    'iread_average_time_per_topic': iread_average_time_per_topic,
-    'iread_average_sessions_per_week': iread_average_sessions_per_week,
-    'iread_current_series': make_iread_current_series_topic('series'),
-    'iread_current_topic': make_iread_current_series_topic('topic'),
+    'iread_is_enrolled': make_iread_feature('iread_is_enrolled'),
+    'iread_data_missing': make_iread_feature('iread_data_missing'),
+    'iread_took_screener': make_iread_feature('iread_took_screener'),
+    'iread_average_time_per_topic': make_iread_feature('iread_average_time_per_topic'),
+    'iread_average_sessions_per_week': make_iread_feature('iread_average_sessions_per_week'),
+    'iread_current_series': make_iread_feature('iread_current_series'),
+    'iread_current_topic': make_iread_feature('iread_current_topic'),
     'iread_screener_placement_series': make_iread_feature('iread_screener_placement_series'),
     'iread_highest_unit_reached': make_iread_feature('iread_highest_unit_reached'),
     'iread_total_sessions': make_iread_feature('iread_total_sessions'),
     'iread_total_topics_completed': make_iread_feature('iread_total_topics_completed'),
     'iread_total_time': make_iread_feature('iread_total_time'),
-    'ethnicity': ethnicity_feature,
+    'ethnicity': make_demographics_feature('ethnicity'),
     'age': age_feature,
-    'ell': ell_feature,
-    'ell_language': ell_lang_feature,
-    'disability_code': disability_code_feature,
-    'service_delivery': service_delivery_feature,
-    'lunch_status': lunch_feature,
-    'homeless': homeless_feature,
-    'lives_with': lives_with_feature,
-    'school': school_feature,
+    'ell': make_demographics_feature('ell'),
+    'ell_language': make_demographics_feature('ell_language'),
+    'disability_code': make_demographics_feature('disability_code'),
+    'service_delivery': make_demographics_feature('service_delivery'),
+    'lunch_status': make_demographics_feature('lunch_status'),
+    'homeless': make_demographics_feature('homeless'),
+    'lives_with': make_demographics_feature('lives_with'),
+    'school': make_demographics_feature('school'),
     'reenroll_num': make_reenroll_feature('num'),
     'reenroll_off_peak': make_reenroll_feature('off_peak'),
     'reenroll_pss': make_reenroll_feature('pss'),
@@ -1904,3 +1634,54 @@ feat_fun = {
 
 def make_feature_from_str(feature_str, engine, stuterm_df):
     return feat_fun[feature_str](stuterm_df, engine)
+
+
+# features that are made together, family name: (feature names, builder)
+# a builder takes stuterm_df, engine and the feature names to make, and
+# returns a DataFrame with a column per feature
+feature_families = {'map': (list(map_aggregates), build_map_features),
+                    'tripod': (tripod_features, build_tripod_features),
+                    'discipline': (discipline_features, build_discipline_features),
+                    'rsa_log': (list(rsa_log_subtypes), build_rsa_log_features),
+                    'reenroll': (reenroll_features, build_reenroll_features),
+                    'attendance': (list(att_codes), build_att_features),
+                    'demographics': (list(dem_features), build_demographics_features),
+                    'iread': (iread_features, build_iread_features),
+                    'grades': (grades_features, build_grades_features)}
+
+
+def group_by_family(feature_strs):
+    """Split feature_strs into lists of features that are made together
+
+    :param feature_strs: the features to make
+    :type feature_strs: list[str]
+    :returns: list[list[str]] -- a list per family, and one per other feature
+    """
+    groups = []
+    family_groups = {}
+    for feature_str in feature_strs:
+        family = next((family for family, (family_feats, builder) in feature_families.items()
+                       if feature_str in family_feats), None)
+        if family is None:
+            groups.append([feature_str])
+        elif family not in family_groups:
+            family_groups[family] = [feature_str]
+            groups.append(family_groups[family])
+        else:
+            family_groups[family].append(feature_str)
+    return groups
+
+
+def make_features_from_strs(feature_strs, engine, stuterm_df):
+    """Make features that are made together, see group_by_family
+
+    :param feature_strs: one group from group_by_family
+    :type feature_strs: list[str]
+    :returns: pandas DataFrame with a column per feature
+    """
+    for family_feats, builder in feature_families.values():
+        if feature_strs[0] in family_feats:
+            return builder(stuterm_df, engine, feature_strs)
+    feat = pd.DataFrame(make_feature_from_str(feature_strs[0], engine, stuterm_df))
+    feat.columns = feature_strs
+    return feat
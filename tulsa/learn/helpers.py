@@ -1,6 +1,24 @@
 import logging
 import os
 from itertools import tee
+import numpy as np
+import pandas as pd
+
+def termids_to_ac_years(termids):
+    """produces str academic years in the form YY_YY+1
+    from 4 digit termids, or 'nan' for invalid termids
+
+    :param termids: the termids to convert
+    :type termids: pandas Series
+    :returns: pandas Series
+    """
+    str_termids = termids.astype(str)
+    valid = str_termids.str.len() == 4
+    key_years = str_termids[valid].str[1]
+    ac_years = pd.Series(np.nan, index=termids.index, dtype=object)
+    ac_years[valid] = '1' + key_years + '_1' + (key_years.astype(int) + 1).astype(str)
+    return ac_years
+
 
 def termid_to_ac_year(termid):
     """produces an str academic year in the form YY_YY+1
@@ -10,12 +28,49 @@ def termid_to_ac_year(termid):
     :type termid: int
     :returns: str
     """
-    str_termid = str(termid)
-    if not len(str_termid) == 4:
-        return float('nan')
-    else:
-        key_year = int(str_termid[1])
-        return '1{}_1{}'.format(key_year, key_year+1)
+    return termids_to_ac_years(pd.Series([termid])).iloc[0]
+
+
+# popular classes and their categories, other classes are 'non-grade'
+course_categories = {'P E': 'pe',
+                     'MUSIC': 'art',
+                     'ART': 'art',
+                     'GR 1 SCIENCE': 'science',
+                     'GR 1 SOCST': 'social',
+                     'GR 1 MATH': 'math',
+                     'GR 1 READ': 'read',
+                     'GR 2 READ': 'read',
+                     'GR 2 SOCST': 'social',
+                     'GR 2 MATH': 'math',
+                     'GR 2 SCIENCE': 'science',
+                     'GR 3 MATH': 'math',
+                     'GR 3 READ': 'read',
+                     'GR 3 SCIENCE': 'science',
+                     'GR 3 SOCST': 'social',
+                     'COMPUTER': 'computer',
+                     'WDN GRADES ONLY': 'non_grade',
+                     'LIBRARY SKILLS': 'read',
+                     'NO GRADES EARNED': 'non_grade',
+                     'GR 2 READ (SPANISH)': 'language',
+                     'GR 1 READ (SPANISH)': 'language',
+                     'SPANISH': 'language',
+                     'FRENCH': 'language',
+                     'GR 3 READ (SPANISH)': 'language',
+                     'SPANISH READING': 'language'}
+
+valid_grades = frozenset(['a', 'b', 'c', 'd',
+                          'e', 'f', 's', 'n',
+                          'u', 'p', 'ng'])
+
+
+def categorize_course_names(course_names):
+    """categorize popular classes into 10 major categories, for each class
+
+    :param course_names: the course names to categorize
+    :type course_names: pandas Series
+    :returns: pandas Series
+    """
+    return course_names.map(course_categories).fillna('non-grade')
 
 
 def categorize_courses(course_name):
@@ -25,35 +80,19 @@ def categorize_courses(course_name):
     :type course_name: str
     :returns: str
     """
-    courses_cat = {'P E': 'pe',
-                   'MUSIC': 'art',
-                   'ART': 'art',
-                   'GR 1 SCIENCE': 'science',
-                   'GR 1 SOCST': 'social',
-                   'GR 1 MATH': 'math',
-                   'GR 1 READ': 'read',
-                   'GR 2 READ': 'read',
-                   'GR 2 SOCST': 'social',
-                   'GR 2 MATH': 'math',
-                   'GR 2 SCIENCE': 'science',
-                   'GR 3 MATH': 'math',
-                   'GR 3 READ': 'read',
-                   'GR 3 SCIENCE': 'science',
-                   'GR 3 SOCST': 'social',
-                   'COMPUTER': 'computer',
-                   'WDN GRADES ONLY': 'non_grade',
-                   'LIBRARY SKILLS': 'read',
-                   'NO GRADES EARNED': 'non_grade',
-                   'GR 2 READ (SPANISH)': 'language',
-                   'GR 1 READ (SPANISH)': 'language',
-                   'SPANISH': 'language',
-                   'FRENCH': 'language',
-                   'GR 3 READ (SPANISH)': 'language',
-                   'SPANISH READING': 'language'}
-    try:
-        return courses_cat[course_name]
-    except KeyError:
-        return 'non-grade'
+    return categorize_course_names(pd.Series([course_name])).iloc[0]
+
+
+def categorize_grade_marks(grades):
+    """categorize grades into standard grades or non, for each grade
+
+    :param grades: the grade names to normalize
+    :type grades: pandas Series
+    :returns: pandas Series
+    """
+    lowered = grades.str.lower()
+    # either no grade, or grade not a valid grade
+    return lowered.where(lowered.isin(valid_grades), 'non_standard_grade')
 
 
 def categorize_grades(grade):
@@ -63,15 +102,61 @@ def categorize_grades(grade):
     :type grade: str
     :returns: str
     """
-    valid_grades = frozenset(['a', 'b', 'c', 'd',
-                              'e', 'f', 's', 'n',
-                              'u', 'p', 'ng'])
-    if grade:
-        grade = grade.lower()
-        if grade in valid_grades:
-            return grade
-    # either no grade, or grade not a valid grade
-    return 'non_standard_grade'
+    return categorize_grade_marks(pd.Series([grade])).iloc[0]
+
+
+def seasons_from_dates(dates):
+    """"fall", "winter", or "spring" for each date, NaN for missing dates
+    :param dates: the dates to classify
+    :type dates: pandas Series of datetimes
+    :returns: pandas Series
+    """
+    months = pd.to_datetime(dates).dt.month
+    seasons = pd.Series(np.select([months >= 8, months < 3, months >= 3],
+                                  ['fall', 'winter', 'spring'],
+                                  default=None),
+                        index=dates.index)
+    return seasons.where(months.notnull(), np.nan)
+
+
+def ac_years_from_dates(dates):
+    """produces str academic years in the form YY_YY+1, NaN for missing dates
+
+    :param dates: the dates to classify
+    :type dates: pandas Series of datetimes
+    :returns: pandas Series
+    """
+    dates = pd.to_datetime(dates)
+    missing = dates.isnull()
+    # fall starts the academic year, winter and spring end it
+    start_years = (dates.dt.year - (dates.dt.month < 8)).fillna(0).astype(int)
+    ac_years = (start_years % 100).astype(str).str.zfill(2) + '_' + \
+        ((start_years + 1) % 100).astype(str).str.zfill(2)
+    return ac_years.where(~missing, np.nan)
+
+
+def terms_from_dates(dates, calendar_df):
+    """measured_year, season and cal_year of each date, looked up in the
+    season calendar (clean_data.season_calendar) with a binary search.
+    Missing dates and dates outside the calendar are NaN.
+
+    :param dates: the dates to classify
+    :param calendar_df: cal_date, measured_year, season and cal_year of every date
+    :type dates: pandas Series of datetimes
+    :type calendar_df: pandas DataFrame
+    :returns: pandas DataFrame with the index of dates
+    """
+    calendar_df = calendar_df.sort_values('cal_date')
+    cal_dates = pd.to_datetime(calendar_df['cal_date']).values
+    day_dates = pd.to_datetime(dates).dt.normalize().values
+    positions = np.searchsorted(cal_dates, day_dates, side='right') - 1
+    # comparisons with NaT are False, so missing dates are not found either
+    found = (positions >= 0) & (day_dates <= cal_dates[-1])
+    terms_df = calendar_df[['measured_year', 'season', 'cal_year']] \
+        .iloc[np.where(found, positions, 0)].copy()
+    terms_df.index = dates.index
+    terms_df.loc[~found] = np.nan
+    return terms_df
 
 
 def season_from_date(date):
@@ -80,14 +165,7 @@ def season_from_date(date):
     :type date: datetime.datetime
     :returns: str
     """
-    month = date.month
-    if month >= 8 and month < 13:
-        season = 'fall'
-    elif month >= 0 and month < 3:
-        season = 'winter'
-    elif month >= 3 and month < 8:
-        season = 'spring'
-    return season
+    return seasons_from_dates(pd.Series([date])).iloc[0]
 
 
 def ac_year_from_date(date):
@@ -97,57 +175,58 @@ def ac_year_from_date(date):
     :type date: datetime.datetime
     :returns: str
     """
-    season = season_from_date(date)
-    if season == 'fall':
-        start_year, end_year = date.year, date.year + 1
-    elif season in ('spring', 'winter'):
-        start_year, end_year = date.year - 1, date.year
-    start_year_2dig = str(start_year)[2:]
-    end_year_2dig = str(end_year)[2:]
-    return '{}_{}'.format(start_year_2dig, end_year_2dig)
+    return ac_years_from_dates(pd.Series([date])).iloc[0]
 
 
-def alter_features_add_column(from_table, from_col, to_table, engine):
+def alter_features_add_columns(from_table, from_cols, to_table, engine):
     """
-    Copies column from_col from table from_talbe to to_table
-    matching on stuterms
+    Copies columns from_cols from table from_table to to_table
+    matching on stuterms.
+    to_table is rebuilt once with all the new columns joined on, instead of
+    one ALTER and UPDATE per column, and keeps its row order.
     :param from_table: the features table to copy from
+    :param from_cols: the column names in from_table to copy
     :param to_table: the features table to copy to
-    :param from_col: the column name in from_table to copy
     :param engine: the engine to use
-    :param from_table: str
-    :param to_table: str
-    :param from_col: str
-    :param engine: sqlalchemy engine
+    :type from_table: str
+    :type from_cols: list[str]
+    :type to_table: str
+    :type engine: sqlalchemy engine
     """
-    col_type_sql = """SELECT data_type
-                      FROM information_schema.columns
-                      WHERE table_schema = 'features'
-                        AND table_name = '{from_table}'
-                        AND column_name = '{from_col}'
-                        """.format(from_table=from_table,
-                                   from_col=from_col)
-    col_type = engine.execute(col_type_sql).fetchone()[0]
-
-    alter_sql = """alter table features.{to_table}
-                    add column {from_col} {col_type}
-                """.format(from_col=from_col,
-                           to_table=to_table,
-                           col_type=col_type)
-
-    engine.execute(alter_sql)
-
-    update_sql = """UPDATE features.{to_table}
-                    SET {from_col} = features.{from_table}.{from_col}
-                    FROM features.{from_table}
-                    WHERE features.{to_table}.studentid = features.{from_table}.studentid
-                        AND features.{to_table}.measured_year = features.{from_table}.measured_year
-                        AND features.{to_table}.season = features.{from_table}.season
-                        """.format(from_table=from_table,
-                                   from_col=from_col,
-                                   to_table=to_table)
-
-    engine.execute(update_sql)
+    from_cols_str = ', '.join(from_cols)
+    new_cols_str = ', '.join('f.{}'.format(col) for col in from_cols)
+
+    index_from_sql = """CREATE INDEX ON features.{from_table}
+                            (studentid, measured_year, season)
+                            """.format(from_table=from_table)
+
+    rebuild_sql = """CREATE TABLE features.{to_table}_rebuild AS
+                     SELECT t.*, {new_cols_str}
+                     FROM features.{to_table} t
+                     LEFT JOIN (SELECT DISTINCT ON (studentid, measured_year, season)
+                                    studentid, measured_year, season, {from_cols_str}
+                                FROM features.{from_table}) f
+                       ON t.studentid = f.studentid
+                         AND t.measured_year = f.measured_year
+                         AND t.season = f.season
+                     ORDER BY t.ctid
+                     """.format(from_table=from_table,
+                                from_cols_str=from_cols_str,
+                                new_cols_str=new_cols_str,
+                                to_table=to_table)
+
+    swap_sqls = ["""DROP TABLE features.{to_table}""".format(to_table=to_table),
+                 """ALTER TABLE features.{to_table}_rebuild
+                        RENAME TO {to_table}""".format(to_table=to_table),
+                 """CREATE INDEX ON features.{to_table}
+                        (studentid, measured_year, season)
+                        """.format(to_table=to_table)]
+
+    with engine.begin() as connection:
+        connection.execute(index_from_sql)
+        connection.execute(rebuild_sql)
+        for swap_sql in swap_sqls:
+            connection.execute(swap_sql)
 
 
 def get_next_ver_number(item_name, state_location, extension=None):
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from tulsa.learn import helpers
+from tulsa.learn import prepare
 
 
 def plot_precision_recall_n(y_true, y_prob, model_name, params, fig_dir='/mnt/data/tulsa/figs'):
@@ -31,13 +32,57 @@ def plot_precision_recall_n(y_true, y_prob, model_name, params, fig_dir='/mnt/da
     return filepath
 
 
-def precision_recall_at_k(y_true, y_pred_probs, k, metric_type):
+class RankedPredictions(object):
+    """ Predictions sorted once, highest first, with the running count of
+    true positives, so every _at_k metric is a lookup.
+    The threshold at k is the score of the int(k * n)th highest prediction,
+    and everything scoring at or above it is predicted positive.
+
+    :param y_true: the actual labels
+    :param y_pred_probs: the predicted probabilities or decision function
+    :type y_true: array like
+    :type y_pred_probs: numpy array
+    """
+    def __init__(self, y_true, y_pred_probs):
+        self.y_pred_probs = np.asarray(y_pred_probs)
+        order = np.argsort(-self.y_pred_probs, kind='mergesort')
+        self.desc_probs = self.y_pred_probs[order]
+        self.cum_true_pos = np.cumsum(np.asarray(y_true)[order])
+
+    def threshold_at(self, k):
+        return self.desc_probs[int(k * len(self.desc_probs))]
+
+    def num_pred_pos_at(self, k):
+        # how many predictions are >= the threshold, ties included
+        return np.searchsorted(-self.desc_probs, -self.threshold_at(k), side='right')
+
+    def y_pred_at(self, k):
+        return (self.y_pred_probs >= self.threshold_at(k)).astype(int)
+
+    def precision_at(self, k):
+        num_pred_pos = self.num_pred_pos_at(k)
+        return self.cum_true_pos[num_pred_pos - 1] / float(num_pred_pos)
+
+    def recall_at(self, k):
+        num_true_pos = self.cum_true_pos[-1]
+        if num_true_pos == 0:
+            return 0.0
+        return self.cum_true_pos[self.num_pred_pos_at(k) - 1] / float(num_true_pos)
+
+
+def precision_recall_at_k(y_true, y_pred_probs, k, metric_type, ranked=None):
     """
     Returns either precision or recall at specified k, where k is proportion of total
+    Pass ranked to reuse the sort of the same predictions.
     """
-    threshold = np.sort(y_pred_probs)[::-1][int(k * len(y_pred_probs))]
-    y_pred = np.asarray([1 if i >= threshold else 0 for i in y_pred_probs])
-    return eval(metric_type + '_score')(y_true, y_pred)
+    if ranked is None:
+        ranked = RankedPredictions(y_true, y_pred_probs)
+    if metric_type == 'precision':
+        return ranked.precision_at(k)
+    elif metric_type == 'recall':
+        return ranked.recall_at(k)
+    else:
+        raise NotImplementedError
 
 
 def make_pred_probs_hist(y_pred_probs, model_name, params, fig_dir='/mnt/data/tulsa/figs/histograms'):
@@ -54,10 +99,12 @@ def make_pred_probs_hist(y_pred_probs, model_name, params, fig_dir='/mnt/data/tu
     return filepath
 
 
-def feature_pred_crosstab(y_pred_probs, y_test, X_test, k, feature_list=['female', 'ethnicity___a', 'ethnicity___b', 'ethnicity___h', 'ethnicity___i', 'ethnicity___m', 'ethnicity___p', 'ethnicity___w']):
-    threshold = np.sort(y_pred_probs)[::-1][int(k * len(y_pred_probs))]
-    y_pred = np.asarray([1 if i >= threshold else 0 for i in y_pred_probs])
+def feature_pred_crosstab(y_pred_probs, y_test, X_test, k, feature_list=['female', 'ethnicity___a', 'ethnicity___b', 'ethnicity___h', 'ethnicity___i', 'ethnicity___m', 'ethnicity___p', 'ethnicity___w'], ranked=None):
+    if ranked is None:
+        ranked = RankedPredictions(y_test, y_pred_probs)
+    y_pred = ranked.y_pred_at(k)
     y_test.name = 'y_actual'
+    X_test = prepare.densify(X_test)
     label_feature_pred_df = pd.concat([X_test.reset_index(), y_test.reset_index()], axis=1)
     label_feature_pred_df = label_feature_pred_df.rename(columns={0: 'y_pred'})
     feat_crosstab = pd.DataFrame()
@@ -85,12 +132,26 @@ def feature_pred_crosstab(y_pred_probs, y_test, X_test, k, feature_list=['female
     return feat_crosstab
 
 
-def make_metric(metric_name, y_pred_probs, y_true, X_test, model_name, params):
+def make_metrics(metric_names, y_pred_probs, y_true, X_test, model_name, params):
+    """
+    Makes every metric in metric_names for one set of predictions,
+    sorting the predictions only once for all the _at_k metrics.
+    :returns: the metric values, in the order of metric_names
+    :rtype: list
+    """
+    ranked = RankedPredictions(y_true, y_pred_probs)
+    return [make_metric(metric_name, y_pred_probs, y_true, X_test, model_name,
+                        params, ranked)
+            for metric_name in metric_names]
+
+
+def make_metric(metric_name, y_pred_probs, y_true, X_test, model_name, params,
+                ranked=None):
     # met_funs = {'precision_recall_curve': plot_precision_recall_n}
     if ('precision_at_' in metric_name) | ('recall_at_' in metric_name):
         k = float(str.split(metric_name, "_")[2]) / 100
         metric_type = str.split(metric_name, "_")[0]
-        return precision_recall_at_k(y_true, y_pred_probs, k, metric_type)
+        return precision_recall_at_k(y_true, y_pred_probs, k, metric_type, ranked)
     elif metric_name == 'pre_rec_n_graph':
         return plot_precision_recall_n(y_true, y_pred_probs, model_name, params)
     elif metric_name == 'auc':
@@ -99,6 +160,6 @@ def make_metric(metric_name, y_pred_probs, y_true, X_test, model_name, params):
         return make_pred_probs_hist(y_pred_probs, model_name, params)
     elif ('crosstab_at_' in metric_name):
         k = float(str.split(metric_name, "_")[2]) / 100
-        return feature_pred_crosstab(y_pred_probs, y_true, X_test, k)
+        return feature_pred_crosstab(y_pred_probs, y_true, X_test, k, ranked=ranked)
     else:
         raise NotImplementedError
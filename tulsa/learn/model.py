@@ -1,14 +1,18 @@
 from tulsa.learn import evaluate
 from tulsa.learn import features
+from tulsa.learn import feature_store
 from tulsa.learn import prepare
 from tulsa.learn import splits
 from tulsa.learn import helpers
 from tulsa.learn import report
+from tulsa.learn.result_writer import ResultWriter
+from tulsa.bulk_copy import copy_df_to_db
 
 import logging
 import pandas as pd
 import numpy as np
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class TulsaModel(object):
@@ -22,12 +26,21 @@ class TulsaModel(object):
     :param split_strategy: the strategy to create test/train splits
     :param regenerate: flag if labels should be regenerated rather than read 
                        from db
+    :param feature_workers: how many features to generate at the same time
+    :param model_workers: how many models to fit at the same time
+    :param store: where features are saved and loaded, by default the
+                  features.<label_name> table
+    :param sparse: keep one hot encoded categorical features sparse
     :type engine: sqlalchemy engine
     :type features_to_make: list[str]
     :type label_name: str
     :type model_name: str
     :type split_strategy: str
     :type regenerate: bool
+    :type feature_workers: int
+    :type model_workers: int
+    :type store: feature_store.PostgresFeatureStore or feature_store.NpyFeatureStore
+    :type sparse: bool
     """
     def __init__(self, engine,
                  features_to_make,
@@ -38,7 +51,11 @@ class TulsaModel(object):
                  regenerate,
                  run_name,
                  state_location,
-                 scale):
+                 scale,
+                 feature_workers=1,
+                 store=None,
+                 model_workers=1,
+                 sparse=False):
         self.features_to_make = features_to_make
         self.engine = engine
         self.label_name = label_name
@@ -51,6 +68,15 @@ class TulsaModel(object):
         self.run_number = helpers.get_next_ver_number(self.run_name,
                                                       self.state_location)
         self.scale = scale
+        self.feature_workers = feature_workers
+        self.model_workers = model_workers
+        self.sparse = sparse
+        if store is None:
+            store = feature_store.PostgresFeatureStore(engine, label_name)
+        self.store = store
+        # the background writer of fit_models_and_metrics, results written
+        # outside of it are uploaded straight away
+        self.result_writer = None
         self.label_feature_df = None
         logging.debug('regeneration is: %s', self.regenerate)
         logging.debug('scaling is : %s', self.scale)
@@ -68,17 +94,12 @@ class TulsaModel(object):
         self.label_feature_df = self.labels
 
     def load_cols(self, cols):
-        """Load columns cols from feature databas
+        """Load columns cols from the feature store
         :param cols: the columns to laod
         :type cols: list[str]
         :returns: pandas DataFrame of columns
         """
-        cols_str = ', '.join(cols)
-        load_feats_sql = """SELECT {cols_str}
-                         FROM features.{label_name}
-                         ;""".format(cols_str=cols_str,
-                                     label_name=self.label_name)
-        return pd.read_sql(load_feats_sql, self.engine)
+        return self.store.load_columns(cols)
 
     def load_labels(self):
         """Try to loads labels from the database
@@ -106,15 +127,41 @@ class TulsaModel(object):
     def make_features(self, features_to_create):
         """Creates features for everything in features_to_create.
         This stores the faetures in label_feature_df, so you don't have to load them as well.
+        Features of the same family (like the MAP aggregates) are made
+        together by one builder, see features.feature_families.
+        Up to feature_workers features are made at the same time, on threads
+        since they mostly wait on the database, and all of them are added to
+        label_feature_df in one concat at the end.
+        Source tables are read once and shared by all the features through
+        features.source_cache, which is emptied again afterwards.
         """
-        for feature_name in features_to_create:
-            logging.debug('trying to make feature %s', feature_name)
-            unnamed_feat = features.make_feature_from_str(feature_name,
-                                                          self.engine,
-                                                          self.stuterm_df)
-            feat = pd.DataFrame(unnamed_feat)  # make sure this is not a series
-            feat.columns = [feature_name]
-            self.label_feature_df = pd.concat([self.label_feature_df, feat], axis=1)
+        if not features_to_create:
+            return
+        feature_groups = features.group_by_family(features_to_create)
+        try:
+            if self.feature_workers > 1:
+                with ThreadPoolExecutor(max_workers=self.feature_workers) as executor:
+                    feats = list(executor.map(self.make_feature_group, feature_groups))
+            else:
+                feats = [self.make_feature_group(feature_names)
+                         for feature_names in feature_groups]
+        finally:
+            features.source_cache.clear()
+        feats_df = pd.concat(feats, axis=1)[list(features_to_create)]
+        self.label_feature_df = pd.concat([self.label_feature_df, feats_df], axis=1)
+
+    def make_feature_group(self, feature_names):
+        """Creates feature columns that are made together
+        Each group gets its own copy of stuterm_df, as some features add
+        columns to it.
+        :param feature_names: a group of features from features.group_by_family
+        :type feature_names: list[str]
+        :returns: pandas DataFrame with a column per feature
+        """
+        logging.debug('trying to make features %s', feature_names)
+        return features.make_features_from_strs(feature_names,
+                                                self.engine,
+                                                self.stuterm_df.copy())
 
     def load_features(self, features_to_load):
         """Try to loads features from the database
@@ -132,13 +179,7 @@ class TulsaModel(object):
         :type feature_name: list[str]
         :returns: tuple ([features_in_db], [features_not_in_db])
         """
-        get_columns_query = """SELECT column_name
-                                FROM information_schema.columns
-                                WHERE table_schema = 'features'
-                                  AND table_name   = '{label_name}'
-                                  """.format(label_name=self.label_name)
-        fetched = self.engine.execute(get_columns_query).fetchall()
-        column_names = [row[0] for row in fetched]
+        column_names = self.store.existing_columns()
         logging.debug('Columns I found in features. %s are: %s',
                       self.label_name, column_names)
         features_in_db = []
@@ -178,15 +219,7 @@ class TulsaModel(object):
         :type features_not_in_db: list[str]
         """
         not_in_df = self.label_feature_df[features_not_in_db]
-        temp_data_df = pd.concat([self.stuterm_df, not_in_df], axis=1)
-        temp_data_df.to_sql(name='temp',
-                            con=self.engine,
-                            schema='features',
-                            if_exists='replace',
-                            index=False)
-        for feat in features_not_in_db:
-            logging.debug('trying to add to features table', feat)
-            helpers.alter_features_add_column('temp', feat, self.label_name, self.engine)
+        self.store.add_columns(self.stuterm_df, not_in_df)
 
     def save_all_data_to_db(self):
         """put together all dataframes in the format
@@ -198,11 +231,7 @@ class TulsaModel(object):
         all_data_df = pd.concat([self.stuterm_df, self.label_feature_df], axis=1)
         # this can take a while so timing it
         start_time = time.time()
-        all_data_df.to_sql(name=self.label_name,
-                           con=self.engine,
-                           schema='features',
-                           if_exists='replace',
-                           index=False)
+        self.store.save_all(all_data_df)
         end_time = time.time()
         time_taken = end_time - start_time
         logging.info('Saving Time: %s seconds', time_taken)
@@ -235,26 +264,38 @@ class TulsaModel(object):
     def fit_models_and_metrics(self):
         """Fit all models in models_to_make on the test parts of each
         split from self.splits and make all metrics.
+        All splits x models x params are fitted under one scheduler (see
+        evaluate.fit_splits), and results are uploaded by a background
+        ResultWriter so uploads never hold up fitting.
         """
         # store the y_preds of the splits
         self.splits_y_preds = {}
         # store the feat_imps of the splits
         self.splits_feat_imps = {}
 
+        split_keys = []
+        split_data = []
         for split_strategy, test_dict in self.splits.items():
-
             # were going to associate splits with y_preds and featimps
             self.splits_y_preds[split_strategy] = dict()
             self.splits_feat_imps[split_strategy] = dict()
-
             for test_name, split in test_dict.items():
-                result_list, feat_imp_df, feat_crosstab, y_preds_df = \
-                    evaluate.fit_models_and_metrics(split['X_train'],
-                                                    split['X_test'],
-                                                    split['y_train'],
-                                                    split['y_test'],
-                                                    self.models_to_make,
-                                                    self.metrics_to_make)
+                split_keys.append((split_strategy, test_name))
+                split_data.append((split['X_train'],
+                                   split['X_test'],
+                                   split['y_train'],
+                                   split['y_test']))
+
+        split_results = evaluate.fit_splits(split_data,
+                                            self.models_to_make,
+                                            self.metrics_to_make,
+                                            self.model_workers)
+
+        self.result_writer = ResultWriter(self.upload_result_to_db)
+        try:
+            for (split_strategy, test_name), results in zip(split_keys, split_results):
+                split = self.splits[split_strategy][test_name]
+                result_list, feat_imp_df, feat_crosstab, y_preds_df = results
 
                 # TODO: could results be returned as DFs
                 # so that they could be handle more easily
@@ -282,41 +323,27 @@ class TulsaModel(object):
 
                 for table_name, df in tab_df.items():
                     df['test_name'] = test_name
-                    self.upload_result_to_db(df, table_name=table_name)
+                    self.result_writer.put(df, table_name)
+        finally:
+            result_writer, self.result_writer = self.result_writer, None
+            result_writer.close()
 
     def impute_missing_values(self):
         """Impute missing values on the label_feature dataframe
         using column specific strategies defined in prepare module.
         """
         cols_before = len(self.label_feature_df.columns)
-        imputed_label_feature_df = pd.DataFrame()
-        for col_name in self.label_feature_df.columns:
-            logging.debug('trying to impute col %s', col_name)
-            col = self.label_feature_df[col_name]
-            scale = False if col_name == self.label_name else self.scale
-            num_nans_before = col.isnull().sum()
-            imputed_col = prepare.make_imputed_col(col_name,
-                                                   col,
-                                                   self.stuterm_df,
-                                                   scale)
-            num_nans_after = imputed_col.isnull().sum()
-            if not scale:
-                logging.debug('Im not scaling %s ', col_name)
-
-            logging.debug('after scaling %s has mean %s',
-                          col_name, imputed_col.mean())
-
-            logging.debug("NaNs before imputation: %s, after: %s", num_nans_before,
-                          num_nans_after)
-            imputed_label_feature_df = pd.concat(
-                (imputed_label_feature_df, imputed_col), axis=1)
-
-            imputed_col_names = list(imputed_col.columns)
-
-            if len(imputed_col_names) > 1:
-                # imputed_col may be a dataframe exploded from categorical
-                # so we cannot simply replace the old col_name
-                logging.debug("Exploded %s into %s", col_name, imputed_col_names)
+        logging.debug('NaNs before imputation: %s',
+                      self.label_feature_df.isnull().sum().to_dict())
+        if not self.scale:
+            logging.debug('Im not scaling')
+        imputed_label_feature_df = prepare.make_imputed_df(self.label_feature_df,
+                                                           self.stuterm_df,
+                                                           self.scale,
+                                                           unscaled_cols=[self.label_name],
+                                                           sparse=self.sparse)
+        logging.debug('NaNs after imputation: %s',
+                      imputed_label_feature_df.isnull().sum().to_dict())
 
         cols_after = len(imputed_label_feature_df.columns)
         logging.info('Columns before cat binarizing %s, columns after %s',
@@ -337,7 +364,8 @@ class TulsaModel(object):
         self.stuterm_df = non_nan_stuterm
 
     def write_results(self, result_row):
-        """Write metric results to database
+        """Queue metric results to be written to the database, or write them
+        now if no ResultWriter is running
         :param results_row: the results of a ml run
         :type results_row: list[list[object]]
         """
@@ -347,7 +375,10 @@ class TulsaModel(object):
         results_table = pd.DataFrame.from_records([result_row],
                                                   columns=results_col)
         results_table['params'] = results_table['params'].apply(lambda x: str(x))
-        self.upload_result_to_db(results_table, table_name='results')
+        if self.result_writer is None:
+            self.upload_result_to_db(results_table, 'results')
+        else:
+            self.result_writer.put(results_table, 'results')
 
     def upload_result_to_db(self, results_table, table_name):
         """
@@ -359,8 +390,8 @@ class TulsaModel(object):
         """
         results_table['time'] = str(datetime.now())
         results_table['run_name'] = '{}_{}'.format(self.run_name, self.run_number)
-        results_table.to_sql(name=table_name, schema='results',
-                             con=self.engine, if_exists='append', index=False)
+        copy_df_to_db(results_table, table_name, self.engine,
+                      schema='results', if_exists='append')
 
     def touch_run_number(self):
         """Enumerate run number
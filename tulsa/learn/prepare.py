@@ -1,10 +1,11 @@
 from sklearn.preprocessing import LabelBinarizer
-from sklearn.preprocessing import Imputer
 from sklearn.preprocessing import MinMaxScaler
 from tulsa.etl.sql_str_normer import normalize_name_generic
 
+import logging
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
 
 def impute_zeros(col, stuterm_df):
@@ -32,53 +33,130 @@ def impute_iden(col, stuterm_df):
 
 
 def impute_fun(col, fun):
-    """return col, but with fun applied to NaN entries, 
-    :param col: the column to impute fun on
-    :param fun: function to use, "mean", "media", or "most_frequent"
-    :type col: pandas Series
+    """return col, but with fun of each column applied to its NaN entries,
+    infinities count as NaN. Works on a column or on many at once.
+    Columns with no values at all are filled with 0, with a warning.
+    :param col: the column or columns to impute fun on
+    :param fun: function to use, "mean", "median", or "most_frequent"
+    :type col: pandas Series or DataFrame
     :type fun: str
-    :returns: pandas Series
+    :returns: pandas Series or DataFrame
     """
-    # sk learn is not happy about 1-d DataFrames
     noninf_col = col.replace([np.inf, -np.inf], np.nan)
-    np_rep = noninf_col.reshape(-1, 1)
-    imp = Imputer(missing_values='NaN', strategy=fun)
-    imp.fit(np_rep)
-    transformed = imp.transform(np_rep)
-    return transformed
+    noninf_df = pd.DataFrame(noninf_col)
+    if fun == 'mean':
+        fill_values = noninf_df.mean()
+    elif fun == 'median':
+        fill_values = noninf_df.median()
+    elif fun == 'most_frequent':
+        # the modes of columns with no values are NaN, or missing altogether
+        # if no column has values
+        fill_values = noninf_df.mode().reindex([0]).iloc[0]
+    else:
+        raise ValueError('unknown imputation function {}'.format(fun))
+    all_missing = fill_values.index[fill_values.isnull()]
+    if len(all_missing):
+        logging.warning('no values to impute the %s of %s from, filling with 0',
+                        fun, ', '.join(str(col_name) for col_name in all_missing))
+    imputed_df = noninf_df.fillna(fill_values.fillna(0))
+    if isinstance(col, pd.Series):
+        return imputed_df.iloc[:, 0]
+    return imputed_df
 
 
 def impute_mean(col, stuterm_df):
-    """return col, but with mean, 
-    :param col: the column to impute fun on
+    """return col, but with mean,
+    :param col: the column or columns to impute the mean on
     :param stuterm_df: the index to match to if needed
-    :param fun: function to use, "mean", "media", or "most_frequent"
-    :type col: pandas Series
+    :type col: pandas Series or DataFrame
     :type stuterm_df: pandas DataFrame
-    :type fun: str
-    :returns: pandas Series
+    :returns: pandas Series or DataFrame
     """
-    col_title = col.name
-    imputed = impute_fun(col, 'mean')
-    named_imputed = pd.DataFrame(imputed, columns=[col_title])
-    return named_imputed
+    return impute_fun(col, 'mean')
 
 
-def cat_binarizer(col, stuterm_df):
+def cat_binarizer(col, stuterm_df, sparse=False):
+    """one hot encode col, a column per value named col___value
+    :param col: the categorical column
+    :param stuterm_df: the index to match to if needed
+    :param sparse: keep the one hot columns sparse, for columns like school
+                   with hundreds of values
+    :type col: pandas Series
+    :type stuterm_df: pandas DataFrame
+    :type sparse: bool
+    :returns: pandas DataFrame, of sparse columns if sparse
+    """
     col_title = col.name
-    lb = LabelBinarizer()
-    col_missing = col.fillna(value='missing')
-    col_missing = col_missing.apply(lambda x: str(x))
+    lb = LabelBinarizer(sparse_output=sparse)
+    col_missing = col.fillna(value='missing').astype(str)
     lb.fit(col_missing)
     transformed = lb.transform(col_missing)
     normed_col_names = [normalize_name_generic(col_name, False) for
                         col_name in lb.classes_]
     titled_col_names = ['{}___{}'.format(col_title, norm_name) for
                         norm_name in normed_col_names]
+    if sparse:
+        return pd.DataFrame.sparse.from_spmatrix(transformed, columns=titled_col_names)
     bin_cols = pd.DataFrame(transformed, columns=titled_col_names)
     return bin_cols
 
 
+def sparse_columns(df):
+    """the columns of df that are stored sparse
+    :type df: pandas DataFrame
+    :returns: list[str]
+    """
+    return [col_name for col_name, dtype in df.dtypes.items()
+            if isinstance(dtype, pd.SparseDtype)]
+
+
+def densify(df):
+    """df with its sparse columns made dense, df itself if it has none
+    :type df: pandas DataFrame
+    :returns: pandas DataFrame
+    """
+    sparse_col_names = sparse_columns(df)
+    if not sparse_col_names:
+        return df
+    dense_df = df.copy()
+    for col_name in sparse_col_names:
+        dense_df[col_name] = df[col_name].sparse.to_dense()
+    return dense_df
+
+
+def model_matrix(X, allow_sparse):
+    """
+    X as the classifiers take it. A DataFrame with sparse columns becomes a
+    CSR matrix, with the columns in the same order, if the classifier takes
+    sparse input, and is made dense if it does not. Anything else is
+    returned as is.
+    :param X: the features
+    :param allow_sparse: whether the classifier takes sparse input
+    :type X: pandas DataFrame or numpy array
+    :type allow_sparse: bool
+    :returns: X, a CSR matrix, or X made dense
+    """
+    if not isinstance(X, pd.DataFrame):
+        return X
+    sparse_col_names = sparse_columns(X)
+    if not sparse_col_names:
+        return X
+    if not allow_sparse:
+        return densify(X)
+    sparse_col_set = set(sparse_col_names)
+    dense_col_names = [col_name for col_name in X.columns
+                       if col_name not in sparse_col_set]
+    blocks = []
+    if dense_col_names:
+        blocks.append(scipy.sparse.csc_matrix(X[dense_col_names].values.astype(float)))
+    blocks.append(X[sparse_col_names].sparse.to_coo().tocsc())
+    matrix = scipy.sparse.hstack(blocks, format='csc')
+    # put the columns back in the order of X
+    positions = {col_name: position for position, col_name
+                 in enumerate(dense_col_names + sparse_col_names)}
+    return matrix[:, [positions[col_name] for col_name in X.columns]].tocsr()
+
+
 def min_max_scale_df(df):
     """
     scale a dataframe to the smallest element is 0, and largest 1.
@@ -238,24 +316,57 @@ imp_fun = {
 }
 
 
-def make_imputed_col(colname, col, stuterm_df, scale):
+# imputation functions that work on a DataFrame of many columns at once
+batch_imp_funs = frozenset([impute_zeros, impute_iden, impute_mean])
+# imputation functions that can make sparse columns
+sparse_imp_funs = frozenset([cat_binarizer])
+
+
+def make_imputed_df(df, stuterm_df, scale, unscaled_cols=(), sparse=False):
     """
-    Looks up colname in a the imp_fun dict and applys
-    imputation on col, passing stuterm_df in case needed
-    :param colname: the columns name
-    :type colname: str
-    :param col: the column data
-    :type col: pandas.Series
-    :param stuterm_df: the index of the column
+    Looks up every column of df in the imp_fun dict and applies its
+    imputation, passing stuterm_df in case needed. Columns with the same
+    imputation are imputed together, as are the columns being scaled.
+    :param df: the columns to impute
+    :type df: pandas.DataFrame
+    :param stuterm_df: the index of the columns
     :type stuterm_df: pandas.DataFrame
     :param scale: which normalization function to use. Or none.
     :type scale: str like "l1", "l2", or None
-    :returns: pandas.Dataframe of varying column width
+    :param unscaled_cols: columns to leave unscaled, like the label
+    :type unscaled_cols: list[str]
+    :param sparse: keep one hot encoded columns sparse. They are 0 or 1
+                   already so they are not scaled.
+    :type sparse: bool
+    :returns: pandas.Dataframe, categorical columns exploded in place
     """
-    imputed = imp_fun[colname](col, stuterm_df)
-    imputed_df = pd.DataFrame(imputed)  # make sure return type is dataframe
-    if not scale:  # i.e norm type is false
-        return imputed_df
-    else:
-        scaled_df = min_max_scale_df(imputed_df)
-        return scaled_df
+    strategy_cols = {}
+    for col_name in df.columns:
+        strategy_cols.setdefault(imp_fun[col_name], []).append(col_name)
+
+    imputed_groups = []
+    imputed_col_names = {}
+    for strategy, col_names in strategy_cols.items():
+        if strategy in batch_imp_funs:
+            imputed_groups.append(strategy(df[col_names], stuterm_df))
+            imputed_col_names.update((col_name, [col_name]) for col_name in col_names)
+        else:
+            for col_name in col_names:
+                if sparse and strategy in sparse_imp_funs:
+                    imputed_col = strategy(df[col_name], stuterm_df, sparse=True)
+                else:
+                    imputed_col = pd.DataFrame(strategy(df[col_name], stuterm_df))
+                imputed_col.index = df.index
+                imputed_groups.append(imputed_col)
+                imputed_col_names[col_name] = list(imputed_col.columns)
+    imputed_df = pd.concat(imputed_groups, axis=1)
+    ordered_col_names = [imputed_col_name for col_name in df.columns
+                         for imputed_col_name in imputed_col_names[col_name]]
+    unscaled_col_set = set(unscaled_cols) | set(sparse_columns(imputed_df))
+    scaled_cols = [col_name for col_name in imputed_df.columns
+                   if col_name not in unscaled_col_set]
+    if scale and scaled_cols:
+        scaled_df = min_max_scale_df(imputed_df[scaled_cols])
+        scaled_df.index = df.index
+        imputed_df = pd.concat([imputed_df.drop(scaled_cols, axis=1), scaled_df], axis=1)
+    return imputed_df[ordered_col_names]
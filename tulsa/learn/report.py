@@ -1,4 +1,5 @@
 from tulsa.learn.feature_groups import feature_groups
+from tulsa.learn import prepare
 import pandas as pd
 import numpy as np
 from datetime import datetime
@@ -46,7 +47,7 @@ def make_stu_feat_df(label_feature_df, stuterm_df, feats):
         return None
     top_feats = list(feats_action_sorted_top['feat_name'])
     logging.info('top feats were %s', top_feats)
-    df_top_feats = label_feature_df[top_feats]
+    df_top_feats = prepare.densify(label_feature_df[top_feats])
     # find the column for which the students are most deficient
     # in highly effective habits of...
     most_room = df_top_feats.idxmin(axis=1)
@@ -0,0 +1,55 @@
+"""
+A single background writer for the results schema.
+
+Model fitting hands every result table to the writer and carries on, the
+writer thread uploads them one at a time in the order they were given.
+"""
+import logging
+import queue
+import threading
+
+
+class ResultWriter(object):
+    """ Serializes result uploads through one background thread.
+
+    :param write_fun: called as write_fun(df, table_name) for every upload
+    :type write_fun: function
+    """
+    def __init__(self, write_fun):
+        self.write_fun = write_fun
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            df, table_name = item
+            if self.error is not None:
+                continue  # something already failed, don't write the rest
+            try:
+                self.write_fun(df, table_name)
+            except Exception as e:
+                logging.exception('failed to write to results.%s', table_name)
+                self.error = e
+
+    def put(self, df, table_name):
+        """Queue df to be uploaded to table_name
+        :param df: the table to upload
+        :param table_name: the table name in the 'results' schema
+        :type df: pandas DataFrame
+        :type table_name: str
+        """
+        self.queue.put((df, table_name))
+
+    def close(self):
+        """Wait for everything queued to be written.
+        Raises the first error the writer hit, if any.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,62 @@
+"""
+Per-run cache of the source tables that features are generated from.
+
+Most features read the same few clean_data tables. The cache pulls each
+table (projected to the union of the columns the features need) or each
+distinct query once, and hands every feature its own copy of the result.
+It is safe to share between threads: a query asked for by several features
+at once is still only run once.
+"""
+import logging
+import threading
+import pandas as pd
+
+
+class SourceCache(object):
+    """ A cache of DataFrames read from the database, keyed by query.
+
+    :param table_columns: the columns to pull for each cacheable table
+    :type table_columns: dict[str, list[str]]
+    """
+    def __init__(self, table_columns):
+        self.table_columns = table_columns
+        self.frames = {}
+        self.lock = threading.Lock()
+        self.query_locks = {}
+
+    def read_table(self, table_name, engine):
+        """Read table_name projected to its declared columns, once per run
+        :param table_name: schema qualified table name, like clean_data.map
+        :param engine: a db engine to use
+        :type table_name: str
+        :type engine: sqlalchemy engine
+        :returns: pandas DataFrame -- a copy of the cached table
+        """
+        cols_str = ', '.join(self.table_columns[table_name])
+        table_sql = """SELECT {cols_str}
+                       FROM {table_name}""".format(cols_str=cols_str,
+                                                   table_name=table_name)
+        return self.read_query(table_sql, engine)
+
+    def read_query(self, sql, engine):
+        """Run sql the first time it is asked for, and serve it from memory after
+        :param sql: the query to run
+        :param engine: a db engine to use
+        :type sql: str
+        :type engine: sqlalchemy engine
+        :returns: pandas DataFrame -- a copy of the cached query result
+        """
+        with self.lock:
+            query_lock = self.query_locks.setdefault(sql, threading.Lock())
+        with query_lock:
+            if sql not in self.frames:
+                logging.debug('source cache miss, reading: %s', sql)
+                self.frames[sql] = pd.read_sql_query(sql, engine)
+            return self.frames[sql].copy()
+
+    def clear(self):
+        """Drop everything cached, at the end of a run
+        """
+        with self.lock:
+            self.frames = {}
+            self.query_locks = {}
@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-from sklearn.cross_validation import train_test_split
+from sklearn.model_selection import train_test_split
 
 
 def make_splits(split_strategy, stuterm_df, label_feature_df, engine):